@@ -0,0 +1,331 @@
+import os
+import time
+import sqlite3
+import argparse
+from datetime import date
+import metrics
+from journal import Journal
+from category_tree import CategoryTree
+
+# Moves closed months of history out of the live databases the lanes write
+# to and into one archive file per month, <dir>/<YYYY-MM>.db, so the live
+# files only hold recent months and stay small enough to sit in the page cache.
+#
+# A month is moved in batches. Each batch is one transaction on the live
+# connection with the month's file attached: the rows are copied with INSERT
+# OR IGNORE, so a batch repeated after a crash adds nothing twice, then
+# deleted from the live table. Sales lines go with their sale, and leave the
+# category sales totals as they were (CategoryTree.archive_sales_items);
+# each customer's archived transactions are summed in ArchivedTransactionTotals
+# so rfm.py still scores their whole history. The journal gets one entry per
+# batch for the rows deleted, and one per row of those running totals once
+# the run has collapsed its updates to them (Journal.collapse), so archiving
+# does not grow the file it empties. The space freed is handed back
+# with incremental VACUUM a step at a time, so lanes are never locked out for
+# long.
+#
+# Historical queries read <table>_history temp views: the live table UNION ALL
+# the same table in each archived month the query's period touches. SQLite
+# attaches at most ten files to a connection, so one view covers up to that
+# many months; pass since/until to attach_history to pick them.
+
+ARCHIVE_DIR = "archive"
+KEEP_MONTHS = 3  # The current month and the two before it stay live
+BATCH_ROWS = 5_000  # Rows per archive transaction; about a quarter of a second of write lock for a batch of sales
+VACUUM_STEP_PAGES = 2_000  # Pages freed per incremental VACUUM step
+HISTORY_SCHEMA_PREFIX = "history_"
+
+# (table, key, date column, child table archived with each row or None, archive index columns)
+ARCHIVED_TABLES = [
+    ("Transactions", "TransactionID", "TransactionDate", None, ("CustomerID, TransactionDate", "TransactionDate")),
+    ("RewardRedemption", "RedemptionID", "RedemptionDate", None, ("CustomerID", "RedemptionDate")),
+    ("sales", "sale_id", "sale_date", "sales_items", ("sale_date", "basket")),
+]
+CHILD_INDEXES = {"sales_items": ("sale_id", "product_id")}
+SUMMARY_TABLES = ("archived_product_sales", "ArchivedTransactionTotals")  # Running totals of what was archived
+HISTORY_TABLES = ("Transactions", "RewardRedemption", "sales", "sales_items")
+
+# A batch is the keys in temp.archive_batch; the rows (and child rows) keyed IN_BATCH_SQL are copied and then deleted
+BATCH_SQL = """INSERT INTO temp.archive_batch (id) SELECT {key} FROM main.{table}
+               WHERE {date_column} >= ? AND {date_column} < ? LIMIT ?"""
+IN_BATCH_SQL = "IN (SELECT id FROM temp.archive_batch)"
+COPY_SQL = "INSERT OR IGNORE INTO archive_month.{table} ({columns}) SELECT {columns} FROM main.{table} WHERE {where}"
+
+
+def month_file(directory, month):
+    return os.path.join(directory, f"{month}.db")
+
+
+def history_schema(month):
+    """Name a month's archive file is attached under by attach_history."""
+    return HISTORY_SCHEMA_PREFIX + month.replace("-", "_")
+
+
+def _next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def cutoff(keep_months=KEEP_MONTHS, today=None):
+    """First day of the oldest month that stays live, as YYYY-MM-DD; everything dated before it is archived."""
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - (keep_months - 1)
+    return f"{months // 12:04d}-{months % 12 + 1:02d}-01"
+
+
+def archived_months(directory=ARCHIVE_DIR):
+    """YYYY-MM of every month with an archive file, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-3] for name in os.listdir(directory)
+                  if len(name) == 10 and name.endswith(".db") and name[4] == "-")
+
+
+def _columns(conn, schema, table):
+    """(name, declared type, primary key position) for each column, or [] if the table does not exist."""
+    return [(row[1], row[2], row[5]) for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+class Archiver:
+    """Moves closed months of Transactions, RewardRedemption and sales (with sales_items) out of a live database.
+
+    Works on whichever of those tables the connection's database has, so the
+    same class archives the loyalty and the inventory database. Every month's
+    tables, from either database, go in the same archive file.
+    """
+
+    def __init__(self, conn, directory=ARCHIVE_DIR, batch_rows=BATCH_ROWS):
+        self.conn = conn
+        self.directory = directory
+        self.batch_rows = batch_rows
+        os.makedirs(directory, exist_ok=True)
+        self.tables = [spec for spec in ARCHIVED_TABLES if _columns(conn, "main", spec[0])]
+        self.category_tree = CategoryTree(conn) if any(spec[3] == "sales_items" for spec in self.tables) else None
+        self.journal = Journal(conn, install=False)  # Archived rows are journaled as ranges, not one entry each
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+
+    def months(self, before):
+        """YYYY-MM of each month with live rows dated before `before` (YYYY-MM-DD), oldest first."""
+        months = set()
+        for table, _, date_column, _, _ in self.tables:
+            months.update(row[0] for row in self.conn.execute(
+                f"SELECT DISTINCT substr({date_column}, 1, 7) FROM {table} WHERE {date_column} < ?", (before,)))
+        return sorted(months)
+
+    def archive(self, before):
+        """Archive every month dated before `before` (YYYY-MM-DD). Returns {table: rows moved}."""
+        moved = {}
+        start_seq = self.journal.last_seq()
+        for month in self.months(before):
+            for table, rows in self.archive_month(month).items():
+                moved[table] = moved.get(table, 0) + rows
+        self.journal.collapse(start_seq, SUMMARY_TABLES)
+        return moved
+
+    @metrics.timed("archive.archive_month")
+    def archive_month(self, month):
+        """Move one month (YYYY-MM) into its archive file, a batch per transaction. Returns {table: rows moved}."""
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.conn.execute("ATTACH DATABASE ? AS archive_month", (month_file(self.directory, month),))
+        try:
+            moved = {}
+            for table, key, date_column, child, indexes in self.tables:
+                self._ensure_table(table, indexes)
+                if child:
+                    self._ensure_table(child, CHILD_INDEXES[child])
+                while True:
+                    rows, child_rows = self._archive_batch(table, key, date_column, child, month)
+                    moved[table] = moved.get(table, 0) + rows
+                    if child:
+                        moved[child] = moved.get(child, 0) + child_rows
+                    if rows < self.batch_rows:
+                        break
+            return moved
+        finally:
+            self.conn.execute("DETACH DATABASE archive_month")
+
+    def _ensure_table(self, table, indexes):
+        """Create the table in the attached month file, or add any columns the live table has gained since."""
+        live = _columns(self.conn, "main", table)
+        archived = {name for name, _, _ in _columns(self.conn, "archive_month", table)}
+        if not archived:
+            keys = [name for name, _, pk in sorted(live, key=lambda column: column[2]) if pk]
+            self.conn.execute(f"CREATE TABLE archive_month.{table} ("
+                              + ", ".join(f"{name} {kind}" for name, kind, _ in live)
+                              + f", PRIMARY KEY ({', '.join(keys)}))")
+            for columns in indexes:
+                name = f"idx_{table}_{columns.replace(', ', '_')}"
+                self.conn.execute(f"CREATE INDEX archive_month.{name} ON {table} ({columns})")
+        else:
+            for name, kind, _ in live:
+                if name not in archived:
+                    self.conn.execute(f"ALTER TABLE archive_month.{table} ADD COLUMN {name} {kind}")
+        self.conn.commit()
+
+    def _archive_batch(self, table, key, date_column, child, month):
+        """Move up to batch_rows rows of one month in one transaction. Returns (rows, child rows) moved."""
+        start, end = f"{month}-01", f"{_next_month(month)}-01"
+        in_batch = IN_BATCH_SQL
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            rows = cursor.execute(BATCH_SQL.format(key=key, table=table, date_column=date_column),
+                                  (start, end, self.batch_rows)).rowcount
+            child_rows = 0
+            if rows:
+                self._copy(cursor, table, f"{key} {in_batch}")
+                if child:
+                    self._copy(cursor, child, f"{key} {in_batch}")
+                    child_rows = self.category_tree.archive_sales_items(f"{key} {in_batch}")
+                if table == "Transactions":
+                    cursor.execute(f"""
+                        INSERT INTO ArchivedTransactionTotals (CustomerID, TransactionCount, TotalAmountPence,
+                                                               PointsEarned, LastTransactionDate)
+                        SELECT CustomerID, SUM(IFNULL(TotalAmountPence, 0) >= 0),  -- Refunds are not visits
+                               COALESCE(SUM(TotalAmountPence), 0), COALESCE(SUM(PointsEarned), 0),
+                               MAX(TransactionDate)
+                        FROM main.Transactions WHERE TransactionID {in_batch} AND CustomerID IS NOT NULL GROUP BY CustomerID
+                        ON CONFLICT (CustomerID) DO UPDATE SET
+                            TransactionCount = TransactionCount + excluded.TransactionCount,
+                            TotalAmountPence = TotalAmountPence + excluded.TotalAmountPence,
+                            PointsEarned = PointsEarned + excluded.PointsEarned,
+                            LastTransactionDate = MAX(LastTransactionDate, excluded.LastTransactionDate)
+                    """)
+                self.journal.delete_archived(cursor, table, f"{key} {in_batch}")
+                cursor.execute("DELETE FROM temp.archive_batch")
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        return rows, child_rows
+
+    def _copy(self, cursor, table, where):
+        columns = ", ".join(name for name, _, _ in _columns(self.conn, "main", table))
+        cursor.execute(COPY_SQL.format(table=table, columns=columns, where=where))
+
+    @metrics.timed("archive.vacuum")
+    def vacuum(self, step_pages=VACUUM_STEP_PAGES):
+        """Return free pages to the file system, step_pages per transaction. Returns the number of pages freed.
+
+        A database created before incremental auto-vacuum was switched on is
+        converted with one full VACUUM the first time.
+        """
+        if self.conn.in_transaction:
+            self.conn.commit()
+        free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("VACUUM")
+            return free
+        remaining = free
+        while remaining:
+            self.conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+            remaining = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return free
+
+
+def history_months(directory=ARCHIVE_DIR, since=None, until=None):
+    """YYYY-MM of every archived month overlapping [since, until), oldest first."""
+    return [month for month in archived_months(directory)
+            if (until is None or f"{month}-01" < until) and (since is None or f"{_next_month(month)}-01" > since)]
+
+
+def _attached(conn):
+    """Databases attached to a connection. main and temp do not count, and temp is only listed once it is used."""
+    return sum(1 for _, schema, _ in conn.execute("PRAGMA database_list") if schema not in ("main", "temp"))
+
+
+def history_schemas(conn, directory=ARCHIVE_DIR, since=None, until=None):
+    """Yield "main", then the schema of each archived month overlapping [since, until).
+
+    For jobs that read every month of a long period one database at a time:
+    the months are attached as many at once as the connection allows and
+    detached again before the next lot, so finish with a schema's queries
+    before asking for the next one.
+    """
+    yield "main"
+    months = history_months(directory, since, until)
+    attached = _attached(conn)
+    at_once = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - attached
+    for group in (months[index:index + at_once] for index in range(0, len(months), at_once)):
+        for month in group:
+            conn.execute(f"ATTACH DATABASE ? AS {history_schema(month)}", (month_file(directory, month),))
+        for month in group:
+            yield history_schema(month)
+        for month in group:
+            conn.execute(f"DETACH DATABASE {history_schema(month)}")
+
+
+def attach_history(conn, directory=ARCHIVE_DIR, since=None, until=None):
+    """Create <table>_history temp views over the live tables and every archived month overlapping [since, until).
+
+    since and until are ISO dates; either can be left open. Returns the
+    months attached. Raises ValueError if the period touches more archived
+    months than the connection can attach.
+    """
+    detach_history(conn)
+    months = history_months(directory, since, until)
+    attached = _attached(conn)
+    free = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - attached
+    if len(months) > free:
+        raise ValueError(f"The period touches {len(months)} archived months but only {free} can be attached at once. "
+                         f"Please narrow it.")
+    for month in months:
+        conn.execute(f"ATTACH DATABASE ? AS {history_schema(month)}",
+                     (month_file(directory, month),))
+
+    for table in HISTORY_TABLES:
+        live = [name for name, _, _ in _columns(conn, "main", table)]
+        if not live:
+            continue
+        selects = [f"SELECT {', '.join(live)} FROM main.{table}"]
+        for month in months:
+            schema = history_schema(month)
+            archived = {name for name, _, _ in _columns(conn, schema, table)}
+            if archived:
+                selects.append(f"SELECT {', '.join(name if name in archived else f'NULL AS {name}' for name in live)} "
+                               f"FROM {schema}.{table}")
+        conn.execute(f"CREATE TEMP VIEW {table}_history AS " + " UNION ALL ".join(selects))
+    return months
+
+
+def detach_history(conn):
+    """Drop the <table>_history views and detach the archived months behind them."""
+    for table in HISTORY_TABLES:
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}_history")
+    for _, schema, _ in conn.execute("PRAGMA database_list").fetchall():
+        if schema.startswith(HISTORY_SCHEMA_PREFIX):
+            conn.execute(f"DETACH DATABASE {schema}")
+
+
+if __name__ == "__main__":
+    from data_access import InventorySystem, DataLayer, INVENTORY_DB, LOYALTY_DB
+
+    parser = argparse.ArgumentParser(description="Archive closed months of history and list the monthly archives.")
+    parser.add_argument("command", choices=("run", "list"))
+    parser.add_argument("--inventory-db", default=INVENTORY_DB)
+    parser.add_argument("--loyalty-db", default=LOYALTY_DB)
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="directory holding the monthly archive files")
+    parser.add_argument("--keep-months", type=int, default=KEEP_MONTHS, help="run: recent months that stay live")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="run: rows moved per transaction")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for month in archived_months(args.dir):
+            print(f"{month}  {os.path.getsize(month_file(args.dir, month)):>14,} bytes")
+    else:
+        before = cutoff(args.keep_months)
+        inventory, data_layer = InventorySystem(args.inventory_db), DataLayer(args.loyalty_db)
+        for db_file, conn in ((args.inventory_db, inventory.conn), (args.loyalty_db, data_layer.conn)):
+            conn.execute("PRAGMA busy_timeout = 30000")  # Lanes keep selling while batches go
+            size = os.path.getsize(db_file)
+            began = time.perf_counter()
+            archiver = Archiver(conn, args.dir, args.batch_rows)
+            moved = archiver.archive(before)
+            pages = archiver.vacuum()
+            print(f"{db_file}: archived before {before} in {time.perf_counter() - began:.1f}s "
+                  f"({', '.join(f'{rows} {table}' for table, rows in moved.items()) or 'nothing to move'}); "
+                  f"{pages} pages freed, {size:,} -> {os.path.getsize(db_file):,} bytes")
+        inventory.close_connection()
+        data_layer.close()
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+import dates
+import metrics
+from journal import Journal
+from category_tree import CategoryTree
+from checkout_commit import LOYALTY_SCHEMA
+from data_access import connect_read_only
+
+# Online backups of the inventory and loyalty databases, and point-in-time
+# restore from them.
+#
+# A backup copies each live file with the SQLite backup API a few pages at a
+# time. A step only holds a read lock for as long as it takes to copy its
+# pages, and lanes waiting to commit get in between steps, so while the store
+# is quiet a backup holds nobody up. A commit by another lane during the copy
+# makes SQLite start it again, and under steady traffic a copy in small steps
+# would never finish, so after a restart the file is copied again in one step:
+# the longest a lane is held up is one copy of the whole file (about 40 ms for
+# a 17 MB file). Going up in smaller multiples was measured to hold lanes up
+# for longer in total, since every step is another chance to collide with a
+# commit. The databases are not switched to WAL, where a copy could read from
+# a snapshot without holding anyone up, because a checkout's commit across the
+# inventory and loyalty files is only atomic in rollback mode.
+#
+# Each database also has a journal of every row change (journal.py). Backups
+# are taken one file after the other, so they are not consistent with each
+# other on their own. A restore copies a backup set and replays both journals
+# up to a restore point, a marker written into both journals in one
+# transaction, which gives two files that agree with each other at that
+# moment. The scheduler writes a restore point every minute and one after
+# every backup, so a restore lands on the last whole minute before the time
+# asked for.
+#
+# Backup sets are directories <dir>/<YYYYMMDDTHHMMSS>/ holding inventory.db,
+# loyalty.db and manifest.json. A set is written under a .tmp name and renamed
+# once complete. When old sets are pruned, the journals are trimmed to what the
+# oldest remaining set still needs.
+
+BACKUP_DIR = "backups"
+STEP_PAGES = 256  # Pages copied per step, 1 MB of 4 KB pages: a couple of milliseconds of read lock
+STEP_PAUSE = 0.005  # Seconds between steps, in which waiting lanes commit
+BACKUP_INTERVAL = 3600  # Seconds between scheduled backups
+MARK_INTERVAL = 60  # Seconds between scheduled restore points
+KEEP_BACKUPS = 24
+MANIFEST = "manifest.json"
+
+
+class _Restarted(Exception):
+    pass
+
+
+class OnlineBackup:
+    """Copies one live database to a file in small steps of the SQLite backup API."""
+
+    def __init__(self, db_file, step_pages=STEP_PAGES, pause=STEP_PAUSE, timeout=30.0):
+        self.db_file = db_file
+        self.step_pages = step_pages
+        self.pause = pause
+        self.timeout = timeout
+
+    @metrics.timed("backup.copy")
+    def copy(self, target):
+        """Copy the database to target. Returns the pages, steps, restarts, longest step and seconds taken.
+
+        A step's time includes any wait for a lane to finish committing first.
+        """
+        stats = {"pages": 0, "steps": 0, "restarts": 0, "longest_step_ms": 0.0}
+        step_pages = self.step_pages
+        source = metrics.connect(self.db_file, timeout=self.timeout)
+        destination = sqlite3.connect(target)
+        began = time.perf_counter()
+        try:
+            while True:
+                last_remaining, step_began = None, time.perf_counter()
+
+                def progress(status, remaining, total):
+                    nonlocal last_remaining, step_began
+                    stats["steps"] += 1
+                    stats["pages"] = total
+                    stats["longest_step_ms"] = max(stats["longest_step_ms"], (time.perf_counter() - step_began) * 1000)
+                    if last_remaining is not None and remaining > last_remaining:
+                        raise _Restarted  # Another connection wrote to the database; SQLite went back to the start
+                    last_remaining = remaining
+                    time.sleep(self.pause)
+                    step_began = time.perf_counter()
+
+                try:
+                    source.backup(destination, pages=step_pages, progress=progress, sleep=self.pause)
+                    break
+                except _Restarted:
+                    stats["restarts"] += 1
+                    step_pages = -1  # The database is busy: copy it all in one go
+        finally:
+            source.close()
+            destination.close()
+        stats["seconds"] = time.perf_counter() - began
+        return stats
+
+
+def _last_seq(db_file):
+    """The last journal entry a database file holds."""
+    conn = sqlite3.connect(db_file)
+    try:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+        return row[0] if row else 0
+    finally:
+        conn.close()
+
+
+def mark_restore_point(inventory_db, loyalty_db, name=None):
+    """Write a restore point to both journals in one transaction. Returns (name, recorded_at)."""
+    recorded_at = dates.now()
+    name = name or f"point {recorded_at}"
+    conn = metrics.connect(inventory_db, timeout=30.0, isolation_level=None)
+    try:
+        conn.execute(f"ATTACH DATABASE ? AS {LOYALTY_SCHEMA}", (loyalty_db,))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for schema in ("main", LOYALTY_SCHEMA):
+                conn.execute(f"INSERT INTO {schema}.journal (op, row_key, recorded_at) VALUES ('M', ?, ?)",
+                             (name, recorded_at))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return name, recorded_at
+
+
+def take_backup(inventory_db, loyalty_db, directory=BACKUP_DIR, step_pages=STEP_PAGES, pause=STEP_PAUSE):
+    """Copy both databases into a new backup set and mark a restore point after them. Returns its manifest."""
+    name = time.strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        raise FileExistsError(f"Backup set {path} already exists.")
+    os.makedirs(path + ".tmp")
+    manifest = {"name": name, "databases": {}}
+    for key, db_file in (("inventory", inventory_db), ("loyalty", loyalty_db)):
+        target = os.path.join(path + ".tmp", f"{key}.db")
+        stats = OnlineBackup(db_file, step_pages, pause).copy(target)
+        stats["journal_seq"] = _last_seq(target)
+        manifest["databases"][key] = stats
+    manifest["restore_point"], manifest["recorded_at"] = mark_restore_point(inventory_db, loyalty_db, f"backup {name}")
+    with open(os.path.join(path + ".tmp", MANIFEST), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def list_backups(directory=BACKUP_DIR):
+    """Manifests of the complete backup sets in directory, oldest first."""
+    manifests = []
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            manifest_file = os.path.join(directory, name, MANIFEST)
+            if not name.endswith(".tmp") and os.path.exists(manifest_file):
+                with open(manifest_file) as f:
+                    manifests.append(json.load(f))
+    return manifests
+
+
+def prune(inventory_db, loyalty_db, directory=BACKUP_DIR, keep=KEEP_BACKUPS):
+    """Remove all but the newest keep backup sets and trim the journals to what the oldest one left needs.
+
+    Returns the number of journal entries removed from each database.
+    """
+    manifests = list_backups(directory)
+    for manifest in manifests[:-keep]:
+        shutil.rmtree(os.path.join(directory, manifest["name"]))
+    manifests = manifests[-keep:]
+    trimmed = {}
+    if manifests:
+        for key, db_file in (("inventory", inventory_db), ("loyalty", loyalty_db)):
+            conn = metrics.connect(db_file, timeout=30.0)
+            try:
+                trimmed[key] = Journal(conn).trim(manifests[0]["databases"][key]["journal_seq"])
+            finally:
+                conn.close()
+    return trimmed
+
+
+@metrics.timed("backup.restore")
+def restore(out_dir, inventory_db, loyalty_db, directory=BACKUP_DIR, point=None, until=None):
+    """Rebuild both databases in out_dir as they were at a restore point, from a backup set and the live journals.
+
+    The point is the one called point, else the last one at or before until
+    (a date and time), else the latest. The backup set used is the newest one
+    taken before it. The live databases are only read. Returns a summary.
+    """
+    journals = {"inventory": Journal(connect_read_only(inventory_db), install=False),
+                "loyalty": Journal(connect_read_only(loyalty_db), install=False)}
+    try:
+        if point is None:
+            until = dates.parse_timestamp(until) if until else None
+            points = [name for _, name, recorded_at in journals["inventory"].restore_points()
+                      if until is None or recorded_at <= until]
+            if not points:
+                raise ValueError("There is no restore point at or before that time.")
+            point = points[-1]
+        seqs = {key: journal.restore_point(point) for key, journal in journals.items()}
+        if None in seqs.values():
+            raise ValueError(f"Restore point {point!r} is not in both journals.")
+
+        bases = [manifest for manifest in list_backups(directory)
+                 if all(manifest["databases"][key]["journal_seq"] <= seq for key, seq in seqs.items())]
+        if not bases:
+            raise ValueError(f"There is no backup set from before restore point {point!r}.")
+        base = bases[-1]
+
+        os.makedirs(out_dir, exist_ok=True)
+        summary = {"restore_point": point, "backup": base["name"], "entries": {}}
+        for key, db_file in (("inventory", inventory_db), ("loyalty", loyalty_db)):
+            base_seq = base["databases"][key]["journal_seq"]
+            if journals[key].first_seq() > base_seq + 1:
+                raise ValueError(f"The {key} journal has been trimmed past backup {base['name']}.")
+            target = os.path.join(out_dir, os.path.basename(db_file))
+            if os.path.exists(target):
+                raise ValueError(f"{target} already exists; refusing to overwrite it.")
+            shutil.copyfile(os.path.join(directory, base["name"], f"{key}.db"), target)
+            conn = sqlite3.connect(target)
+            try:
+                summary["entries"][key] = Journal(conn).replay(journals[key].entries(base_seq, seqs[key]))
+                # Change feed consumers may have read past the point; they start again from a snapshot
+                conn.execute("DELETE FROM journal_cursors")
+                conn.commit()
+                if key == "inventory":
+                    # The tables triggers keep from the others were not replayed; work them out again
+                    CategoryTree(conn).rebuild()
+                    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'inventory_search'").fetchone():
+                        conn.execute("INSERT INTO inventory_search (inventory_search) VALUES ('rebuild')")
+                        conn.commit()
+                check = conn.execute("PRAGMA quick_check").fetchone()[0]
+                if check != "ok":
+                    raise ValueError(f"Restored {key} database failed its integrity check: {check}")
+            finally:
+                conn.close()
+        return summary
+    finally:
+        for journal in journals.values():
+            journal.conn.close()
+
+
+class BackupScheduler(threading.Thread):
+    """Background thread taking a backup every interval seconds and a restore point every mark_interval."""
+
+    def __init__(self, inventory_db, loyalty_db, directory=BACKUP_DIR, interval=BACKUP_INTERVAL,
+                 mark_interval=MARK_INTERVAL, keep=KEEP_BACKUPS, step_pages=STEP_PAGES, pause=STEP_PAUSE):
+        super().__init__(daemon=True)
+        self.inventory_db = inventory_db
+        self.loyalty_db = loyalty_db
+        self.directory = directory
+        self.interval = interval
+        self.mark_interval = mark_interval
+        self.keep = keep
+        self.step_pages = step_pages
+        self.pause = pause
+        self.stop_event = threading.Event()
+
+    def backup_once(self):
+        manifest = take_backup(self.inventory_db, self.loyalty_db, self.directory, self.step_pages, self.pause)
+        prune(self.inventory_db, self.loyalty_db, self.directory, self.keep)
+        return manifest
+
+    def run(self):
+        next_backup = next_mark = time.monotonic()
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            try:
+                if now >= next_backup:
+                    next_backup, next_mark = now + self.interval, now + self.mark_interval
+                    manifest = self.backup_once()
+                    print(f"Backup {manifest['name']} taken.")
+                elif now >= next_mark:
+                    next_mark = now + self.mark_interval
+                    mark_restore_point(self.inventory_db, self.loyalty_db)
+            except (sqlite3.Error, OSError) as e:
+                # Tried again at the next restore point rather than straight away
+                next_backup = min(next_backup, now + self.mark_interval)
+                metrics.count_error("backup.scheduled")
+                print(f"Scheduled backup deferred: {e}")
+            self.stop_event.wait(max(0.0, min(next_backup, next_mark) - time.monotonic()))
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+if __name__ == "__main__":
+    from data_access import INVENTORY_DB, LOYALTY_DB
+
+    parser = argparse.ArgumentParser(description="Back up the databases online and restore them to a point in time.")
+    parser.add_argument("command", choices=("run", "schedule", "mark", "list", "restore"))
+    parser.add_argument("--inventory-db", default=INVENTORY_DB)
+    parser.add_argument("--loyalty-db", default=LOYALTY_DB)
+    parser.add_argument("--dir", default=BACKUP_DIR, help="directory holding the backup sets")
+    parser.add_argument("--keep", type=int, default=KEEP_BACKUPS, help="run, schedule: backup sets kept")
+    parser.add_argument("--interval", type=float, default=BACKUP_INTERVAL, help="schedule: seconds between backups")
+    parser.add_argument("--mark-interval", type=float, default=MARK_INTERVAL,
+                        help="schedule: seconds between restore points")
+    parser.add_argument("--step-pages", type=int, default=STEP_PAGES, help="pages copied per backup step")
+    parser.add_argument("--pause", type=float, default=STEP_PAUSE, help="seconds between backup steps")
+    parser.add_argument("--point", help="mark: name of the restore point; restore: restore point to restore to")
+    parser.add_argument("--until", help="restore: restore to the last restore point at or before this date and time")
+    parser.add_argument("--out", default="restored", help="restore: directory the restored databases are written to")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        manifest = take_backup(args.inventory_db, args.loyalty_db, args.dir, args.step_pages, args.pause)
+        for key, stats in manifest["databases"].items():
+            print(f"{key}: {stats['pages']} pages in {stats['seconds']:.2f}s, {stats['steps']} steps, "
+                  f"{stats['restarts']} restarts, longest step {stats['longest_step_ms']:.1f} ms")
+        trimmed = prune(args.inventory_db, args.loyalty_db, args.dir, args.keep)
+        print(f"Backup {manifest['name']} taken; journal entries trimmed: {trimmed}")
+    elif args.command == "schedule":
+        scheduler = BackupScheduler(args.inventory_db, args.loyalty_db, args.dir, args.interval, args.mark_interval,
+                                    args.keep, args.step_pages, args.pause)
+        scheduler.start()
+        try:
+            while scheduler.is_alive():
+                scheduler.join(1.0)
+        except KeyboardInterrupt:
+            scheduler.stop()
+    elif args.command == "mark":
+        print("Restore point {!r} written at {}.".format(*mark_restore_point(args.inventory_db, args.loyalty_db, args.point)))
+    elif args.command == "list":
+        for manifest in list_backups(args.dir):
+            print(f"{manifest['name']}  restore point {manifest['restore_point']!r}")
+        journal = Journal(connect_read_only(args.inventory_db), install=False)
+        for seq, name, recorded_at in journal.restore_points()[-20:]:
+            print(f"{recorded_at}  {name}")
+    else:
+        try:
+            summary = restore(args.out, args.inventory_db, args.loyalty_db, args.dir, args.point, args.until)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"Restored to {summary['restore_point']!r} from backup {summary['backup']} in {args.out} "
+              f"({', '.join(f'{count} {key} journal entries' for key, count in summary['entries'].items())}).")
@@ -0,0 +1,144 @@
+from collections import Counter
+import metrics
+
+# SQLite limits the number of ? parameters in one statement, so IN (...)
+# lookups are split into chunks of this size
+_CHUNK_SIZE = 900
+
+CODES_FOR_SQL = "SELECT code FROM barcodes WHERE product_id = ? ORDER BY code"
+# {placeholders} is one ? per product in the chunk
+RESOLVE_SQL = "SELECT product_id, name, price_pence, quantity FROM inventory WHERE product_id IN ({placeholders})"
+
+
+def check_digit(digits):
+    """GS1 mod-10 check digit for the given body digits (everything but the last digit)."""
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        total += int(digit) * (3 if position % 2 == 0 else 1)
+    return str((10 - total % 10) % 10)
+
+
+def normalise_code(raw):
+    """Normalise a scanned or typed code.
+
+    EAN-8 and EAN-13 are kept as is, UPC-A is widened to EAN-13 and GTIN-14
+    with a leading zero is narrowed to EAN-13, so every form of the same
+    barcode maps to one key. 4-5 digit PLU codes (loose produce) have no
+    check digit and are returned unchanged. Raises ValueError for anything else.
+    """
+    code = "".join(ch for ch in str(raw) if not ch.isspace() and ch != "-")
+    if not code.isdigit():
+        raise ValueError(f"Invalid barcode: {raw!r}")
+
+    if len(code) in (4, 5):
+        return code  # PLU
+    if len(code) == 12:
+        code = "0" + code  # UPC-A -> EAN-13
+    elif len(code) == 14 and code.startswith("0"):
+        code = code[1:]  # GTIN-14 -> EAN-13
+    if len(code) not in (8, 13, 14):
+        raise ValueError(f"Invalid barcode length: {raw!r}")
+    if check_digit(code[:-1]) != code[-1]:
+        raise ValueError(f"Invalid barcode check digit: {raw!r}")
+    return code
+
+
+class BarcodeTable:
+    """Maps barcodes and PLU codes to inventory products. A product can have many codes.
+
+    The whole mapping is also held in a dict so that a burst of scans can be
+    resolved without touching the database; it is written through on every
+    add. With a catalogue snapshot, names and prices come from it, as every
+    lane charges the published price, and the table is read again whenever a
+    new catalogue version appears, since other processes add codes along with
+    their products.
+    """
+
+    def __init__(self, conn, catalog=None):
+        self.conn = conn
+        self.catalog = catalog
+        self._create_table()
+        self._load()
+
+    def _load(self):
+        self.catalog_version = self.catalog.version if self.catalog else 0
+        self.codes = dict(self.conn.execute("SELECT code, product_id FROM barcodes"))
+
+    def _check_catalog(self):
+        """Read the codes again if the catalogue has moved on to a new version since they were read."""
+        if self.catalog and self.catalog.current() != self.catalog_version:
+            self._load()
+
+    def _create_table(self):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS barcodes (
+                code TEXT PRIMARY KEY,
+                product_id TEXT NOT NULL,
+                FOREIGN KEY (product_id) REFERENCES inventory(product_id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_barcodes_product_id ON barcodes (product_id)")
+        self.conn.commit()
+
+    def add_barcode(self, code, product_id):
+        """Register a barcode or PLU for a product. Raises ValueError for invalid codes."""
+        code = normalise_code(code)
+        self.conn.execute("INSERT OR REPLACE INTO barcodes (code, product_id) VALUES (?, ?)", (code, product_id))
+        self.conn.commit()
+        self.codes[code] = product_id
+        return code
+
+    def codes_for(self, product_id):
+        """Return every code registered for a product."""
+        cursor = self.conn.execute(CODES_FOR_SQL, (product_id,))
+        return [row[0] for row in cursor]
+
+    def lookup(self, code):
+        """Return the product_id for a single code, or None if it is unknown or invalid."""
+        self._check_catalog()
+        try:
+            return self.codes.get(normalise_code(code))
+        except ValueError:
+            return None
+
+    @metrics.timed("barcodes.resolve_scans")
+    def resolve_scans(self, scanned_codes):
+        """Resolve a burst of scans into cart lines.
+
+        Repeated scans of the same product are merged. Returns a tuple of
+        (lines, rejected) where lines is a list of
+        (product_id, name, quantity, price_pence, stock) in first-scan order and
+        rejected lists the codes that were invalid or unknown. Product details
+        for the whole burst are fetched with one query per chunk of 900 products.
+        """
+        metrics.observe_size("barcodes.scan_burst", len(scanned_codes))
+        self._check_catalog()
+        quantities = Counter()
+        rejected = []
+        for raw in scanned_codes:
+            product_id = self.lookup(raw)
+            if product_id is None:
+                rejected.append(raw)
+            else:
+                quantities[product_id] += 1
+
+        details = {}
+        product_ids = list(quantities)
+        for start in range(0, len(product_ids), _CHUNK_SIZE):
+            chunk = product_ids[start:start + _CHUNK_SIZE]
+            cursor = self.conn.execute(RESOLVE_SQL.format(placeholders=", ".join("?" * len(chunk))), chunk)
+            for product_id, name, price_pence, stock in cursor:
+                product = self.catalog.lookup(product_id) if self.catalog else None
+                if product:
+                    name, price_pence = product[0], product[1]
+                details[product_id] = (name, price_pence, stock)
+
+        lines = []
+        for product_id, quantity in quantities.items():
+            if product_id not in details:
+                rejected.append(product_id)
+                continue
+            name, price_pence, stock = details[product_id]
+            lines.append((product_id, name, quantity, price_pence, stock))
+        return lines, rejected
@@ -0,0 +1,307 @@
+import os
+import mmap
+import time
+import struct
+import zlib
+import argparse
+import sqlite3
+from array import array
+import metrics
+
+# A read-only, array-backed copy of the product catalogue (IDs, names, prices
+# and categories) in a single file that every lane process maps into memory.
+# The operating system shares the mapped pages between processes, so a
+# catalogue of a million products costs its size in memory once, not once per
+# lane. Lookups go through a hash table stored in the file and read straight
+# from the mapping, without building any Python objects up front.
+#
+# Each publish writes a complete new file, catalog-<version>.snap, and then
+# points CURRENT at it with an atomic rename. Readers check CURRENT now and
+# then and switch to the new mapping in one assignment, so a lookup always
+# sees one consistent version. Stock levels change too often to snapshot and
+# are still read from the database.
+#
+# File layout (little-endian): the header, then these sections, each 8-byte aligned:
+#   id_offsets   uint32[count + 1]   product IDs, sorted as SQLite sorts TEXT
+#   id_blob      UTF-8
+#   name_index   uint32[count]       each product's entry in the interned name table
+#   name_offsets uint32[names + 1]
+#   name_blob    UTF-8
+#   prices       int64[count]        pence
+#   categories   int32[count]        0 when the product has no category
+#   id_hash      uint32[slots]       open-addressing table of index + 1 by crc32 of the ID, 0 = empty
+
+MAGIC = b"GCAT"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sIQQIII8Q")  # magic, format, version, source changes, count, names, slots, 8 section offsets
+CURRENT = "CURRENT"
+KEEP_VERSIONS = 2  # Older files are removed when they are no longer the current or previous version
+
+
+def _snapshot_file(directory, version):
+    return os.path.join(directory, f"catalog-{version:08d}.snap")
+
+
+def current_version(directory):
+    """The version CURRENT points at, or 0 if nothing has been published."""
+    try:
+        with open(os.path.join(directory, CURRENT)) as current:
+            return int(current.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _hash_table(id_offsets, id_blob):
+    """Open-addressing table with at least twice as many slots as IDs, so probes are short."""
+    count = len(id_offsets) - 1
+    slots = 1
+    while slots < 2 * count:
+        slots *= 2
+    table, mask = array("I", [0]) * slots, slots - 1
+    for index in range(count):
+        slot = zlib.crc32(id_blob[id_offsets[index]:id_offsets[index + 1]]) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = index + 1
+    return table
+
+
+class CatalogPublisher:
+    """Builds catalogue snapshots from the inventory database.
+
+    Triggers count every change to a product's name, price or category (and
+    every product added or removed) in catalog_changes; publish_if_changed
+    compares that count with the one the current snapshot was built from, so
+    a new version is only written when something a lane would see has changed.
+    """
+
+    def __init__(self, conn, directory):
+        self.conn = conn
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._create_tables()
+
+    def _create_tables(self):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_changes (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                changes INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO catalog_changes (id, changes) VALUES (1, 0)")
+        for name, event in (("catalog_changes_insert", "INSERT"), ("catalog_changes_delete", "DELETE"),
+                            ("catalog_changes_update", "UPDATE OF product_id, name, price_pence, category_id")):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON inventory BEGIN
+                    UPDATE catalog_changes SET changes = changes + 1 WHERE id = 1;
+                END
+            """)
+        self.conn.commit()
+
+    def changes(self):
+        return self.conn.execute("SELECT changes FROM catalog_changes WHERE id = 1").fetchone()[0]
+
+    def publish_if_changed(self):
+        """Publish a new version if products have changed since the current one. Returns the current version."""
+        version = current_version(self.directory)
+        if version:
+            with open(_snapshot_file(self.directory, version), "rb") as snapshot_file:
+                header = _HEADER.unpack(snapshot_file.read(_HEADER.size))
+            if header[3] == self.changes():
+                return version
+        return self.publish()
+
+    @metrics.timed("catalog.publish")
+    def publish(self):
+        """Write the whole catalogue as a new version and make it current. Returns the new version."""
+        # Read in one transaction so the rows and the change count agree
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.conn.execute("BEGIN")
+        try:
+            changes = self.changes()
+            id_offsets, id_blob = array("I", [0]), bytearray()
+            name_index, name_offsets, name_blob = array("I"), array("I", [0]), bytearray()
+            prices, categories = array("q"), array("i")
+            interned = {}
+            for product_id, name, price_pence, category_id in self.conn.execute(
+                    "SELECT product_id, name, price_pence, category_id FROM inventory ORDER BY product_id"):
+                id_blob += product_id.encode()
+                id_offsets.append(len(id_blob))
+                entry = interned.get(name)
+                if entry is None:
+                    entry = interned[name] = len(interned)
+                    name_blob += name.encode()
+                    name_offsets.append(len(name_blob))
+                name_index.append(entry)
+                prices.append(price_pence)
+                categories.append(category_id or 0)
+        finally:
+            self.conn.commit()
+
+        id_hash = _hash_table(id_offsets, id_blob)
+        sections = [id_offsets.tobytes(), bytes(id_blob), name_index.tobytes(), name_offsets.tobytes(),
+                    bytes(name_blob), prices.tobytes(), categories.tobytes(), id_hash.tobytes()]
+        offsets, position = [], _align(_HEADER.size)
+        for section in sections:
+            offsets.append(position)
+            position = _align(position + len(section))
+
+        version = current_version(self.directory) + 1
+        path = _snapshot_file(self.directory, version)
+        with open(path + ".tmp", "wb") as snapshot_file:
+            snapshot_file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, version, changes, len(prices), len(interned),
+                                             len(id_hash), *offsets))
+            for offset, section in zip(offsets, sections):
+                snapshot_file.write(b"\0" * (offset - snapshot_file.tell()))
+                snapshot_file.write(section)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(path + ".tmp", path)
+
+        # The switch readers see: CURRENT names the new version in one rename
+        current = os.path.join(self.directory, CURRENT)
+        with open(current + ".tmp", "w") as current_file:
+            current_file.write(str(version))
+        os.replace(current + ".tmp", current)
+        self._remove_old_versions(version)
+        return version
+
+    def _remove_old_versions(self, version):
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith("catalog-") and file_name.endswith(".snap"):
+                if int(file_name[8:-5]) <= version - KEEP_VERSIONS:
+                    try:
+                        os.remove(os.path.join(self.directory, file_name))
+                    except OSError:
+                        pass  # Still mapped by a reader on Windows; removed after a later publish
+
+
+class _Mapping:
+    """One mapped snapshot version and typed views over its sections."""
+
+    def __init__(self, path):
+        with open(path, "rb") as snapshot_file:
+            self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _HEADER.unpack_from(self.map)
+        magic, file_format, self.version, self.changes, self.count, names, slots = header[:7]
+        if magic != MAGIC or file_format != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a catalogue snapshot this version can read")
+        id_offsets, id_blob, name_index, name_offsets, name_blob, prices, categories, id_hash = header[7:]
+        view = memoryview(self.map)
+        self.id_offsets = view[id_offsets:id_offsets + 4 * (self.count + 1)].cast("I")
+        self.id_blob = id_blob
+        self.name_index = view[name_index:name_index + 4 * self.count].cast("I")
+        self.name_offsets = view[name_offsets:name_offsets + 4 * (names + 1)].cast("I")
+        self.name_blob = name_blob
+        self.prices = view[prices:prices + 8 * self.count].cast("q")
+        self.categories = view[categories:categories + 4 * self.count].cast("i")
+        self.id_hash = view[id_hash:id_hash + 4 * slots].cast("I")
+        self.mask = slots - 1
+
+    def product_id(self, index):
+        return self.map[self.id_blob + self.id_offsets[index]:self.id_blob + self.id_offsets[index + 1]].decode()
+
+    def name(self, index):
+        entry = self.name_index[index]
+        return self.map[self.name_blob + self.name_offsets[entry]:self.name_blob + self.name_offsets[entry + 1]].decode()
+
+    def find(self, product_id):
+        """Index of product_id through the hash table, or -1."""
+        key, id_offsets, id_blob, data, id_hash, mask = (product_id.encode(), self.id_offsets, self.id_blob, self.map,
+                                                         self.id_hash, self.mask)
+        slot = zlib.crc32(key) & mask
+        entry = id_hash[slot]
+        while entry:
+            index = entry - 1
+            if data[id_blob + id_offsets[index]:id_blob + id_offsets[index + 1]] == key:
+                return index
+            slot = (slot + 1) & mask
+            entry = id_hash[slot]
+        return -1
+
+
+class CatalogSnapshot:
+    """Read-only view of the current catalogue snapshot, shared by every process that maps it.
+
+    refresh() switches to a newer version if one has been published; lookups
+    call it at most once every check_interval seconds.
+    """
+
+    def __init__(self, directory, check_interval=1.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._mapping = None
+        self._checked_at = 0.0
+        self.refresh()
+
+    @property
+    def version(self):
+        return self._mapping.version if self._mapping else 0
+
+    def __len__(self):
+        return self._mapping.count if self._mapping else 0
+
+    def refresh(self):
+        """Map the current version if it is newer than the one in use. Returns True if it switched."""
+        self._checked_at = time.monotonic()
+        version = current_version(self.directory)
+        if version <= self.version:
+            return False
+        # Lookups already running keep the old mapping; it is unmapped when no longer referenced
+        self._mapping = _Mapping(_snapshot_file(self.directory, version))
+        return True
+
+    def current(self):
+        """The version in use, switching to a newer one first if check_interval has passed since the last check."""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.refresh()
+        return self.version
+
+    @metrics.timed("catalog.lookup")
+    def lookup(self, product_id):
+        """(name, price_pence, category_id) for a product, or None if it is not in the snapshot."""
+        self.current()
+        mapping = self._mapping  # One version for the whole lookup
+        if mapping is None:
+            return None
+        index = mapping.find(product_id)
+        if index < 0:
+            return None
+        return mapping.name(index), mapping.prices[index], mapping.categories[index] or None
+
+    def products(self):
+        """Yield (product_id, name, price_pence, category_id) for every product, in ID order."""
+        mapping = self._mapping
+        for index in range(len(self)):
+            yield mapping.product_id(index), mapping.name(index), mapping.prices[index], mapping.categories[index] or None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish or inspect the shared catalogue snapshot.")
+    parser.add_argument("command", choices=("publish", "info", "lookup"))
+    parser.add_argument("--db", default="InventorySystem.db", help="inventory database")
+    parser.add_argument("--dir", default="catalog", help="directory the snapshots are published to")
+    parser.add_argument("--force", action="store_true", help="publish: even if nothing has changed")
+    parser.add_argument("--product", help="lookup: product ID")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        conn = sqlite3.connect(args.db)
+        publisher = CatalogPublisher(conn, args.dir)
+        began = time.perf_counter()
+        version = publisher.publish() if args.force else publisher.publish_if_changed()
+        print(f"Catalogue version {version} is current ({time.perf_counter() - began:.2f}s).")
+        conn.close()
+    else:
+        snapshot = CatalogSnapshot(args.dir)
+        if args.command == "info":
+            size = os.path.getsize(_snapshot_file(args.dir, snapshot.version)) if snapshot.version else 0
+            print(f"Version {snapshot.version}: {len(snapshot)} products, {size:,} bytes.")
+        else:
+            print(snapshot.lookup(args.product or ""))
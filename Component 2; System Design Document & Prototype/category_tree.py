@@ -0,0 +1,372 @@
+import sqlite3
+import argparse
+import money
+import metrics
+from journal import Journal
+
+# Triggers that keep category_closure and category_totals in step with
+# categories, inventory and sales_items. Bulk loaders drop them, load, and
+# then call CategoryTree(conn).rebuild() to recreate and recompute them.
+TRIGGERS = ("categories_closure_check", "categories_closure_insert", "categories_closure_move_check",
+            "categories_closure_move", "categories_closure_delete_check", "categories_closure_delete",
+            "inventory_category_totals_insert", "inventory_category_totals_delete",
+            "inventory_category_totals_update", "inventory_category_totals_recategorise",
+            "sales_items_category_totals_insert", "sales_items_category_totals_delete")
+
+TOTAL_COLUMNS = ("products", "stock_units", "stock_value_pence", "sales_units", "sales_value_pence")
+
+# UPDATE category_totals ... followed by this reaches the totals a category rolls up into, itself included.
+# Joining through the closure rows drives the update from the closure index and then looks each total up by
+# primary key; with "category_id IN (SELECT ...)" the planner scans category_totals when there are only a
+# few categories, on every stock change and sales line.
+ANCESTORS_OF = "FROM category_closure cc WHERE cc.descendant_id = {} AND category_totals.category_id = cc.ancestor_id"
+
+TOTALS_SQL = f"SELECT {', '.join(TOTAL_COLUMNS)} FROM category_totals WHERE category_id = ?"
+TOP_LEVEL_SQL = f"""SELECT c.category_id, c.name, {', '.join(f't.{column}' for column in TOTAL_COLUMNS)} FROM categories c
+                    JOIN category_totals t ON t.category_id = c.category_id
+                    WHERE c.parent_id IS NULL ORDER BY c.name"""
+ROLLUP_SQL = f"""SELECT c.category_id, c.name, {', '.join(f't.{column}' for column in TOTAL_COLUMNS)} FROM category_closure cc
+                 JOIN categories c ON c.category_id = cc.descendant_id
+                 JOIN category_totals t ON t.category_id = cc.descendant_id
+                 WHERE cc.ancestor_id = ? AND cc.depth = 1 ORDER BY c.name"""
+PRODUCTS_IN_SQL = """SELECT i.product_id, i.name, i.price_pence, i.quantity
+                     FROM category_closure cc JOIN inventory i ON i.category_id = cc.descendant_id
+                     WHERE cc.ancestor_id = ? LIMIT ?"""
+
+
+class CategoryTree:
+    """Hierarchical product categories with running stock and sales totals for every subtree.
+
+    The hierarchy is categories.parent_id, with a closure table holding every
+    (ancestor, descendant, depth) pair so a whole subtree is one indexed range
+    read instead of a recursive walk. category_totals holds, for each category,
+    the products, stock units and value, and sales units and value of its
+    whole subtree. Triggers keep both up to date one row at a time: a stock
+    change or sales line only touches the totals of the product's category and
+    its ancestors, so a department roll-up is a single primary key read.
+    Sales archived by archive.py stay in the totals, through per-product
+    sums in archived_product_sales.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._create_tables()
+
+    def _create_tables(self):
+        cursor = self.conn.cursor()
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'category_closure'").fetchone()
+        if "parent_id" not in {row[1] for row in cursor.execute("PRAGMA table_info(categories)")}:
+            cursor.execute("ALTER TABLE categories ADD COLUMN parent_id INTEGER REFERENCES categories(category_id)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS category_closure (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""CREATE INDEX IF NOT EXISTS idx_category_closure_descendant_id
+                          ON category_closure (descendant_id, ancestor_id)""")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS category_totals (
+                category_id INTEGER PRIMARY KEY,
+                products INTEGER NOT NULL DEFAULT 0,
+                stock_units INTEGER NOT NULL DEFAULT 0,
+                stock_value_pence INTEGER NOT NULL DEFAULT 0,
+                sales_units INTEGER NOT NULL DEFAULT 0,
+                sales_value_pence INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # Sales lines moved to the monthly archives still count towards their product's category
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archived_product_sales (
+                product_id TEXT PRIMARY KEY,
+                units INTEGER NOT NULL,
+                value_pence INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_categories_parent_id ON categories (parent_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_category_id ON inventory (category_id)")
+        # Moving a product to another category moves its sales history with it
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_items_product_id ON sales_items (product_id)")
+        self._create_triggers(cursor)
+        self.conn.commit()
+
+        # Categories, products and sales from before the tree existed
+        if not exists:
+            self.rebuild()
+
+    @staticmethod
+    def _create_triggers(cursor):
+        # Hierarchy: a new category links to itself and to every ancestor of its parent
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS categories_closure_check BEFORE INSERT ON categories
+            WHEN new.parent_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM categories WHERE category_id = new.parent_id)
+            BEGIN
+                SELECT RAISE(ABORT, 'parent category does not exist');
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS categories_closure_insert AFTER INSERT ON categories BEGIN
+                INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+                SELECT ancestor_id, new.category_id, depth + 1 FROM category_closure WHERE descendant_id = new.parent_id
+                UNION ALL SELECT new.category_id, new.category_id, 0;
+                INSERT INTO category_totals (category_id) VALUES (new.category_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS categories_closure_move_check BEFORE UPDATE OF parent_id ON categories
+            WHEN new.parent_id IS NOT NULL AND (
+                NOT EXISTS (SELECT 1 FROM categories WHERE category_id = new.parent_id)
+                OR EXISTS (SELECT 1 FROM category_closure WHERE ancestor_id = new.category_id AND descendant_id = new.parent_id))
+            BEGIN
+                SELECT RAISE(ABORT, 'a category can only move under an existing category outside its own subtree');
+            END
+        """)
+        # Moving a subtree: take its totals off the old ancestors, relink it, and add them to the new ancestors
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS categories_closure_move AFTER UPDATE OF parent_id ON categories
+            WHEN old.parent_id IS NOT new.parent_id BEGIN
+                UPDATE category_totals SET
+                    {", ".join(f"{column} = {column} - (SELECT {column} FROM category_totals WHERE category_id = new.category_id)"
+                               for column in TOTAL_COLUMNS)}
+                {ANCESTORS_OF.format("new.category_id")} AND cc.depth > 0;
+                DELETE FROM category_closure
+                WHERE descendant_id IN (SELECT descendant_id FROM category_closure WHERE ancestor_id = new.category_id)
+                  AND ancestor_id IN (SELECT ancestor_id FROM category_closure WHERE descendant_id = new.category_id AND depth > 0);
+                INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+                SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+                FROM category_closure a, category_closure d
+                WHERE a.descendant_id = new.parent_id AND d.ancestor_id = new.category_id;
+                UPDATE category_totals SET
+                    {", ".join(f"{column} = {column} + (SELECT {column} FROM category_totals WHERE category_id = new.category_id)"
+                               for column in TOTAL_COLUMNS)}
+                {ANCESTORS_OF.format("new.category_id")} AND cc.depth > 0;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS categories_closure_delete_check BEFORE DELETE ON categories
+            WHEN EXISTS (SELECT 1 FROM categories WHERE parent_id = old.category_id)
+              OR EXISTS (SELECT 1 FROM inventory WHERE category_id = old.category_id)
+            BEGIN
+                SELECT RAISE(ABORT, 'move this category''s subcategories and products before deleting it');
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS categories_closure_delete AFTER DELETE ON categories BEGIN
+                DELETE FROM category_closure WHERE descendant_id = old.category_id;
+                DELETE FROM category_totals WHERE category_id = old.category_id;
+            END
+        """)
+
+        # Stock: each change is applied to the product's category and its ancestors
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS inventory_category_totals_insert AFTER INSERT ON inventory BEGIN
+                UPDATE category_totals SET products = products + 1, stock_units = stock_units + new.quantity,
+                                           stock_value_pence = stock_value_pence + new.quantity * new.price_pence
+                {ANCESTORS_OF.format("new.category_id")};
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS inventory_category_totals_delete AFTER DELETE ON inventory BEGIN
+                UPDATE category_totals SET products = products - 1, stock_units = stock_units - old.quantity,
+                                           stock_value_pence = stock_value_pence - old.quantity * old.price_pence
+                {ANCESTORS_OF.format("old.category_id")};
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS inventory_category_totals_update AFTER UPDATE OF quantity, price_pence ON inventory
+            WHEN old.category_id IS new.category_id BEGIN
+                UPDATE category_totals SET stock_units = stock_units + new.quantity - old.quantity,
+                    stock_value_pence = stock_value_pence + new.quantity * new.price_pence - old.quantity * old.price_pence
+                {ANCESTORS_OF.format("new.category_id")};
+            END
+        """)
+        product_sales = ("((SELECT {} FROM sales_items WHERE product_id = new.product_id)"
+                         " + (SELECT {} FROM archived_product_sales WHERE product_id = new.product_id))")
+        sales_units = product_sales.format("COALESCE(SUM(quantity), 0)", "COALESCE(SUM(units), 0)")
+        sales_value = product_sales.format("COALESCE(SUM(quantity * price_pence), 0)", "COALESCE(SUM(value_pence), 0)")
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS inventory_category_totals_recategorise AFTER UPDATE OF category_id ON inventory
+            WHEN old.category_id IS NOT new.category_id BEGIN
+                UPDATE category_totals SET products = products - 1, stock_units = stock_units - old.quantity,
+                    stock_value_pence = stock_value_pence - old.quantity * old.price_pence,
+                    sales_units = sales_units - {sales_units}, sales_value_pence = sales_value_pence - {sales_value}
+                {ANCESTORS_OF.format("old.category_id")};
+                UPDATE category_totals SET products = products + 1, stock_units = stock_units + new.quantity,
+                    stock_value_pence = stock_value_pence + new.quantity * new.price_pence,
+                    sales_units = sales_units + {sales_units}, sales_value_pence = sales_value_pence + {sales_value}
+                {ANCESTORS_OF.format("new.category_id")};
+            END
+        """)
+
+        # Sales: each line is counted against the product's current category and its ancestors
+        product_category = "(SELECT category_id FROM inventory WHERE product_id = {}.product_id)"
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS sales_items_category_totals_insert AFTER INSERT ON sales_items BEGIN
+                UPDATE category_totals SET sales_units = sales_units + new.quantity,
+                                           sales_value_pence = sales_value_pence + new.quantity * new.price_pence
+                {ANCESTORS_OF.format(product_category.format("new"))};
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS sales_items_category_totals_delete AFTER DELETE ON sales_items BEGIN
+                UPDATE category_totals SET sales_units = sales_units - old.quantity,
+                                           sales_value_pence = sales_value_pence - old.quantity * old.price_pence
+                {ANCESTORS_OF.format(product_category.format("old"))};
+            END
+        """)
+
+    @metrics.timed("category_tree.rebuild")
+    def rebuild(self):
+        """Recreate the triggers and recompute the closure table and every total from scratch, set-based."""
+        cursor = self.conn.cursor()
+        if self.conn.in_transaction:
+            self.conn.commit()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            self._create_triggers(cursor)
+            cursor.execute("DELETE FROM category_closure")
+            cursor.execute("""
+                INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+                WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+                    SELECT category_id, category_id, 0 FROM categories
+                    UNION ALL
+                    SELECT tree.ancestor_id, c.category_id, tree.depth + 1
+                    FROM tree JOIN categories c ON c.parent_id = tree.descendant_id
+                )
+                SELECT ancestor_id, descendant_id, depth FROM tree
+            """)
+            cursor.execute("DELETE FROM category_totals")
+            cursor.execute(f"""
+                INSERT INTO category_totals (category_id, {", ".join(TOTAL_COLUMNS)})
+                SELECT c.category_id,
+                       COALESCE(SUM(stock.products), 0), COALESCE(SUM(stock.units), 0), COALESCE(SUM(stock.value), 0),
+                       COALESCE(SUM(sold.units), 0), COALESCE(SUM(sold.value), 0)
+                FROM categories c
+                JOIN category_closure cc ON cc.ancestor_id = c.category_id
+                LEFT JOIN (SELECT category_id, COUNT(*) AS products, SUM(quantity) AS units,
+                                  SUM(quantity * price_pence) AS value
+                           FROM inventory GROUP BY category_id) stock ON stock.category_id = cc.descendant_id
+                LEFT JOIN (SELECT i.category_id, SUM(s.units) AS units, SUM(s.value) AS value
+                           FROM (SELECT product_id, quantity AS units, quantity * price_pence AS value FROM sales_items
+                                 UNION ALL
+                                 SELECT product_id, units, value_pence FROM archived_product_sales) s
+                           JOIN inventory i ON i.product_id = s.product_id
+                           GROUP BY i.category_id) sold ON sold.category_id = cc.descendant_id
+                GROUP BY c.category_id
+            """)
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    @metrics.timed("category_tree.archive_sales_items")
+    def archive_sales_items(self, where, params=()):
+        """Delete the sales_items rows matching where without taking them out of the sales totals. Returns the count.
+
+        Their units and value are added to archived_product_sales, which
+        rebuild() and recategorising a product count along with sales_items,
+        and the delete trigger is held back while they go. Runs in the
+        caller's transaction, which should have the write lock already.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            INSERT INTO archived_product_sales (product_id, units, value_pence)
+            SELECT product_id, SUM(quantity), SUM(quantity * price_pence) FROM sales_items
+            WHERE ({where}) AND product_id IS NOT NULL GROUP BY product_id
+            ON CONFLICT (product_id) DO UPDATE SET units = units + excluded.units,
+                                                   value_pence = value_pence + excluded.value_pence
+        """, params)
+        cursor.execute("DROP TRIGGER sales_items_category_totals_delete")
+        deleted = Journal(self.conn, install=False).delete_archived(cursor, "sales_items", where, params)
+        self._create_triggers(cursor)
+        return deleted
+
+    def add_category(self, name, parent_id=None):
+        """Add a category, optionally under a parent. Returns its ID."""
+        cursor = self.conn.execute("INSERT INTO categories (name, parent_id) VALUES (?, ?)", (name, parent_id))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def move_category(self, category_id, parent_id):
+        """Move a category, with its subcategories and products, under another parent (None for top level)."""
+        self.conn.execute("UPDATE categories SET parent_id = ? WHERE category_id = ?", (parent_id, category_id))
+        self.conn.commit()
+
+    def path(self, category_id):
+        """Category names from the top level down to category_id, e.g. ['Food', 'Dairy']."""
+        rows = self.conn.execute("""SELECT c.name FROM category_closure cc JOIN categories c ON c.category_id = cc.ancestor_id
+                                    WHERE cc.descendant_id = ? ORDER BY cc.depth DESC""", (category_id,))
+        return [row[0] for row in rows]
+
+    def subtree(self, category_id):
+        """IDs of category_id and every category below it."""
+        rows = self.conn.execute("SELECT descendant_id FROM category_closure WHERE ancestor_id = ?", (category_id,))
+        return [row[0] for row in rows]
+
+    @metrics.timed("category_tree.totals")
+    def totals(self, category_id):
+        """A dict of TOTAL_COLUMNS for category_id and everything below it, or None for an unknown category."""
+        row = self.conn.execute(TOTALS_SQL, (category_id,)).fetchone()
+        return dict(zip(TOTAL_COLUMNS, row)) if row else None
+
+    @metrics.timed("category_tree.rollup")
+    def rollup(self, parent_id=None):
+        """(category_id, name, *TOTAL_COLUMNS) for each direct child of parent_id, or each top-level category."""
+        if parent_id is None:
+            return self.conn.execute(TOP_LEVEL_SQL).fetchall()
+        return self.conn.execute(ROLLUP_SQL, (parent_id,)).fetchall()
+
+    def products_in(self, category_id, limit=100):
+        """(product_id, name, price_pence, quantity) for products anywhere in a category's subtree."""
+        return self.conn.execute(PRODUCTS_IN_SQL, (category_id, limit)).fetchall()
+
+
+_REPORT_ROW = "{:<6} {:<32} {:>9} {:>12} {:>14} {:>12} {:>14}\n".format
+
+
+def render_report(tree, parent_id=None, indent=0, max_depth=None):
+    """Render the category tree below parent_id with each subtree's totals, depth first."""
+    parts = [_REPORT_ROW("ID", "Category", "Products", "Stock units", "Stock value(£)", "Units sold", "Sales(£)")] \
+        if indent == 0 else []
+    for category_id, name, products, stock_units, stock_value, sales_units, sales_value in tree.rollup(parent_id):
+        parts.append(_REPORT_ROW(category_id, ("  " * indent + name)[:32], products, stock_units,
+                                 money.format_pounds(stock_value), sales_units, money.format_pounds(sales_value)))
+        if max_depth is None or indent + 1 < max_depth:
+            parts.append(render_report(tree, category_id, indent + 1, max_depth))
+    return "".join(parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Category hierarchy maintenance and department roll-up reports.")
+    parser.add_argument("command", choices=("report", "add", "move", "rebuild"))
+    parser.add_argument("--db", default="InventorySystem.db", help="inventory database")
+    parser.add_argument("--category", type=int, help="report: start below this category; move: the category to move")
+    parser.add_argument("--depth", type=int, help="report: levels to show (default all)")
+    parser.add_argument("--name", help="add: the new category's name")
+    parser.add_argument("--parent", type=int, help="add/move: the parent category (omit for top level)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    tree = CategoryTree(conn)
+    try:
+        if args.command == "report":
+            print(render_report(tree, args.category, max_depth=args.depth), end="")
+        elif args.command == "add":
+            if not args.name:
+                parser.error("add needs --name")
+            print(f"Added category {tree.add_category(args.name, args.parent)}.")
+        elif args.command == "move":
+            if args.category is None:
+                parser.error("move needs --category")
+            tree.move_category(args.category, args.parent)
+            print(f"Moved category {args.category}: {' > '.join(tree.path(args.category))}")
+        else:
+            tree.rebuild()
+            print("Rebuilt the category closure table and totals.")
+    except sqlite3.IntegrityError as e:
+        print(f"Error: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import dates
+import metrics
+from journal import Journal
+from backup import OnlineBackup
+
+# Change data capture for downstream systems (e-commerce stock, head-office
+# reporting, marketing), so they can follow the inventory and loyalty
+# databases instead of re-exporting whole tables.
+#
+# The feed is the row journal (journal.py): triggers write every insert,
+# update and delete to it in the same transaction as the change, with a
+# sequence number. Writers to a database are serialised, so entries commit in
+# sequence order and a reader never finds a gap that is later filled in. Each
+# consumer has a named cursor in journal_cursors holding the last sequence
+# number it has acknowledged; it reads batches after that and acknowledges them
+# once they are safely delivered, so after a crash it picks up where it
+# stopped and sees at most the unacknowledged batch again. The journal is not
+# trimmed past any consumer's cursor, so a consumer that is no longer used
+# must be dropped.
+#
+# A new consumer starts from a snapshot of the tables it follows, read from an
+# online backup copy so the lanes are not held up while it is read; its cursor
+# is set to the last journal entry in that copy.
+
+BATCH_SIZE = 1_000
+POLL_INTERVAL = 1.0  # Seconds between polls when following the feed
+OPS = {"I": "insert", "U": "update", "D": "delete", "A": "archive"}
+
+POSITION_SQL = "SELECT seq FROM journal_cursors WHERE consumer = ?"
+READ_SQL = """SELECT seq, table_name, op, row_key, row_data, recorded_at FROM journal
+              WHERE seq > ? ORDER BY seq LIMIT ?"""
+
+
+class ChangeFeed:
+    """A named consumer's resumable view of one database's changes, optionally limited to some tables.
+
+    Events are dicts: seq, table, op ("insert", "update", "delete",
+    "archive" or "snapshot"), key (the row's primary key, with its rowid where
+    it has one; for "archive", {"rowid_ranges": [[first, last], ...]} of the
+    rows moved to the monthly archive), row (the new row, or None for a
+    delete or archive) and at (when it happened).
+    """
+
+    def __init__(self, conn, consumer, tables=None):
+        self.conn = conn
+        self.consumer = consumer
+        self.tables = set(tables) if tables else None
+        self.journal = Journal(conn)
+
+    def position(self):
+        """The last sequence number the consumer has acknowledged, or None if it is not registered."""
+        row = self.conn.execute(POSITION_SQL, (self.consumer,)).fetchone()
+        return row[0] if row else None
+
+    def register(self, seq=None):
+        """Start (or restart) the consumer's feed after seq, by default after the latest change."""
+        seq = self.journal.last_seq() if seq is None else seq
+        self.conn.execute("""INSERT INTO journal_cursors (consumer, seq, updated_at) VALUES (?, ?, ?)
+                             ON CONFLICT (consumer) DO UPDATE SET seq = excluded.seq, updated_at = excluded.updated_at""",
+                          (self.consumer, seq, dates.now()))
+        self.conn.commit()
+
+    def drop(self):
+        """Forget the consumer, so the journal can be trimmed past it."""
+        self.conn.execute("DELETE FROM journal_cursors WHERE consumer = ?", (self.consumer,))
+        self.conn.commit()
+
+    @metrics.timed("change_feed.read")
+    def read(self, limit=BATCH_SIZE, after=None):
+        """(events, position): the changes in the next limit journal entries after the consumer's position.
+
+        Nothing is acknowledged; pass position to ack() once the events have
+        been delivered. Entries for tables the consumer does not follow, and
+        restore points, are skipped but still move the position on.
+        """
+        if after is None:
+            after = self.position()
+            if after is None:
+                raise ValueError(f"Consumer {self.consumer!r} is not registered; take a snapshot or register it first.")
+        rows = self.conn.execute(READ_SQL, (after, limit)).fetchall()
+        events = [{"seq": seq, "table": table, "op": OPS[op], "key": json.loads(row_key),
+                   "row": json.loads(row_data) if row_data else None, "at": recorded_at}
+                  for seq, table, op, row_key, row_data, recorded_at in rows
+                  if op != "M" and (self.tables is None or table in self.tables)]
+        return events, rows[-1][0] if rows else after
+
+    def ack(self, seq):
+        """Record that everything up to seq has been delivered. The cursor never moves backwards."""
+        self.conn.execute("UPDATE journal_cursors SET seq = ?, updated_at = ? WHERE consumer = ? AND seq < ?",
+                          (seq, dates.now(), self.consumer, seq))
+        self.conn.commit()
+
+    def tail(self, limit=BATCH_SIZE, follow=False, interval=POLL_INTERVAL):
+        """Yield batches of events until the feed is caught up, or for ever with follow.
+
+        A batch is acknowledged when the next one is asked for, so one the
+        consumer stops part way through is delivered again next time.
+        """
+        position = self.position()
+        while True:
+            events, next_position = self.read(limit, position)
+            if events:
+                yield events
+            if next_position != position:
+                self.ack(next_position)
+                position = next_position
+                continue
+            if not follow:
+                return
+            time.sleep(interval)
+
+    @metrics.timed("change_feed.snapshot")
+    def snapshot(self):
+        """Yield every current row of the followed tables as snapshot events, then register the consumer.
+
+        The feed then carries on from the first change after the snapshot. A
+        consumer that stops part way through is not registered and starts again.
+        """
+        db_file = self.conn.execute("PRAGMA database_list").fetchone()[2]
+        work_dir = tempfile.mkdtemp(prefix="grocery_feed_")
+        try:
+            copy_file = os.path.join(work_dir, "snapshot.db")
+            OnlineBackup(db_file).copy(copy_file)
+            copy = sqlite3.connect(copy_file)
+            try:
+                snapshot = Journal(copy, install=False)
+                seq = snapshot.last_seq()
+                for table, (_, key, rowid) in sorted(snapshot.tables().items()):
+                    if self.tables is not None and table not in self.tables:
+                        continue
+                    key_columns = ([rowid] if rowid else []) + key
+                    cursor = copy.execute(f'SELECT {"rowid, " if rowid else ""}* FROM "{table}"')
+                    columns = [description[0] for description in cursor.description]
+                    for values in cursor:
+                        row = dict(zip(columns, values))
+                        yield {"seq": seq, "table": table, "op": "snapshot",
+                               "key": {column: row[column] for column in key_columns}, "row": row, "at": None}
+            finally:
+                copy.close()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        self.register(seq)
+        if self.journal.first_seq() > seq + 1:
+            self.drop()
+            raise ValueError("The journal was trimmed past the snapshot while it was read; take it again.")
+
+    def lag(self):
+        """Journal entries written since the consumer's position."""
+        position = self.position()
+        return None if position is None else self.journal.last_seq() - position
+
+
+def consumers(conn):
+    """(consumer, seq, updated_at) for every registered consumer of this database's feed."""
+    return conn.execute("SELECT consumer, seq, updated_at FROM journal_cursors ORDER BY consumer").fetchall()
+
+
+if __name__ == "__main__":
+    from data_access import INVENTORY_DB
+
+    parser = argparse.ArgumentParser(description="Stream inserts, updates and deletes from a database as JSON lines.")
+    parser.add_argument("command", choices=("snapshot", "register", "tail", "list", "drop"))
+    parser.add_argument("--db", default=INVENTORY_DB, help="inventory or loyalty database")
+    parser.add_argument("--consumer", help="name of the downstream consumer")
+    parser.add_argument("--tables", help="comma-separated tables to follow (default: all)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="tail: journal entries per batch")
+    parser.add_argument("--follow", action="store_true", help="tail: keep waiting for new changes")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="tail: seconds between polls")
+    args = parser.parse_args()
+
+    conn = metrics.connect(args.db, timeout=30.0)
+    if args.command == "list":
+        last_seq = Journal(conn).last_seq()
+        for consumer, seq, updated_at in consumers(conn):
+            print(f"{consumer:<24} at {seq:>12}  {last_seq - seq:>10} behind  (acknowledged {updated_at})")
+    elif not args.consumer:
+        parser.error(f"{args.command} needs --consumer")
+    else:
+        feed = ChangeFeed(conn, args.consumer, args.tables.split(",") if args.tables else None)
+        try:
+            if args.command == "snapshot":
+                for event in feed.snapshot():
+                    sys.stdout.write(json.dumps(event) + "\n")
+            elif args.command == "register":
+                feed.register()
+            elif args.command == "drop":
+                feed.drop()
+            else:
+                for events in feed.tail(args.batch, args.follow, args.interval):
+                    sys.stdout.write("".join(json.dumps(event) + "\n" for event in events))
+                    sys.stdout.flush()  # Delivered before the batch is acknowledged
+        except ValueError as e:
+            raise SystemExit(str(e))
+        except KeyboardInterrupt:
+            pass
+    conn.close()
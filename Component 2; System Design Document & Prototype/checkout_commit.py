@@ -0,0 +1,176 @@
+import os
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import money
+import dates
+import metrics
+from stock_ledger import StockLedger
+
+# Schema name the loyalty database is attached under on the inventory connection
+LOYALTY_SCHEMA = "loyalty"
+
+SALES_ITEM_SQL = """INSERT INTO sales_items (sale_id, product_id, quantity, price_pence)
+                    VALUES ((SELECT sale_id FROM sales WHERE basket = ?), ?, ?, ?)"""
+# {placeholders} is one ? per product in the cart
+STOCK_CHECK_SQL = "SELECT name FROM inventory WHERE quantity < 0 AND product_id IN ({placeholders})"
+
+
+class CheckoutCommit:
+    """Records a paid basket in the inventory and loyalty databases as one atomic write.
+
+    The loyalty database is attached to the inventory connection, so the sale,
+    its lines, the stock movements and the customer's points all go in one
+    transaction and SQLite's multi-file commit either applies every change or
+    none of them. Nothing is written for a basket until it has been paid for.
+    With a lane queue the same statements are queued as one entry, and the
+    replayer applies them in one transaction with the same database attached;
+    as the basket has been paid for by then, stock another lane sold first is
+    recorded as oversold rather than refusing the sale.
+
+    Each sale carries its basket ID, which is also on its stock movements and
+    is unique, so a basket can never be recorded twice.
+    """
+
+    def __init__(self, conn, loyalty_db, lane_queue=None, lane=None, inventory_db=None):
+        self.conn = conn
+        self.loyalty_db = loyalty_db
+        self.lane_queue = lane_queue
+        self.lane = lane
+        self.inventory_db = inventory_db  # Where queued entries are replayed to
+        if not any(row[1] == LOYALTY_SCHEMA for row in self.conn.execute("PRAGMA database_list")):
+            self.conn.execute(f"ATTACH DATABASE ? AS {LOYALTY_SCHEMA}", (loyalty_db,))
+
+    def statements(self, cart, total_pence, basket, customer_id=None, sale_date=None, alert=None):
+        """(sql, params) statements that record a paid cart of (product_id, name, quantity, price_pence) lines.
+
+        alert is a FraudAlerts row from BusinessLogicLayer.screen_sale to record with the sale, or None.
+        A held alert keeps the points off the card until it is released; the
+        sale is still the customer's, so a return finds it.
+        """
+        sale_date = sale_date or dates.now()
+        statements = [("INSERT INTO sales (sale_date, total_pence, basket, customer_id) VALUES (?, ?, ?, ?)",
+                       (sale_date, total_pence, basket, customer_id))]
+        statements += [(SALES_ITEM_SQL, (basket, product_id, quantity, price_pence))
+                       for product_id, _, quantity, price_pence in cart]
+        statements += StockLedger.stock_change_statements(
+            [(product_id, -quantity) for product_id, _, quantity, _ in cart], "sale", self.lane, basket, sale_date)
+        held = alert is not None and alert[2] == "held"
+        if customer_id is not None and not held:
+            points_earned = money.points_for(total_pence)
+            statements += [
+                (f"""INSERT INTO {LOYALTY_SCHEMA}.Transactions (CustomerID, TransactionDate, TotalAmountPence, PointsEarned)
+                     VALUES (?, ?, ?, ?)""", (customer_id, sale_date, total_pence, points_earned)),
+                (f"UPDATE {LOYALTY_SCHEMA}.Customer SET TotalPoints = TotalPoints + ? WHERE CustomerID = ?",
+                 (points_earned, customer_id)),
+            ]
+        if alert is not None:
+            alert_customer, activity, action, events, window_seconds, happened_at, amount_pence, points = alert
+            statements.append((f"""INSERT INTO {LOYALTY_SCHEMA}.FraudAlerts (CustomerID, Activity, Action, Events,
+                                       WindowSeconds, Source, HappenedAt, DetectedAt, AmountPence, Points, Basket)
+                                   VALUES (?, ?, ?, ?, ?, 'stream', ?, ?, ?, ?, ?)""",
+                               (alert_customer, activity, action, events, window_seconds, happened_at, dates.now(),
+                                amount_pence, points, basket)))
+        return statements
+
+    @metrics.timed("checkout_commit.commit")
+    def commit(self, cart, total_pence, basket, customer_id=None, sale_date=None, alert=None):
+        """Record a paid cart in both databases at once.
+
+        Raises ValueError, and writes nothing, if another lane has sold the
+        stock since it was scanned. In queued mode the entry is applied when
+        the replayer next runs, and any product it takes below zero is set
+        back to zero with an "oversold" stock movement for the difference.
+        """
+        sale_date = sale_date or dates.now()
+        statements = self.statements(cart, total_pence, basket, customer_id, sale_date, alert)
+        if self.lane_queue:
+            statements += StockLedger.oversold_statements(dict.fromkeys(product_id for product_id, _, _, _ in cart),
+                                                          self.lane, basket, sale_date)
+            self.lane_queue.enqueue(self.inventory_db, statements, key=f"sale-{basket}",
+                                    attach={LOYALTY_SCHEMA: self.loyalty_db})
+            return
+
+        if self.conn.in_transaction:
+            self.conn.commit()
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                cursor.execute(sql, params)
+            product_ids = list({product_id for product_id, _, _, _ in cart})
+            short = cursor.execute(STOCK_CHECK_SQL.format(placeholders=", ".join("?" * len(product_ids))),
+                                   product_ids).fetchall()
+            if short:
+                raise ValueError(f"Insufficient stock for {', '.join(name for name, in short)}. Please edit the cart.")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+
+# Benchmark: the same baskets written the old way, one commit per scanned line
+# plus one for the loyalty points, against one atomic commit per basket.
+
+def _scattered(inventory, data_layer, baskets):
+    for basket, cart, customer_id in baskets:
+        for product_id, _, quantity, _ in cart:
+            inventory.update_quantity(product_id, quantity, basket=basket)
+        if customer_id is not None:
+            total = sum(quantity * price for _, _, quantity, price in cart)
+            data_layer.record_transaction(customer_id, dates.now(), total, money.points_for(total))
+
+
+def _atomic(committer, baskets):
+    for basket, cart, customer_id in baskets:
+        committer.commit(cart, sum(quantity * price for _, _, quantity, price in cart), basket, customer_id)
+
+
+if __name__ == "__main__":
+    import random
+    from data_access import InventorySystem, DataLayer
+
+    parser = argparse.ArgumentParser(description="Benchmark atomic checkout commits against one commit per line.")
+    parser.add_argument("--baskets", type=int, default=500)
+    parser.add_argument("--basket-size", type=int, default=8, help="lines per basket")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    baskets = [(uuid.uuid4().hex,
+                [(str(rng.randint(1, args.products)), "", rng.randint(1, 3), rng.randint(50, 500))
+                 for _ in range(args.basket_size)],
+                rng.randint(1, args.customers) if rng.random() < 0.6 else None)
+               for _ in range(args.baskets)]
+
+    work_dir = tempfile.mkdtemp(prefix="grocery_commit_")
+    try:
+        print(f"{'Mode':<10} {'Baskets/s':>10} {'Commits/basket':>15}")
+        for mode in ("scattered", "atomic"):
+            inventory = InventorySystem(os.path.join(work_dir, f"{mode}_inventory.db"))
+            inventory.conn.executemany("INSERT OR IGNORE INTO inventory (product_id, name, price_pence, quantity, category_id) "
+                                       "VALUES (?, ?, 100, 1000000, 1)",
+                                       ((str(n), f"Product {n}") for n in range(1, args.products + 1)))
+            inventory.conn.commit()
+            data_layer = DataLayer(os.path.join(work_dir, f"{mode}_loyalty.db"))
+            data_layer.conn.executemany("INSERT INTO Customer (FirstName) VALUES (?)",
+                                        ((f"First{n}",) for n in range(args.customers)))
+            data_layer.conn.commit()
+
+            began = time.perf_counter()
+            if mode == "scattered":
+                _scattered(inventory, data_layer, baskets)
+                commits = args.basket_size + sum(1 for *_, customer_id in baskets if customer_id) / len(baskets)
+            else:
+                _atomic(CheckoutCommit(inventory.conn, data_layer.db_name), baskets)
+                commits = 1
+            elapsed = time.perf_counter() - began
+            print(f"{mode:<10} {len(baskets) / elapsed:>10.1f} {commits:>15.1f}", flush=True)
+            inventory.close_connection()
+            data_layer.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
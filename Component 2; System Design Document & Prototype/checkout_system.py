@@ -1,78 +1,220 @@
-import sqlite3
+import uuid
 import json
-from inventory_system import InventorySystem
+import money
+import dates
+import metrics
+import rendering
+from checkout_commit import CheckoutCommit
+from data_access import InventorySystem, DataLayer
+from loyalty_card_system import BusinessLogicLayer
 
 class CheckoutSystem:
-    def __init__(self):
+    def __init__(self, inventory_system, bl_layer):  # Accept bl_layer in the constructor
         self.cart = []
-        self.inventory_system = InventorySystem()  # Initialize InventorySystem
-        self.total = 0.0
-        self.tax_rate = 0.1  # Example tax rate (10%)
+        self.inventory_system = inventory_system  # Initialize InventorySystem
+        self.bl_layer = bl_layer  # Store the BusinessLogicLayer instance
+        self.total = 0  # Running cart total in pence
+        self.basket_id = uuid.uuid4().hex  # Ties this cart's sale and stock movements together
+        # Stock, sale and loyalty points are only written once the basket is paid for, in one transaction
+        self.sale_commit = CheckoutCommit(inventory_system.conn, bl_layer.data_layer.db_name, inventory_system.lane_queue,
+                                          inventory_system.lane, inventory_system.db_file)
 
     def login(self):
         """Allow a staff member to log in."""
-        print("\n--- Staff Login ---")
+        print("\n--- STAFF LOGIN ---")
         username = input("Enter your username: ").strip()
         password = input("Enter your password: ").strip()
-        print(f"\nWelcome, {username}! You are now logged in.")
-
-    def display_inventory(self):
-        """Display all available products to the user."""
-        print("\nAvailable Products:")
-        products = self.inventory_system.get_all_products()  # Get all products
-        if not products:
-            print("No products available in the inventory.")
+        # For simplicity, we will allow any username/password
+        print(f"\nWelcome, {username}! You are now logged in!")
+
+    def display_inventory(self, page=1, name_filter=None):
+        """Display one page of available products to the user."""
+        products, total_count = self.inventory_system.get_products_page(page, rendering.PAGE_SIZE, name_filter)
+        rendering.emit("\nAvailable Products:\n" + rendering.render_inventory(products, page, rendering.PAGE_SIZE, total_count))
+
+    @metrics.timed("checkout.find_product")
+    def find_product(self, text):
+        """Look up a product by exact ID or barcode, falling back to a name search. Shows the choices if the name is ambiguous."""
+        product = self.inventory_system.get_product_details(text)
+        if product:
+            return product
+
+        product_id = self.inventory_system.lookup_barcode(text)
+        if product_id:
+            return self.inventory_system.get_product_details(product_id)
+
+        matches = self.inventory_system.search_products(text)
+        if len(matches) == 1:
+            return self.inventory_system.get_product_details(matches[0][0])
+        if matches:
+            rendering.emit("\nMatching Products:\n" + rendering.render_inventory(matches))
+        return None
+
+    def _in_cart(self, product_id):
+        """Units of a product already in the cart; they are not taken out of stock until the sale is paid for."""
+        return sum(item[2] for item in self.cart if item[0] == product_id)
+
+    @metrics.timed("checkout.add_scanned_items")
+    def add_scanned_items(self, codes):
+        """Add a burst of scanned barcodes to the cart with one lookup for the whole burst."""
+        lines, rejected = self.inventory_system.scan_items(codes)
+        purchased = []
+        for product_id, name, quantity, price_pence, stock in lines:
+            available = stock - self._in_cart(product_id)
+            if quantity > available:
+                print(f"Insufficient stock for {name}. Only {available} available.")
+                continue
+            self.cart.append((product_id, name, quantity, price_pence))
+            self.total += price_pence * quantity
+            purchased.append((product_id, quantity))
+
+        for code in rejected:
+            print(f"Unknown barcode: {code}")
+        return purchased
+
+    # Headless cart operations, used by the menus below and by scripted lanes.
+    # Problems are raised as ValueError with a message ready to show the cashier.
+
+    def add_item(self, product_id, quantity):
+        """Add quantity of a product to the cart if there is enough stock. Returns the product."""
+        product = self.inventory_system.get_product_details(product_id)
+        if not product:
+            raise ValueError("Invalid product ID, please try again.")
+        if quantity <= 0:
+            raise ValueError("Please enter a positive quantity.")
+        available = product.quantity - self._in_cart(product_id)
+        if quantity > available:
+            raise ValueError(f"Insufficient stock for {product.name}. Only {available} available.")
+
+        self.cart.append((product_id, product.name, quantity, product.price_pence))
+        self.total += product.price_pence * quantity
+        return product
+
+    def remove_item(self, product_id):
+        """Remove a line from the cart. Returns the removed line."""
+        item = next((item for item in self.cart if item[0] == product_id), None)
+        if not item:
+            raise ValueError("Item not found in the cart.")
+
+        self.cart.remove(item)
+        self.total -= item[2] * item[3]
+        return item
+
+    def edit_item(self, product_id, new_quantity):
+        """Change the quantity of a cart line, checking stock for any increase."""
+        item = next((item for item in self.cart if item[0] == product_id), None)
+        if not item:
+            raise ValueError("Item not found in the cart.")
+        if new_quantity <= 0:
+            raise ValueError("Quantity must be greater than zero.")
+
+        difference = new_quantity - item[2]
+        if difference > 0 and difference > (self.inventory_system.get_product_details(product_id).quantity
+                                            - self._in_cart(product_id)):
+            raise ValueError("Insufficient stock! Unable to update quantity!")
+
+        self.cart[self.cart.index(item)] = (item[0], item[1], new_quantity, item[3])
+        self.total += difference * item[3]
+
+    def suggestions(self, product_id, limit=3):
+        """Names of products often bought with product_id (market_basket.py) that are not in the cart yet."""
+        return [name for suggested_id, name, _ in self.inventory_system.get_suggestions(product_id, limit + len(self.cart))
+                if not self._in_cart(suggested_id)][:limit]
+
+    @metrics.timed("checkout.complete_sale")
+    def complete_sale(self, payment_method, amount_given=None, customer_id=None, transaction_date=None):
+        """Take payment for the cart without prompting, record the sale, stock and loyalty points, and clear the cart.
+
+        Nothing is recorded if the payment or the stock check fails, or the
+        customer's card is blocked, and the cart is kept. transaction_date
+        defaults to now.
+        Returns (total_pence, points_earned, change_pence).
+        """
+        if not self.cart:
+            raise ValueError("Your cart is empty! Cannot proceed with checkout and payment!")
+        if customer_id is not None:
+            self.bl_layer.check_card(customer_id)
+
+        total_amount = self.total
+        if payment_method == "cash":
+            if amount_given is None or amount_given < total_amount:
+                raise ValueError("Insufficient amount provided! Transaction failed!")
+            change = amount_given - total_amount
+        elif payment_method == "card":
+            change = 0
+        else:
+            raise ValueError("Invalid payment method!")
+
+        metrics.observe_size("checkout.cart_lines", len(self.cart))
+        metrics.observe_size("checkout.cart_items", sum(item[2] for item in self.cart))
+        points_earned = money.points_for(total_amount)
+        held, alert = False, None
+        if customer_id is not None:
+            held, alert = self.bl_layer.screen_sale(customer_id, total_amount, points_earned, dates.now())
+        if held:
+            points_earned = 0  # The sale goes through on the card; its points wait in the alert
+        self.record_sale(customer_id, transaction_date, alert)
+        if customer_id is not None:
+            self.bl_layer.sale_recorded(customer_id, alert)
+        self.clear_cart()
+        return total_amount, points_earned, change
+
+    def record_sale(self, customer_id=None, transaction_date=None, alert=None):
+        """Write the paid cart, and any fraud alert on it, to inventory and loyalty in one atomic commit.
+
+        Raises ValueError if stock ran out.
+        """
+        sale_date = dates.parse_timestamp(transaction_date) if transaction_date else dates.now()
+        self.sale_commit.commit(self.cart, self.total, self.basket_id, customer_id, sale_date, alert)
+
+    def clear_cart(self):
+        """Empty the cart and start a new basket."""
+        self.cart.clear()
+        self.total = 0
+        self.basket_id = uuid.uuid4().hex
+
+    def display_cart(self):
+        """Display the items in the cart."""
+        if not self.cart:
+            print("\nYour cart is empty!")
             return
 
-        # Displaying the products
-        for product in products:
-            product_id, name, price, quantity = product
-            print(f"ID: {product_id}, Name: {name}, Price: £{price}, Quantity: {quantity}")
+        rendering.emit(rendering.render_cart(self.cart, self.total))
 
-    def add_to_cart(self):
-        """Manage the cart: add, remove, or edit items."""
+    def cart_menu(self, exit_label="Back to Main Menu"):
+        """Manage the cart from the keyboard: add, remove or edit items, then check out."""
         while True:
-            # Display inventory
             self.display_inventory()
-
-            print("\nOptions: ")
+            print("\nCHECKOUT SYSTEM MENU: ")
             print("1. Add an item to the cart")
             print("2. Remove/Edit an item in the cart")
             print("3. View cart")
             print("4. Proceed to checkout")
-            print("5. Exit")
-            choice = input("Enter your choice: ").strip()
+            print(f"5. {exit_label}")
+            choice = input("Choose an option: ").strip()
 
             if choice == "1":
-                # Add an item to the cart
-                product_id = input("\nEnter the product ID: ").strip()
-                product = self.inventory_system.get_product_details(product_id)
+                product = self.find_product(input("\nEnter the product ID, name or barcode: ").strip())
                 if not product:
                     print("Invalid product ID, please try again.")
                     continue
 
                 try:
-                    quantity = int(input(f"Enter the quantity for {product['name']}: ").strip())
-                    if quantity <= 0:
-                        print("Please enter a positive quantity.")
-                        continue
+                    quantity = int(input(f"Enter the quantity for {product.name}: ").strip())
                 except ValueError:
                     print("Invalid input. Please enter a valid quantity.")
                     continue
 
-                if quantity > product['quantity']:
-                    print(f"Insufficient stock for {product['name']}. Only {product['quantity']} available.")
-                    continue
-
-                self.cart.append((product_id, product['name'], quantity, product['price']))
-                self.total += product['price'] * quantity
-                print(f"Added {quantity} x {product['name']} to your cart.")
-
-                # Ensure quantity decreases correctly
-                self.inventory_system.update_quantity(product_id, -quantity)
+                try:
+                    self.add_item(product.product_id, quantity)
+                    print(f"Added {quantity} x {product.name} to your cart.")
+                    suggestions = self.suggestions(product.product_id)
+                    if suggestions:
+                        print(f"Often bought with it: {', '.join(suggestions)}")
+                except ValueError as e:
+                    print(e)
 
             elif choice == "2":
-                # Remove or edit an item in the cart
                 self.display_cart()
                 product_id = input("Enter the product ID to edit/remove: ").strip()
                 item = next((item for item in self.cart if item[0] == product_id), None)
@@ -84,66 +226,42 @@ class CheckoutSystem:
                 print("Options:")
                 print("1. Remove item")
                 print("2. Edit quantity")
-                edit_choice = input("Enter your choice: ").strip()
+                edit_choice = input("Choose an option: ").strip()
 
                 if edit_choice == "1":
-                    self.cart.remove(item)
-                    self.total -= item[2] * item[3]
-                    self.inventory_system.update_quantity(product_id, item[2])
+                    self.remove_item(product_id)
                     print(f"Removed {item[1]} from the cart.")
 
                 elif edit_choice == "2":
                     try:
                         new_quantity = int(input(f"Enter new quantity for {item[1]}: ").strip())
-                        if new_quantity <= 0:
-                            print("Quantity must be greater than zero.")
-                            continue
-
-                        difference = new_quantity - item[2]
-                        if difference > 0 and difference > self.inventory_system.get_product_details(product_id)['quantity']:
-                            print(f"Insufficient stock. Unable to update quantity.")
-                            continue
-
-                        item_index = self.cart.index(item)
-                        self.cart[item_index] = (item[0], item[1], new_quantity, item[3])
-                        self.total += difference * item[3]
-                        self.inventory_system.update_quantity(product_id, -difference)
-                        print(f"Updated {item[1]} to quantity {new_quantity}.")
-
                     except ValueError:
-                        print("Invalid input. Please enter a valid quantity.")
+                        print("Invalid input! Please enter a valid quantity!")
+                        continue
+
+                    try:
+                        self.edit_item(product_id, new_quantity)
+                        print(f"Updated {item[1]} to quantity {new_quantity}.")
+                    except ValueError as e:
+                        print(e)
 
             elif choice == "3":
                 # View the cart
                 self.display_cart()
 
             elif choice == "4":
-                # Proceed to checkout
-                break
+                self.checkout()
+                break  # Proceed to checkout
 
             elif choice == "5":
                 # Exit the program or cancel the cart
-                print("Exiting cart management...")
-                self.cart.clear()
-                self.total = 0.0
+                print("Exiting Cart Management...")
+                print("Thank you! Exit Successful! Signing Off!")
+                self.clear_cart()
                 break
 
             else:
-                print("Invalid choice. Please try again.")
-
-    def display_cart(self):
-        """Display the items in the cart."""
-        if not self.cart:
-            print("\nYour cart is empty.")
-            return
-
-        print("\nYour Cart:")
-        print("{:<10} {:<25} {:<10} {:<10}".format("ID", "Name", "Price(£)", "Quantity"))
-        print("-" * 60)
-        for product_id, name, quantity, price in self.cart:
-            print("{:<10} {:<25} {:<10.2f} {:<10}".format(product_id, name, price, quantity))
-        print("-" * 60)
-        print(f"Total: £{self.total:.2f}")
+                print("Invalid option! Please try again!")
 
     def checkout(self):
         """Complete the purchase."""
@@ -151,23 +269,75 @@ class CheckoutSystem:
         self.display_cart()
 
         if not self.cart:
-            print("Your cart is empty. Cannot proceed with checkout.")
+            print("Your cart is empty! Cannot proceed with checkout and payment!")
+            print("Thank you for visiting our Grocery Store. See you again soon!")
             return
 
-        total_with_tax = self.total * (1 + self.tax_rate)
-        print(f"Total with tax (10%): £{total_with_tax:.2f}")
+        metrics.observe_size("checkout.cart_lines", len(self.cart))
+        metrics.observe_size("checkout.cart_items", sum(item[2] for item in self.cart))
+
+        # Ask if the customer has a loyalty card
+        has_loyalty_card = input("Do you have a Loyalty Card? (Yes/No): ").strip().lower()
+        
+        total_amount = self.total
+        points_earned = money.points_for(total_amount)  # Example: 1 point for every £1 spent
+        
+        customer_id = None
+        if has_loyalty_card == 'yes':
+            # Points are added with the sale, once payment has gone through
+            customer_id = int(input("Enter Customer ID: "))
+            try:
+                self.bl_layer.check_card(customer_id)
+                segment, tier = self.bl_layer.get_customer_tier(customer_id)
+                print(f"Loyalty tier: {tier} ({segment})")
+            except ValueError as e:
+                print(e)
+                customer_id = None
+
+        payment_method = input("Select Payment Type (Cash or Card): ").strip().lower()
+        if payment_method == "cash":
+            try:
+                amount_given = money.parse_pounds(input("Enter money amount given: £"))
+                if amount_given < total_amount:
+                    print("Insufficient amount provided! Transaction failed!")
+                    return
+                change = amount_given - total_amount
+            except ValueError:
+                print("Invalid input. Please enter a numeric value.")
+                return
+        elif payment_method == "card":
+            change = None
+        else:
+            print("Invalid payment method!")
+            return
 
-        payment_method = input("Select payment method (cash, card): ").strip().lower()
-        if payment_method in ["cash", "card"]:
-            print(f"Payment successful! Total: £{total_with_tax:.2f}")
-            self.export_cart_to_json(total_with_tax)
-            self.print_receipt(total_with_tax)
-            self.cart.clear()  # Clear cart after purchase
-            self.total = 0.0
+        held, alert = False, None
+        if customer_id is not None:
+            held, alert = self.bl_layer.screen_sale(customer_id, total_amount, points_earned, dates.now())
+        if held:
+            points_earned = 0  # Held points are not on the receipt until released
+
+        try:
+            self.record_sale(customer_id, alert=alert)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if customer_id is not None:
+            self.bl_layer.sale_recorded(customer_id, alert)
+        if held:
+            print("Loyalty points for this sale are held for review.")
+        if change is None:
+            print(f"Payment successful! Total: £{money.format_pounds(total_amount)}")
         else:
-            print("Invalid payment method.")
+            print(f"Payment successful! Total: £{money.format_pounds(total_amount)}, Change: £{money.format_pounds(change)}")
+        if customer_id is not None and not held:
+            print(f"{points_earned} Loyalty Point(s) earned on your shopping.")
+
+        self.export_cart_to_json(total_amount, points_earned)
+        self.print_receipt(total_amount, points_earned)
+        self.clear_cart()  # Clear cart after purchase
 
-    def export_cart_to_json(self, total_with_tax):
+    def export_cart_to_json(self, total_amount, points_earned):
         """Export cart details to a JSON file."""
         transaction_data = {
             "cart": [
@@ -175,12 +345,12 @@ class CheckoutSystem:
                     "product_id": product_id,
                     "name": name,
                     "quantity": quantity,
-                    "price": price
-                } for product_id, name, quantity, price in self.cart
+                    "price_pence": price_pence
+                } for product_id, name, quantity, price_pence in self.cart
             ],
-            "subtotal": self.total,
-            "tax": self.total * self.tax_rate,
-            "total_with_tax": total_with_tax
+            "subtotal_pence": self.total,
+            "total_pence": total_amount,
+            "points_earned": points_earned
         }
 
         try:
@@ -190,28 +360,26 @@ class CheckoutSystem:
         except IOError:
             print("Failed to export transaction details to JSON.")
 
-    def print_receipt(self, total_with_tax):
+    @metrics.timed("checkout.render_receipt")
+    def render_receipt(self, total_amount, points_earned):
+        """Render the receipt for the transaction as a single string."""
+        summary = [("Total", f"£{money.format_pounds(total_amount)}"), ("Points Earned", points_earned)]
+        return rendering.render_receipt(self.cart, summary, "Thank you for shopping with us! See you again soon!")
+
+    def print_receipt(self, total_amount, points_earned):
         """Print the receipt for the transaction."""
-        print("\n--- Receipt ---")
-        print("{:<10} {:<25} {:<10} {:<10}".format("ID", "Name", "Price(£)", "Quantity"))
-        print("-" * 60)
-        for product_id, name, quantity, price in self.cart:
-            print("{:<10} {:<25} {:<10.2f} {:<10}".format(product_id, name, price, quantity))
-        print("-" * 60)
-        print(f"Subtotal: £{self.total:.2f}")
-        print(f"Tax: £{self.total * self.tax_rate:.2f}")
-        print(f"Total: £{total_with_tax:.2f}")
-        print("Thank you for shopping with us!")
-
-# Example usage
-if __name__ == "__main__":
-    checkout = CheckoutSystem()
+        rendering.emit(self.render_receipt(total_amount, points_earned))
 
-    # Log in staff member
-    checkout.login()
 
-    # Allow customer to add items to cart
-    checkout.add_to_cart()
+# Run the checkout on its own, against the same databases as the grocery store
+if __name__ == "__main__":
+    inventory_system = InventorySystem()
+    data_layer = DataLayer()
+    checkout_system = CheckoutSystem(inventory_system, BusinessLogicLayer(data_layer))
+
+    # Log in staff member, then manage the cart and check out
+    checkout_system.login()
+    checkout_system.cart_menu(exit_label="Exit")
 
-    # Checkout
-    checkout.checkout()
+    inventory_system.close_connection()
+    data_layer.close()
@@ -0,0 +1,272 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import calendar
+from datetime import date
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import dates
+
+# Validation and normalisation for loyalty customers. BusinessLogicLayer runs
+# it on every customer added at the till; the CLI runs the same checks over an
+# exported or imported Customer.json / Customer.jsonl in parallel, catches
+# duplicates inside the file and against the database (through the CardNumber
+# and Email indexes), and optionally imports the clean rows.
+
+CUSTOMER_COLUMNS = ("CustomerID", "FirstName", "LastName", "Email", "PhoneNumber", "Address",
+                    "CardNumber", "IssueDate", "ExpiryDate", "TotalPoints")
+CHUNK_SIZE = 20_000
+LOOKUP_CHUNK = 500  # Values per IN (...) when checking the database for duplicates
+
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[a-z]{2,}$")
+_NON_DIGITS = re.compile(r"\D")
+_DOUBLED = [0, 2, 4, 6, 8, 1, 3, 5, 7, 9]  # Luhn: each digit doubled, with the two digits of the result added
+
+
+def luhn_check_digit(body):
+    """Luhn check digit for a card number body."""
+    total = 0
+    for position, digit in enumerate(reversed(body)):
+        value = int(digit) * (2 if position % 2 == 0 else 1)
+        total += value - 9 if value > 9 else value
+    return str((10 - total % 10) % 10)
+
+
+def luhn_valid(digits):
+    """True if a string of digits ends in the right Luhn check digit."""
+    total = sum(map(int, digits[-1::-2])) + sum(_DOUBLED[int(digit)] for digit in digits[-2::-2])
+    return total % 10 == 0
+
+
+def normalise_card_number(text):
+    """Return the card number in the stored form, four-digit groups separated by spaces."""
+    digits = _NON_DIGITS.sub("", str(text))
+    if not 12 <= len(digits) <= 19:
+        raise ValueError("Card number must have 12 to 19 digits.")
+    if not luhn_valid(digits):
+        raise ValueError("Card number fails the Luhn check; please re-enter it.")
+    return " ".join(digits[i:i + 4] for i in range(0, len(digits), 4))
+
+
+def normalise_email(text):
+    """Lower-case and validate an email address. A blank address is stored as None."""
+    email = str(text or "").strip().lower()
+    if not email:
+        return None
+    if not _EMAIL.match(email):
+        raise ValueError(f"Invalid email address: {text!r}")
+    return email
+
+
+def normalise_phone(text):
+    """Return a UK phone number as 11 digits starting with 0, e.g. '+44 7581 578575' -> '07581578575'."""
+    phone = str(text or "").strip()
+    if not phone:
+        return None
+    digits = _NON_DIGITS.sub("", phone.replace("(0)", ""))
+    if phone.startswith("+44"):
+        digits = "0" + digits[2:]
+    elif digits.startswith("0044"):
+        digits = "0" + digits[4:]
+    if len(digits) != 11 or digits[0] != "0":
+        raise ValueError(f"Invalid phone number: {text!r}")
+    return digits
+
+
+def parse_expiry(text):
+    """Parse a card expiry date: DD/MM/YYYY, ISO, or MM/YY as printed on cards (the last day of that month)."""
+    text = str(text or "").strip()
+    if len(text) == 5 and text[2] == "/" and text.replace("/", "").isdigit():
+        month, year = int(text[:2]), 2000 + int(text[3:])
+        if not 1 <= month <= 12:
+            raise ValueError(f"Invalid expiry date: {text!r}")
+        return date(year, month, calendar.monthrange(year, month)[1]).isoformat()
+    return dates.parse_date(text)
+
+
+def validate_customer(record, today=None):
+    """Normalise one customer record (a dict keyed by Customer column names).
+
+    Returns (customer, errors); customer is only complete when errors is empty.
+    """
+    today = today or dates.today()
+    customer, errors = dict(record), []
+    for column in ("FirstName", "LastName"):
+        customer[column] = str(record.get(column) or "").strip()
+        if not customer[column]:
+            errors.append(f"{column} is required.")
+    for column, normalise in (("Email", normalise_email), ("PhoneNumber", normalise_phone),
+                              ("CardNumber", normalise_card_number)):
+        try:
+            customer[column] = normalise(record.get(column))
+        except ValueError as e:
+            errors.append(str(e))
+    try:
+        customer["IssueDate"] = dates.parse_date(record["IssueDate"]) if record.get("IssueDate") else today
+        customer["ExpiryDate"] = parse_expiry(record.get("ExpiryDate"))
+        if customer["ExpiryDate"] <= customer["IssueDate"]:
+            errors.append("Expiry date must be after the issue date.")
+        elif customer["ExpiryDate"] < today:
+            errors.append(f"Card expired on {dates.format_date(customer['ExpiryDate'])}.")
+    except ValueError as e:
+        errors.append(str(e))
+    customer["Address"] = str(record.get("Address") or "").strip()
+    return customer, errors
+
+
+def clean_customer(first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date):
+    """Validate a customer typed at the till. Returns the normalised dict or raises ValueError listing every problem."""
+    customer, errors = validate_customer({
+        "FirstName": first_name, "LastName": last_name, "Email": email, "PhoneNumber": phone_number,
+        "Address": address, "CardNumber": card_number, "IssueDate": issue_date, "ExpiryDate": expiry_date,
+    })
+    if errors:
+        raise ValueError(" ".join(errors))
+    return customer
+
+
+# Batch pass
+
+# Positions in a CUSTOMER_COLUMNS row of the values that must be unique
+UNIQUE_COLUMNS = {"CustomerID": 0, "Email": 3, "CardNumber": 6}
+
+
+def _validate_chunk(job):
+    """Worker: validate a chunk of records (dicts, or raw JSON Lines).
+
+    Returns (valid, rejected): valid rows are CUSTOMER_COLUMNS tuples, which are
+    much cheaper to send back to the parent than dicts.
+    """
+    records, today = job
+    valid, rejected = [], []
+    for record in records:
+        if isinstance(record, str):
+            try:
+                record = json.loads(record)
+            except ValueError:
+                rejected.append((record, ["Not valid JSON."]))
+                continue
+        customer, errors = validate_customer(record, today)
+        if errors:
+            rejected.append((record, errors))
+        else:
+            customer["TotalPoints"] = customer.get("TotalPoints") or 0
+            valid.append(tuple(customer.get(column) for column in CUSTOMER_COLUMNS))
+    return valid, rejected
+
+
+def read_chunks(file_name, size=CHUNK_SIZE):
+    """Yield lists of records from a JSON array file, or lists of raw lines from a JSON Lines file."""
+    if file_name.endswith(".jsonl"):
+        with open(file_name) as jsonl_file:
+            chunk = []
+            for line in jsonl_file:
+                if line.strip():
+                    chunk.append(line)
+                    if len(chunk) == size:
+                        yield chunk
+                        chunk = []
+            if chunk:
+                yield chunk
+    else:
+        with open(file_name) as json_file:
+            records = json.load(json_file)
+        for start in range(0, len(records), size):
+            yield records[start:start + size]
+
+
+def _validate_in_order(chunks, today, workers):
+    """Validate chunks in a process pool, in order, with at most two chunks per worker in flight
+    so huge files are never read in all at once. A single worker validates in this process."""
+    if workers == 1:
+        for chunk in chunks:
+            yield _validate_chunk((chunk, today))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_validate_chunk, (chunk, today)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _existing(conn, column, values):
+    """The subset of values already present in Customer.column, looked up through its index."""
+    found = set()
+    values = list(values)
+    for start in range(0, len(values), LOOKUP_CHUNK):
+        chunk = values[start:start + LOOKUP_CHUNK]
+        found.update(row[0] for row in conn.execute(
+            f"SELECT {column} FROM Customer WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk))
+    return found
+
+
+def run(file_name, conn=None, workers=None, import_rows=False, rejects_file=None):
+    """Validate every customer in file_name. Returns (valid, rejected) counts.
+
+    Duplicates (same CustomerID, card number or email) are rejected whether they
+    repeat an earlier row of the file or a customer already in the database.
+    """
+    seen = {column: set() for column in UNIQUE_COLUMNS}
+    valid_count = rejected_count = 0
+    rejects = open(rejects_file, "w") if rejects_file else None
+    insert = (f"INSERT INTO Customer ({', '.join(CUSTOMER_COLUMNS)}) "
+              f"VALUES ({', '.join('?' * len(CUSTOMER_COLUMNS))})")
+    for valid, rejected in _validate_in_order(read_chunks(file_name), dates.today(), workers or os.cpu_count()):
+        in_db = {column: set() for column in UNIQUE_COLUMNS}
+        if conn is not None:
+            for column, index in UNIQUE_COLUMNS.items():
+                in_db[column] = _existing(conn, column, {row[index] for row in valid} - {None})
+        clean = []
+        for row in valid:
+            duplicates = [column for column, index in UNIQUE_COLUMNS.items() if row[index] is not None
+                          and (row[index] in seen[column] or row[index] in in_db[column])]
+            if duplicates:
+                rejected.append((dict(zip(CUSTOMER_COLUMNS, row)), [f"Duplicate {column}." for column in duplicates]))
+                continue
+            for column, index in UNIQUE_COLUMNS.items():
+                if row[index] is not None:
+                    seen[column].add(row[index])
+            clean.append(row)
+
+        if import_rows and clean:
+            conn.executemany(insert, clean)
+            conn.commit()
+        if rejects:
+            rejects.write("".join(json.dumps({"record": record, "errors": errors}) + "\n" for record, errors in rejected))
+        valid_count += len(clean)
+        rejected_count += len(rejected)
+    if rejects:
+        rejects.close()
+    return valid_count, rejected_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate (and optionally import) loyalty customers from JSON or JSON Lines.")
+    parser.add_argument("file", help="Customer.json or Customer.jsonl")
+    parser.add_argument("--db", help="loyalty database to check for duplicates against (and import into)")
+    parser.add_argument("--import", dest="import_rows", action="store_true", help="insert the valid customers into --db")
+    parser.add_argument("--rejects", help="write rejected rows and their errors to this JSON Lines file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    if args.import_rows and not args.db:
+        parser.error("--import needs --db")
+
+    conn = None
+    if args.db:
+        from data_access import DataLayer
+        conn = DataLayer(args.db).conn  # Creates the tables and duplicate-check indexes if needed
+
+    began = time.perf_counter()
+    valid, rejected = run(args.file, conn, args.workers, args.import_rows, args.rejects)
+    elapsed = time.perf_counter() - began
+    print(f"{valid} valid and {rejected} rejected customers in {elapsed:.1f}s "
+          f"({(valid + rejected) / elapsed * 60:,.0f} rows/minute).")
+    if conn is not None:
+        conn.close()
+    sys.exit(1 if rejected else 0)
@@ -0,0 +1,846 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from datetime import date, timedelta
+from itertools import groupby
+from operator import itemgetter
+from urllib.request import pathname2url
+import money
+import dates
+import metrics
+from search_index import ProductSearchIndex
+from barcodes import BarcodeTable
+from stock_ledger import StockLedger
+from category_tree import CategoryTree, render_report
+from catalog_snapshot import CatalogPublisher, CatalogSnapshot
+from journal import Journal
+
+# The inventory and loyalty data access shared by every entry point
+# (grocery_store.py, inventory_system.py, checkout_system.py and
+# loyalty_card_system.py) and by the tools, so there is one schema, one set of
+# default database files and one sign convention for stock changes.
+#
+# sqlite3 keeps each connection's prepared statements in a cache keyed by the
+# SQL text, and a statement that misses it is compiled again, which costs about
+# as much as running it. The inventory connection is shared by the search
+# index, barcodes, stock ledger, category tree, catalogue and checkout commit,
+# so connections are opened with room for every statement they issue.
+# Single-product lookups are mapped straight from the cursor to a slotted
+# Product rather than through a dict.
+
+INVENTORY_DB = "InventorySystem.db"
+LOYALTY_DB = "LoyaltyCardSystem.db"
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection; sqlite3's default is 128
+
+# Statements kept here, rather than inline, so query_audit.py explains exactly what runs.
+# {where} is "" or NAME_FILTER_SQL.
+ALL_PRODUCTS_SQL = "SELECT product_id, name, price_pence, quantity FROM inventory"
+NAME_FILTER_SQL = " WHERE name LIKE ?"
+PRODUCTS_COUNT_SQL = "SELECT COUNT(*) FROM inventory{where}"
+PRODUCTS_PAGE_SQL = "SELECT product_id, name, price_pence, quantity FROM inventory{where} ORDER BY rowid LIMIT ? OFFSET ?"
+PRODUCT_SQL = "SELECT product_id, name, price_pence, quantity FROM inventory WHERE product_id = ?"
+PRODUCT_STOCK_SQL = "SELECT quantity FROM inventory WHERE product_id = ?"
+UPDATE_PRICE_SQL = "UPDATE inventory SET price_pence = ? WHERE product_id = ?"
+FORECAST_SQL = "SELECT daily_units, weekday_factors, as_of FROM forecasts WHERE product_id = ?"
+SUGGESTIONS_SQL = """SELECT s.suggested_id, i.name, s.confidence FROM product_suggestions s
+                     JOIN inventory i ON i.product_id = s.suggested_id
+                     WHERE s.product_id = ? ORDER BY s.rank LIMIT ?"""
+
+DUPLICATE_CUSTOMER_SQL = """SELECT CustomerID FROM Customer WHERE CardNumber = ?
+                            UNION ALL
+                            SELECT CustomerID FROM Customer WHERE Email = ?
+                            LIMIT 1"""
+ADD_POINTS_SQL = "UPDATE Customer SET TotalPoints = TotalPoints + ? WHERE CustomerID = ?"
+SPEND_POINTS_SQL = "UPDATE Customer SET TotalPoints = TotalPoints - ? WHERE CustomerID = ?"
+CUSTOMER_POINTS_SQL = "SELECT TotalPoints FROM Customer WHERE CustomerID = ?"
+CARD_BLOCKED_ON_SQL = "SELECT BlockedOn FROM Customer WHERE CustomerID = ?"
+REWARD_POINTS_SQL = "SELECT PointsRequired FROM Reward WHERE RewardID = ?"
+RELEASE_HELD_ACCRUAL_SQL = """UPDATE FraudAlerts SET Action = 'released'
+                              WHERE AlertID = ? AND Activity = 'accrual' AND Action = 'held' AND Points IS NOT NULL"""
+SEGMENT_SQL = "SELECT Segment, Tier FROM CustomerSegment WHERE CustomerID = ?"
+TRANSACTIONS_SINCE_SQL = """SELECT TransactionID, CustomerID, TransactionDate, TotalAmountPence, PointsEarned
+                            FROM Transactions WHERE TransactionDate >= ? ORDER BY TransactionDate"""
+CUSTOMER_TRANSACTIONS_SINCE_SQL = """SELECT TransactionID, CustomerID, TransactionDate, TotalAmountPence, PointsEarned
+                                     FROM Transactions WHERE CustomerID = ? AND TransactionDate >= ?
+                                     ORDER BY TransactionDate"""
+EXPORT_TABLE_SQL = "SELECT * FROM {table}"
+
+
+def connect(db_file):
+    """Open a connection with a statement cache large enough for everything the systems run on it."""
+    conn = metrics.connect(db_file, cached_statements=STATEMENT_CACHE_SIZE)
+    # New databases hand back the space archive.py frees a step at a time; older ones are converted by its first run
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    return conn
+
+
+def connect_read_only(db_file):
+    """Open a connection that cannot write, for batch job workers and for reading the live databases' journals."""
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_file))}?mode=ro", uri=True)
+
+
+class Product:
+    """One inventory row. Prices are in pence."""
+    __slots__ = ("product_id", "name", "price_pence", "quantity")
+
+    def __init__(self, product_id, name, price_pence, quantity):
+        self.product_id = product_id
+        self.name = name
+        self.price_pence = price_pence
+        self.quantity = quantity
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """Row factory for cursors selecting product_id, name, price_pence, quantity."""
+        return cls(*row)
+
+    def __repr__(self):
+        return f"Product({self.product_id!r}, {self.name!r}, {self.price_pence!r}, {self.quantity!r})"
+
+
+# INVENTORY SYSTEM
+@metrics.instrument("inventory")
+class InventorySystem:
+    def __init__(self, db_file=INVENTORY_DB, lane_queue=None, lane=None, catalog_dir=None):
+        """Initialize the Inventory System and connect to the database.
+
+        With catalog_dir, product names, prices and categories are read from the
+        shared catalogue snapshot published there, and adding a product or
+        changing a price publishes a new version of it.
+        """
+        self.db_file = db_file
+        self.lane_queue = lane_queue  # Optional write-ahead queue for stock updates
+        self.lane = lane if lane is not None else (lane_queue.lane if lane_queue else None)  # Recorded on stock movements
+        self.conn = connect(self.db_file)
+        self.create_tables()  # Create all necessary tables
+        self._products = self.conn.cursor()  # Kept for single-product lookups, which it returns as Product rows
+        self._products.row_factory = Product.from_row
+        self.search_index = ProductSearchIndex(self.conn)  # Name search, kept in sync by triggers
+        self.stock_ledger = StockLedger(self.conn)  # Every stock change, for audits and stock at a past time
+        self.category_tree = CategoryTree(self.conn)  # Category hierarchy with per-subtree stock and sales totals
+        self.catalog_publisher = self.catalog = None
+        self.initialize_products()
+        if catalog_dir:
+            self.catalog_publisher = CatalogPublisher(self.conn, catalog_dir)
+            self.catalog = CatalogSnapshot(catalog_dir)
+        self.barcodes = BarcodeTable(self.conn, self.catalog)  # Barcode and PLU codes for each product
+        self.journal = Journal(self.conn)  # Every row change, for point-in-time restore from backups (backup.py)
+
+    def create_tables(self):
+        """Create all necessary tables in the database."""
+        try:
+            cursor = self.conn.cursor()
+
+            # Create Categories Table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS categories (
+                    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    parent_id INTEGER REFERENCES categories(category_id)
+                )
+            """)
+
+            # Create Inventory Table with a foreign key to Categories Table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS inventory (
+                    product_id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    price_pence INTEGER NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    category_id INTEGER,
+                    FOREIGN KEY (category_id) REFERENCES categories(category_id)
+                )
+            """)
+
+            # Create Sales Table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sales (
+                    sale_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sale_date TEXT NOT NULL,
+                    total_pence INTEGER NOT NULL,
+                    basket TEXT
+                )
+            """)
+
+            # Create Sales_Items Table, linking Sales and Inventory
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sales_items (
+                    sales_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sale_id INTEGER,
+                    product_id TEXT,
+                    quantity INTEGER NOT NULL,
+                    price_pence INTEGER NOT NULL,
+                    FOREIGN KEY (sale_id) REFERENCES sales(sale_id),
+                    FOREIGN KEY (product_id) REFERENCES inventory(product_id)
+                )
+            """)
+
+            # Create Forecasts Table (written by forecast.py): expected daily sales and their weekly pattern
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS forecasts (
+                    product_id TEXT PRIMARY KEY,
+                    daily_units REAL NOT NULL,
+                    weekday_factors TEXT NOT NULL,
+                    next_week_units REAL NOT NULL,
+                    as_of TEXT NOT NULL,
+                    computed_at TEXT NOT NULL,
+                    FOREIGN KEY (product_id) REFERENCES inventory(product_id)
+                )
+            """)
+
+            # Create Product_Suggestions Table (written by market_basket.py): products often bought together, best first
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS product_suggestions (
+                    product_id TEXT NOT NULL,
+                    rank INTEGER NOT NULL,
+                    suggested_id TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    lift REAL NOT NULL,
+                    baskets INTEGER NOT NULL,
+                    computed_at TEXT NOT NULL,
+                    PRIMARY KEY (product_id, rank)
+                ) WITHOUT ROWID
+            """)
+
+            # Create Returns and Return_Items Tables (written by returns.py): refunds against a sale and what came back
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS returns (
+                    return_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sale_id INTEGER NOT NULL,
+                    reference TEXT NOT NULL UNIQUE,
+                    returned_at TEXT NOT NULL,
+                    refund_pence INTEGER NOT NULL,
+                    customer_id INTEGER,
+                    points_reversed INTEGER NOT NULL,
+                    FOREIGN KEY (sale_id) REFERENCES sales(sale_id)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS return_items (
+                    return_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    return_id INTEGER NOT NULL,
+                    product_id TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    price_pence INTEGER NOT NULL,
+                    FOREIGN KEY (return_id) REFERENCES returns(return_id),
+                    FOREIGN KEY (product_id) REFERENCES inventory(product_id)
+                )
+            """)
+
+            self.conn.commit()
+
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_sale_date ON sales (sale_date)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_items_sale_id ON sales_items (sale_id)")  # Archived with their sale
+            # A sale's basket ID links it to its stock movements and stops it being recorded twice
+            if "basket" not in {row[1] for row in cursor.execute("PRAGMA table_info(sales)")}:
+                cursor.execute("ALTER TABLE sales ADD COLUMN basket TEXT")
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_basket ON sales (basket)")
+            # The loyalty customer a sale's points went to, so a return can take them back
+            if "customer_id" not in {row[1] for row in cursor.execute("PRAGMA table_info(sales)")}:
+                cursor.execute("ALTER TABLE sales ADD COLUMN customer_id INTEGER")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_returns_sale_id ON returns (sale_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_return_items_return_id ON return_items (return_id)")
+            self.conn.commit()
+
+            # Convert databases created before prices were stored in pence and dates as ISO-8601
+            money.migrate_db(self.conn)
+            dates.migrate_db(self.conn)
+        except Exception as e:
+            metrics.count_error("inventory.create_tables")
+            print(f"Error creating tables: {e}")
+
+    def get_all_products(self):
+        """Fetch all products from the inventory."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(ALL_PRODUCTS_SQL)
+            products = cursor.fetchall()
+            return products
+        except Exception as e:
+            metrics.count_error("inventory.get_all_products")
+            print(f"Error getting all products: {e}")
+            return []
+
+    def get_products_page(self, page=1, page_size=20, name_filter=None):
+        """Fetch one page of products, optionally filtered by name, along with the total number of matches."""
+        try:
+            cursor = self.conn.cursor()
+            where, params = "", ()
+            if name_filter:
+                where, params = NAME_FILTER_SQL, (f"%{name_filter}%",)
+            cursor.execute(PRODUCTS_COUNT_SQL.format(where=where), params)
+            total_count = cursor.fetchone()[0]
+            cursor.execute(PRODUCTS_PAGE_SQL.format(where=where), params + (page_size, (page - 1) * page_size))
+            return cursor.fetchall(), total_count
+        except Exception as e:
+            metrics.count_error("inventory.get_products_page")
+            print(f"Error getting products page: {e}")
+            return [], 0
+
+    def export_to_json(self, file_name="inventory_data.json"):
+        """Export inventory data to a JSON file."""
+        try:
+            products = self.get_all_products()
+            data = [{"product_id": p[0], "name": p[1], "price_pence": p[2], "quantity": p[3]} for p in products]
+            with open(file_name, "w") as json_file:
+                json.dump(data, json_file, indent=4)
+            print(f"Inventory data exported successfully to {file_name}.")
+        except Exception as e:
+            metrics.count_error("inventory.export_to_json")
+            print(f"Error exporting to JSON: {e}")
+
+    def get_product_details(self, product_id):
+        """Fetch a single product by its ID as a Product, or None if it is not found."""
+        try:
+            product = self.catalog.lookup(product_id) if self.catalog else None
+            if product:
+                # Every lane charges the published price; only the stock level is read from the database
+                stock = self.conn.execute(PRODUCT_STOCK_SQL, (product_id,)).fetchone()
+                if stock:
+                    return Product(product_id, product[0], product[1], stock[0])
+            return self._products.execute(PRODUCT_SQL, (product_id,)).fetchone()
+        except Exception as e:
+            metrics.count_error("inventory.get_product_details")
+            print(f"Error fetching product details: {e}")
+            return None
+
+    def search_products(self, query, category_id=None, limit=10):
+        """Find products whose name matches the query, best matches first."""
+        try:
+            return self.search_index.search(query, category_id, limit)
+        except Exception as e:
+            metrics.count_error("inventory.search_products")
+            print(f"Error searching products: {e}")
+            return []
+
+    def add_barcode(self, product_id, code):
+        """Register a barcode or PLU code for a product."""
+        if not self.get_product_details(product_id):
+            print(f"Error adding barcode: product {product_id} not found")
+            return None
+        try:
+            return self.barcodes.add_barcode(code, product_id)
+        except Exception as e:
+            metrics.count_error("inventory.add_barcode")
+            print(f"Error adding barcode: {e}")
+            return None
+
+    def lookup_barcode(self, code):
+        """Return the product ID a barcode or PLU code belongs to, or None."""
+        return self.barcodes.lookup(code)
+
+    def scan_items(self, codes):
+        """Resolve a burst of scanned codes into (product_id, name, quantity, price_pence, stock) lines."""
+        try:
+            return self.barcodes.resolve_scans(codes)
+        except Exception as e:
+            metrics.count_error("inventory.scan_items")
+            print(f"Error resolving scanned items: {e}")
+            return [], list(codes)
+
+    def initialize_products(self):
+        """Initialize the database with some sample products if it's empty."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM inventory")
+            if cursor.fetchone()[0] == 0:
+                # Sample categories
+                cursor.execute("INSERT INTO categories (name) VALUES ('Dairy')")                    # CategoryID: 1
+                cursor.execute("INSERT INTO categories (name) VALUES ('Snacks')")                   # CategoryID: 2
+                cursor.execute("INSERT INTO categories (name) VALUES ('Beverages')")                # CategoryID: 3
+                cursor.execute("INSERT INTO categories (name) VALUES ('Bakery')")                   # CategoryID: 4
+                cursor.execute("INSERT INTO categories (name) VALUES ('Fruit & Veg.')")             # CategoryID: 5
+                cursor.execute("INSERT INTO categories (name) VALUES ('Frozen Foods')")             # CategoryID: 6
+                cursor.execute("INSERT INTO categories (name) VALUES ('Toiletries & Beauty')")      # CategoryID: 7
+                cursor.execute("INSERT INTO categories (name) VALUES ('Home & Entertainment')")     # CategoryID: 8
+                cursor.execute("INSERT INTO categories (name) VALUES ('Clothing')")                 # CategoryID: 9
+                cursor.execute("INSERT INTO categories (name) VALUES ('Other')")                    # CategoryID: 10
+                
+                # Sample products
+                self.add_product("1", "Milk", 150, 25, 1)  # Category 1 (Dairy)
+                self.add_product("2", "Bread", 100, 25, 2)  # Category 4 (Bakery)
+                self.add_product("3", "Eggs", 250, 20, 1)  # Category 10 (Other)
+                self.add_product("4", "Butter", 200, 30, 1)  # Category 1 (Dairy)
+                self.add_product("5", "Chocolate Bar", 75, 45, 2)  # Category 2 (Snacks)
+                self.add_product("6", "Crisps", 125, 45, 2)  # Category 2 (Snacks)
+                self.add_product("7", "Soda Can", 100, 45, 3)  # Category 3 (Beverages)
+                self.add_product("8", "Toothpaste", 300, 50, 1)  # Category 7 (Toiletries & Beauty)
+                self.add_product("9", "Shampoo", 450, 40, 1)  # Category 7 (Toiletries & Beauty)
+                self.add_product("10", "Packet of Biscuits", 200, 30, 2)  # Category 2 (Snacks)
+                self.conn.commit()
+        except Exception as e:
+            metrics.count_error("inventory.initialize_products")
+            print(f"Error initializing products: {e}")
+
+    def add_product(self, product_id, name, price_pence, quantity, category_id):
+        """Add a product to the inventory. The price is given in pence."""
+        try:
+            cursor = self.conn.cursor()
+            # The opening stock goes in as the product's first stock movement
+            cursor.execute("INSERT INTO inventory (product_id, name, price_pence, quantity, category_id) VALUES (?, ?, ?, 0, ?)",
+                           (product_id, name, price_pence, category_id))
+            for sql, params in StockLedger.stock_change_statements([(product_id, quantity)], "initial", self.lane):
+                cursor.execute(sql, params)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            metrics.count_error("inventory.add_product")
+            print(f"Error adding product: {e}")
+            return
+        self.publish_catalog()
+
+    def update_price(self, product_id, price_pence):
+        """Change a product's price (in pence). Returns True if the product exists."""
+        try:
+            cursor = self.conn.execute(UPDATE_PRICE_SQL, (price_pence, product_id))
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            metrics.count_error("inventory.update_price")
+            print(f"Error updating price: {e}")
+            return False
+        self.publish_catalog()
+        return cursor.rowcount > 0
+
+    def publish_catalog(self):
+        """Publish a new catalogue snapshot version if products have changed, and start reading it."""
+        if not self.catalog_publisher:
+            return
+        try:
+            self.catalog_publisher.publish_if_changed()
+            self.catalog.refresh()
+        except Exception as e:
+            metrics.count_error("inventory.publish_catalog")
+            print(f"Error publishing catalogue snapshot: {e}")
+
+    def display_inventory(self):
+        """Return the list of all products in the inventory."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(ALL_PRODUCTS_SQL)
+            products = cursor.fetchall()
+            return products
+        except Exception as e:
+            metrics.count_error("inventory.display_inventory")
+            print(f"Error displaying inventory: {e}")
+            return []
+
+    def _apply_stock_statements(self, statements):
+        """Run stock change statements in one transaction, or queue them as one entry when writing ahead."""
+        if self.lane_queue:
+            # Write-ahead: queued locally and applied to the database by the lane's replayer
+            self.lane_queue.enqueue(self.db_file, statements)
+            return
+        cursor = self.conn.cursor()
+        for sql, group in groupby(statements, key=itemgetter(0)):
+            cursor.executemany(sql, [params for _, params in group])
+        self.conn.commit()
+
+    def update_quantity(self, product_id, quantity_purchased, reason="sale", basket=None):
+        """Update the quantity of a product after purchase, recording the stock movement."""
+        try:
+            self._apply_stock_statements(StockLedger.stock_change_statements(
+                [(product_id, -quantity_purchased)], reason, self.lane, basket))
+        except Exception as e:
+            self.conn.rollback()
+            metrics.count_error("inventory.update_quantity")
+            print(f"Error updating quantity: {e}")
+
+    def update_quantities(self, items, reason="sale", basket=None):
+        """Update the quantities of several products after purchase in a single commit."""
+        try:
+            self._apply_stock_statements(StockLedger.stock_change_statements(
+                [(product_id, -quantity_purchased) for product_id, quantity_purchased in items], reason, self.lane, basket))
+        except Exception as e:
+            self.conn.rollback()
+            metrics.count_error("inventory.update_quantities")
+            print(f"Error updating quantities: {e}")
+
+    def record_stock_count(self, product_id, counted):
+        """Set a product's stock to a physical count; the difference is recorded as a stock_count movement."""
+        try:
+            self._apply_stock_statements(StockLedger.stock_count_statements(product_id, counted, self.lane))
+        except Exception as e:
+            self.conn.rollback()
+            metrics.count_error("inventory.record_stock_count")
+            print(f"Error recording stock count: {e}")
+
+    def add_category(self, name, parent_id=None):
+        """Add a category, optionally under a parent category. Returns its ID."""
+        try:
+            return self.category_tree.add_category(name, parent_id)
+        except Exception as e:
+            self.conn.rollback()
+            metrics.count_error("inventory.add_category")
+            print(f"Error adding category: {e}")
+            return None
+
+    def move_category(self, category_id, parent_id):
+        """Move a category and everything in it under another parent (None for top level)."""
+        try:
+            self.category_tree.move_category(category_id, parent_id)
+            return True
+        except Exception as e:
+            self.conn.rollback()
+            metrics.count_error("inventory.move_category")
+            print(f"Error moving category: {e}")
+            return False
+
+    def category_report(self, parent_id=None):
+        """Render stock and sales totals for each category below parent_id (the whole tree by default)."""
+        try:
+            return render_report(self.category_tree, parent_id)
+        except Exception as e:
+            metrics.count_error("inventory.category_report")
+            print(f"Error building category report: {e}")
+            return ""
+
+    def save_forecasts(self, rows):
+        """Insert or replace a batch of forecasts rows in one transaction."""
+        self.conn.executemany("""INSERT OR REPLACE INTO forecasts (product_id, daily_units, weekday_factors, next_week_units,
+                                                                 as_of, computed_at)
+                                 VALUES (?, ?, ?, ?, ?, ?)""", rows)
+        self.conn.commit()
+
+    def get_forecast(self, product_id, days=7):
+        """Expected units sold on each of the days from the forecast's as_of date, as (YYYY-MM-DD, units), or None."""
+        row = self.conn.execute(FORECAST_SQL, (product_id,)).fetchone()
+        if not row:
+            return None
+        daily_units, weekday_factors, as_of = row
+        factors = [float(factor) for factor in weekday_factors.split(",")]  # Monday first
+        first = date.fromisoformat(as_of)
+        span = [first + timedelta(days=offset) for offset in range(days)]
+        return [(day.isoformat(), daily_units * factors[day.weekday()]) for day in span]
+
+    def save_suggestions(self, rows):
+        """Insert or replace a batch of product_suggestions rows in one transaction."""
+        self.conn.executemany("""INSERT OR REPLACE INTO product_suggestions (product_id, rank, suggested_id, confidence, lift,
+                                                                           baskets, computed_at)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+        self.conn.commit()
+
+    def get_suggestions(self, product_id, limit=3):
+        """(product_id, name, confidence) of the products most often bought with a product, best first."""
+        return self.conn.execute(SUGGESTIONS_SQL, (product_id, limit)).fetchall()
+
+    def close_connection(self):
+        """Close the database connection."""
+        self.conn.close()
+
+
+# LOYALTY CARD SYSTEM
+@metrics.instrument("loyalty")
+class DataLayer:
+    def __init__(self, db_name=LOYALTY_DB, lane_queue=None):
+        self.db_name = db_name
+        self.lane_queue = lane_queue  # Optional write-ahead queue for loyalty transactions
+        self.conn = connect(db_name)
+        self.cursor = self.conn.cursor()
+        self._initialize_tables()
+        self.journal = Journal(self.conn)  # Every row change, for point-in-time restore from backups (backup.py)
+
+    def _initialize_tables(self):
+        # Create Customer table
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS Customer (
+                                    CustomerID INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    FirstName TEXT,
+                                    LastName TEXT,
+                                    Email TEXT,
+                                    PhoneNumber TEXT,
+                                    Address TEXT,
+                                    CardNumber TEXT,
+                                    IssueDate TEXT,
+                                    ExpiryDate TEXT,
+                                    TotalPoints INTEGER DEFAULT 0
+                                )''')
+
+        # Create Transactions table
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS Transactions (
+                                    TransactionID INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    CustomerID INTEGER,
+                                    TransactionDate TEXT,
+                                    TotalAmountPence INTEGER,
+                                    PointsEarned INTEGER,
+                                    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID)
+                                )''')
+
+        # Create RewardRedemption table
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS RewardRedemption (
+                                    RedemptionID INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    CustomerID INTEGER,
+                                    RewardID INTEGER,
+                                    RedemptionDate TEXT,
+                                    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID),
+                                    FOREIGN KEY (RewardID) REFERENCES Reward(RewardID)
+                                )''')
+
+        # Create Reward table
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS Reward (
+                                    RewardID INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    RewardName TEXT,
+                                    Description TEXT,
+                                    PointsRequired INTEGER
+                                )''')
+
+        # Create ArchivedTransactionTotals table: each customer's history moved to the monthly archives by archive.py
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS ArchivedTransactionTotals (
+                                    CustomerID INTEGER PRIMARY KEY,
+                                    TransactionCount INTEGER NOT NULL,
+                                    TotalAmountPence INTEGER NOT NULL,
+                                    PointsEarned INTEGER NOT NULL,
+                                    LastTransactionDate TEXT,
+                                    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID)
+                                )''')
+
+        # Create CustomerSegment table (written by rfm.py, read at the till)
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS CustomerSegment (
+                                    CustomerID INTEGER PRIMARY KEY,
+                                    RecencyDays INTEGER,
+                                    Frequency INTEGER,
+                                    MonetaryPence INTEGER,
+                                    RScore INTEGER,
+                                    FScore INTEGER,
+                                    MScore INTEGER,
+                                    Segment TEXT,
+                                    Tier TEXT,
+                                    ComputedAt TEXT,
+                                    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID)
+                                )''')
+
+        # Create PointsExpiry table: points taken off balances by points_expiry.py, for finance
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS PointsExpiry (
+                                    ExpiryID INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    CustomerID INTEGER NOT NULL,
+                                    ExpiredOn TEXT NOT NULL,
+                                    Points INTEGER NOT NULL,
+                                    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID)
+                                )''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_PointsExpiry_CustomerID ON PointsExpiry (CustomerID)")
+
+        # Create FraudAlerts table: bursts of card activity found by fraud.py; held accruals keep their amount and
+        # points, and a till sale's alert its basket, so a return before the release takes them off the alert
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS FraudAlerts (
+                                    AlertID INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    CustomerID INTEGER NOT NULL,
+                                    Activity TEXT NOT NULL,
+                                    Action TEXT NOT NULL,
+                                    Events INTEGER NOT NULL,
+                                    WindowSeconds INTEGER NOT NULL,
+                                    Source TEXT NOT NULL,
+                                    HappenedAt TEXT NOT NULL,
+                                    DetectedAt TEXT NOT NULL,
+                                    AmountPence INTEGER,
+                                    Points INTEGER,
+                                    Basket TEXT,
+                                    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID)
+                                )''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_FraudAlerts_Basket ON FraudAlerts (Basket)")
+        # Cards past their ExpiryDate are blocked by points_expiry.py and earn no more points
+        if "BlockedOn" not in {row[1] for row in self.cursor.execute("PRAGMA table_info(Customer)")}:
+            self.cursor.execute("ALTER TABLE Customer ADD COLUMN BlockedOn TEXT")
+
+        # History is read by customer and date range ("last 30 days") and by date range alone
+        self.cursor.execute("DROP INDEX IF EXISTS idx_Transactions_CustomerID")  # Superseded by the composite index
+        self.cursor.execute("""CREATE INDEX IF NOT EXISTS idx_Transactions_CustomerID_TransactionDate
+                               ON Transactions (CustomerID, TransactionDate)""")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_Transactions_TransactionDate ON Transactions (TransactionDate)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_RewardRedemption_RedemptionDate ON RewardRedemption (RedemptionDate)")
+
+        # New customers are checked against these for duplicates
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_Customer_CardNumber ON Customer (CardNumber)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_Customer_Email ON Customer (Email)")
+        self.conn.commit()
+
+        # Convert databases created before amounts were stored in pence and dates as ISO-8601
+        money.migrate_db(self.conn)
+        dates.migrate_db(self.conn)
+
+    def add_customer(self, first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date):
+        self.cursor.execute('''INSERT INTO Customer (FirstName, LastName, Email, PhoneNumber, Address, CardNumber, IssueDate, ExpiryDate) 
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', 
+                            (first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date))
+        self.conn.commit()
+
+    def find_duplicate_customer(self, card_number, email):
+        """Return the CustomerID of an existing customer with this card number or email, or None."""
+        row = self.cursor.execute(DUPLICATE_CUSTOMER_SQL, (card_number, email)).fetchone()
+        return row[0] if row else None
+
+    def record_transaction(self, customer_id, transaction_date, total_pence, points_earned):
+        if self.lane_queue:
+            # Write-ahead: both statements are applied together by the lane's replayer
+            self.lane_queue.enqueue(self.db_name, [
+                ("INSERT INTO Transactions (CustomerID, TransactionDate, TotalAmountPence, PointsEarned) VALUES (?, ?, ?, ?)",
+                 (customer_id, transaction_date, total_pence, points_earned)),
+                (ADD_POINTS_SQL, (points_earned, customer_id)),
+            ])
+            return
+        self.cursor.execute('''INSERT INTO Transactions (CustomerID, TransactionDate, TotalAmountPence, PointsEarned) 
+                                VALUES (?, ?, ?, ?)''', 
+                            (customer_id, transaction_date, total_pence, points_earned))
+        self.cursor.execute(ADD_POINTS_SQL, (points_earned, customer_id))
+        self.conn.commit()
+
+    def get_card_blocked_on(self, customer_id):
+        """The date a customer's card was blocked, or None if it is in use (or there is no such customer)."""
+        row = self.cursor.execute(CARD_BLOCKED_ON_SQL, (customer_id,)).fetchone()
+        return row[0] if row else None
+
+    def record_fraud_alert(self, customer_id, activity, action, events, window_seconds, happened_at,
+                           amount_pence=None, points=None):
+        """Record an alert from the inline monitor. Returns its AlertID."""
+        self.cursor.execute('''INSERT INTO FraudAlerts (CustomerID, Activity, Action, Events, WindowSeconds, Source,
+                                                       HappenedAt, DetectedAt, AmountPence, Points)
+                                VALUES (?, ?, ?, ?, ?, 'stream', ?, ?, ?, ?)''',
+                            (customer_id, activity, action, events, window_seconds, happened_at, dates.now(),
+                             amount_pence, points))
+        self.conn.commit()
+        return self.cursor.lastrowid
+
+    def record_fraud_alerts(self, rows):
+        """Insert a batch of (CustomerID, Activity, Action, Events, WindowSeconds, Source, HappenedAt, DetectedAt) alerts."""
+        self.cursor.executemany('''INSERT INTO FraudAlerts (CustomerID, Activity, Action, Events, WindowSeconds, Source,
+                                                           HappenedAt, DetectedAt)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        self.conn.commit()
+
+    def get_fraud_alerts(self, limit=50):
+        """The most recent alerts, newest first."""
+        return self.cursor.execute('''SELECT AlertID, CustomerID, Activity, Action, Events, WindowSeconds, Source, HappenedAt,
+                                             Points
+                                      FROM FraudAlerts ORDER BY AlertID DESC LIMIT ?''', (limit,)).fetchall()
+
+    def release_held_accrual(self, alert_id):
+        """Record a held accrual's transaction and add its points, once. Raises ValueError if there is none to release."""
+        # Marked released first, so a return of the sale cannot change the points between the read and the credit
+        self.cursor.execute(RELEASE_HELD_ACCRUAL_SQL, (alert_id,))
+        if not self.cursor.rowcount:
+            self.conn.rollback()
+            raise ValueError(f"Alert {alert_id} is not a held accrual.")
+        customer_id, happened_at, amount_pence, points = self.cursor.execute(
+            "SELECT CustomerID, HappenedAt, AmountPence, Points FROM FraudAlerts WHERE AlertID = ?", (alert_id,)).fetchone()
+        self.cursor.execute('''INSERT INTO Transactions (CustomerID, TransactionDate, TotalAmountPence, PointsEarned)
+                                VALUES (?, ?, ?, ?)''', (customer_id, happened_at, amount_pence, points))
+        self.cursor.execute(ADD_POINTS_SQL, (points, customer_id))
+        self.conn.commit()
+
+    def redeem_reward(self, customer_id, reward_id, redemption_date):
+        reward = self.cursor.execute(REWARD_POINTS_SQL, (reward_id,)).fetchone()
+        if not reward:
+            raise ValueError("Reward not found.")
+        
+        required_points = reward[0]
+        customer = self.cursor.execute(CUSTOMER_POINTS_SQL, (customer_id,)).fetchone()
+        if not customer:
+            raise ValueError("Customer not found.")
+
+        current_points = customer[0]
+        if current_points < required_points:
+            raise ValueError("Insufficient points to redeem this reward.")
+
+        self.cursor.execute('''INSERT INTO RewardRedemption (CustomerID, RewardID, RedemptionDate) 
+                                VALUES (?, ?, ?)''', 
+                            (customer_id, reward_id, redemption_date))
+        self.cursor.execute(SPEND_POINTS_SQL, (required_points, customer_id))
+        self.conn.commit()
+
+    def add_reward(self, reward_name, description, points_required):
+        self.cursor.execute('''INSERT INTO Reward (RewardName, Description, PointsRequired) 
+                                VALUES (?, ?, ?)''', 
+                            (reward_name, description, points_required))
+        self.conn.commit()
+
+    def save_customer_segments(self, rows):
+        """Insert or replace a batch of CustomerSegment rows in one transaction."""
+        self.cursor.executemany('''INSERT OR REPLACE INTO CustomerSegment (CustomerID, RecencyDays, Frequency, MonetaryPence,
+                                    RScore, FScore, MScore, Segment, Tier, ComputedAt)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        self.conn.commit()
+
+    def get_customer_segment(self, customer_id):
+        """Return (Segment, Tier) for a customer, or None if they have not been scored yet."""
+        return self.cursor.execute(SEGMENT_SQL, (customer_id,)).fetchone()
+
+    def get_transactions_since(self, since, customer_id=None):
+        """Transactions at or after an ISO date/timestamp, oldest first, optionally for one customer."""
+        if customer_id is None:
+            return self.cursor.execute(TRANSACTIONS_SINCE_SQL, (since,)).fetchall()
+        return self.cursor.execute(CUSTOMER_TRANSACTIONS_SINCE_SQL, (customer_id, since)).fetchall()
+
+    def export_data_to_json(self, table_name, file_name):
+        self.cursor.execute(EXPORT_TABLE_SQL.format(table=table_name))
+        rows = self.cursor.fetchall()
+        
+        # Get column names
+        columns = [description[0] for description in self.cursor.description]
+        
+        # Convert rows to dictionary format
+        data = [dict(zip(columns, row)) for row in rows]
+        
+        # Write to JSON file
+        with open(file_name, 'w') as json_file:
+            json.dump(data, json_file, indent=4)
+        
+        print(f"Data from {table_name} exported to {file_name} successfully.")
+
+    def close(self):
+        self.conn.close()
+
+
+# Benchmark: the time each hot call adds on top of running its statement
+# directly, and what the same statement costs when it misses the statement cache.
+
+def _per_call(func, calls, repeat=5):
+    """Best of repeat runs, in microseconds per call."""
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, time.perf_counter() - began)
+    return best / calls * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the per-call overhead of the shared data access.")
+    parser.add_argument("--calls", type=int, default=100_000)
+    parser.add_argument("--products", type=int, default=10_000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="grocery_access_")
+    try:
+        inventory = InventorySystem(os.path.join(work_dir, "inventory.db"))
+        inventory.conn.executemany("INSERT OR IGNORE INTO inventory (product_id, name, price_pence, quantity, category_id) "
+                                   "VALUES (?, ?, 100, 1000, 1)",
+                                   ((str(n), f"Product {n}") for n in range(1, args.products + 1)))
+        inventory.conn.commit()
+        data_layer = DataLayer(os.path.join(work_dir, "loyalty.db"))
+        data_layer.add_customer("Ada", "Lovelace", "ada@example.com", "", "", "6011000000000004", "2024-01-01", "2027-01-01")
+        data_layer.save_customer_segments([(1, 3, 12, 12000, 5, 4, 4, "Loyal", "Gold", "2024-12-18T10:00:00")])
+
+        uncached = {path: sqlite3.connect(path, cached_statements=0) for path in (inventory.db_file, data_layer.db_name)}
+        cases = [
+            ("inventory.get_product_details", lambda: inventory.get_product_details("42"),
+             lambda: inventory.conn.execute(PRODUCT_SQL, ("42",)).fetchone(),
+             lambda: uncached[inventory.db_file].execute(PRODUCT_SQL, ("42",)).fetchone()),
+            ("loyalty.get_customer_segment", lambda: data_layer.get_customer_segment(1),
+             lambda: data_layer.conn.execute(SEGMENT_SQL, (1,)).fetchone(),
+             lambda: uncached[data_layer.db_name].execute(SEGMENT_SQL, (1,)).fetchone()),
+        ]
+        print(f"{'Call':<32} {'Call (us)':>10} {'Statement (us)':>15} {'Overhead (us)':>14} {'Uncached (us)':>14}")
+        for name, call, statement, miss in cases:
+            call_us, statement_us = _per_call(call, args.calls), _per_call(statement, args.calls)
+            print(f"{name:<32} {call_us:>10.2f} {statement_us:>15.2f} {call_us - statement_us:>14.2f} "
+                  f"{_per_call(miss, args.calls):>14.2f}", flush=True)
+
+        for conn in uncached.values():
+            conn.close()
+        inventory.close_connection()
+        data_layer.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,154 @@
+import sqlite3
+import json
+import sys
+from datetime import date, datetime, timedelta
+
+# Dates are stored as ISO-8601 text: calendar dates as YYYY-MM-DD and points
+# in time (checkout, sales) as YYYY-MM-DDTHH:MM:SS in store-local time. Both
+# sort as text in time order, so an index on a date column answers range
+# queries, and SQLite's date functions read them directly. The cashier still
+# types DD/MM/YYYY; it is converted at the edges.
+
+DATE_FORMAT = "%Y-%m-%d"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Formats accepted from the cashier and found in older databases and JSON exports
+INPUT_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y",
+                 "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+# Columns holding dates, and whether they are points in time (timestamps) or calendar dates
+DB_DATE_COLUMNS = {
+    "Customer": {"IssueDate": False, "ExpiryDate": False},
+    "Transactions": {"TransactionDate": True},
+    "RewardRedemption": {"RedemptionDate": False},
+    "sales": {"sale_date": True},
+}
+JSON_DATE_FIELDS = {"IssueDate", "ExpiryDate", "TransactionDate", "RedemptionDate", "sale_date"}
+
+# Old DD/MM/YYYY[ HH:MM[:SS]] values, rewritten in SQL so migrating millions of rows stays set-based
+_OLD_DATE_GLOB = "[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*"
+_ISO_DATE_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*"
+
+
+def now():
+    """The current store-local time as an ISO-8601 timestamp."""
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+
+def today():
+    return date.today().strftime(DATE_FORMAT)
+
+
+def days_ago(days, timestamp=False):
+    """The date (or timestamp) a number of days before now, for 'last N days' range queries."""
+    then = datetime.now() - timedelta(days=days)
+    return then.strftime(TIMESTAMP_FORMAT if timestamp else DATE_FORMAT)
+
+
+def _parse(text):
+    text = str(text).strip()
+    # Fast paths for the two common shapes; strptime costs several microseconds a call
+    try:
+        if len(text) == 10 and text[2] == "/" and text[5] == "/" and text.replace("/", "").isdigit():
+            return datetime(int(text[6:]), int(text[3:5]), int(text[:2]))
+        if len(text) >= 10 and text[4] == "-":
+            return datetime.fromisoformat(text)
+    except ValueError:
+        pass  # Report it below like any other unparseable date
+    for fmt in INPUT_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid date: {text!r} (expected DD/MM/YYYY)")
+
+
+def parse_date(text):
+    """Parse a date typed by the cashier (DD/MM/YYYY) or already in ISO form into YYYY-MM-DD."""
+    return _parse(text).date().isoformat()  # Same as DATE_FORMAT, several times faster than strftime
+
+
+def parse_timestamp(text):
+    """Parse a date or date and time into YYYY-MM-DDTHH:MM:SS (midnight when no time is given)."""
+    return _parse(text).replace(microsecond=0).isoformat()  # Same as TIMESTAMP_FORMAT
+
+
+def format_date(value):
+    """Show a stored ISO date or timestamp the way the cashier types it, e.g. '2024-12-18' -> '18/12/2024'."""
+    if not value:
+        return ""
+    parsed = _parse(value)
+    return parsed.strftime("%d/%m/%Y %H:%M" if "T" in value else "%d/%m/%Y")
+
+
+def migrate_db(conn):
+    """Rewrite any DD/MM/YYYY values in this database's date columns as ISO-8601.
+
+    Values that are not dates at all (e.g. the old 'transaction_date_placeholder')
+    carry no time information and are set to NULL so they cannot land in a range.
+    The rewrite scans every row, so it only runs once per database.
+    """
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at TEXT)")
+    if cursor.execute("SELECT 1 FROM schema_migrations WHERE name = 'iso_dates'").fetchone():
+        return
+    for table, columns in DB_DATE_COLUMNS.items():
+        not_null = {row[1]: row[3] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        for column, is_timestamp in columns.items():
+            if column not in not_null:
+                continue
+            iso_day = f"substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2)"
+            if is_timestamp:
+                # '18/12/2024' -> '2024-12-18T00:00:00', '18/12/2024 14:05' -> '2024-12-18T14:05:00'
+                clock = f"CASE WHEN length({column}) >= 16 THEN substr({column}, 12, 5) ELSE '00:00' END"
+                seconds = f"CASE WHEN length({column}) >= 19 THEN substr({column}, 17, 3) ELSE ':00' END"
+                new_value = f"{iso_day} || 'T' || {clock} || {seconds}"
+            else:
+                new_value = iso_day
+            cursor.execute(f"UPDATE {table} SET {column} = {new_value} WHERE {column} GLOB '{_OLD_DATE_GLOB}'")
+            if not not_null[column]:
+                cursor.execute(f"UPDATE {table} SET {column} = NULL WHERE {column} NOT GLOB '{_ISO_DATE_GLOB}'")
+    cursor.execute("INSERT INTO schema_migrations (name, applied_at) VALUES ('iso_dates', ?)", (now(),))
+    conn.commit()
+
+
+def _migrate_json_value(value):
+    if isinstance(value, list):
+        return [_migrate_json_value(item) for item in value]
+    if isinstance(value, dict):
+        migrated = {}
+        for key, item in value.items():
+            if key in JSON_DATE_FIELDS and isinstance(item, str):
+                try:
+                    parsed = _parse(item)
+                except ValueError:
+                    migrated[key] = None
+                    continue
+                timestamp = any(key in columns and columns[key] for columns in DB_DATE_COLUMNS.values())
+                migrated[key] = parsed.strftime(TIMESTAMP_FORMAT if timestamp else DATE_FORMAT)
+            else:
+                migrated[key] = _migrate_json_value(item)
+        return migrated
+    return value
+
+
+def migrate_json_file(file_name):
+    """Rewrite a previously exported JSON file so its date fields are ISO-8601."""
+    with open(file_name) as json_file:
+        data = json.load(json_file)
+    with open(file_name, "w") as json_file:
+        json.dump(_migrate_json_value(data), json_file, indent=4)
+    print(f"Migrated date fields in {file_name} to ISO-8601.")
+
+
+# Migrate existing databases and JSON exports, e.g.
+#   python dates.py LoyaltyCardSystem.db InventorySystem.db Customer.json Transactions.json
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        if path.endswith(".json"):
+            migrate_json_file(path)
+        else:
+            conn = sqlite3.connect(path)
+            migrate_db(conn)
+            conn.close()
+            print(f"Migrated date columns in {path} to ISO-8601.")
@@ -0,0 +1,168 @@
+import os
+import time
+import argparse
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import archive
+from data_access import InventorySystem, INVENTORY_DB, connect_read_only
+
+try:
+    import numpy
+except ImportError:  # The forecasts come out the same without NumPy, only more slowly
+    numpy = None
+
+# Per-product demand forecasts for stocking, written to the forecasts table
+# next to inventory.
+#
+# Products are split into inventory rowid ranges and each range is forecast
+# by one of a pool of worker processes (data_access.connect_read_only). A
+# worker sums the range's sales into a dense day x product matrix with one
+# GROUP BY per database: the live one and each archived month the history
+# window touches (archive.history_schemas, as 52 weeks can touch more
+# months than attach_history takes at once). It then works on every product
+# in the range at once, a column each:
+#
+#   - the weekly pattern is each weekday's share of the product's sales, eased
+#     towards a flat week by SEASON_PRIOR_UNITS so a product that has sold a
+#     handful of times does not get a wild pattern;
+#   - sales divided by that pattern are smoothed exponentially, one day (one
+#     matrix row) at a time, to give the expected daily units.
+#
+# A day's forecast is the daily units times that weekday's factor. With
+# NumPy each step is a whole-array operation; without it the same
+# arithmetic runs over Python lists.
+
+HISTORY_DAYS = 364  # 52 whole weeks, so every weekday is seen equally often
+ALPHA = 0.1  # Smoothing weight of the latest day
+SEASON_PRIOR_UNITS = 2.0
+HORIZON_DAYS = 7
+CHUNK_SIZE = 50_000  # Products per rowid range
+FETCH_ROWS = 10_000
+
+# {schema} is main or an archived month's history schema
+DAILY_SALES_SQL = """
+    SELECT i.rowid, CAST(julianday(substr(s.sale_date, 1, 10)) - julianday(?) AS INTEGER), SUM(si.quantity)
+    FROM main.inventory i
+    JOIN {schema}.sales_items si ON si.product_id = i.product_id
+    JOIN {schema}.sales s ON s.sale_id = si.sale_id
+    WHERE i.rowid BETWEEN ? AND ? AND s.sale_date >= ? AND s.sale_date < ?
+    GROUP BY 1, 2
+"""
+
+
+def _daily_sales(conn, schema, start, as_of, first_rowid, last_rowid):
+    """Cursor over (inventory rowid, day number from start, units) for the range's sales in one database."""
+    return conn.execute(DAILY_SALES_SQL.format(schema=schema), (start, first_rowid, last_rowid, start, as_of))
+
+
+def _batches(cursor):
+    return iter(lambda: cursor.fetchmany(FETCH_ROWS), [])
+
+
+def _forecast_numpy(cursors, rowids):
+    """(daily units, weekday factors by position from the first day) per product, with NumPy."""
+    matrix = numpy.zeros((HISTORY_DAYS, len(rowids)))
+    rowids = numpy.array(rowids)
+    for cursor in cursors:
+        for batch in _batches(cursor):
+            cells = numpy.array(batch, dtype=numpy.int64)
+            numpy.add.at(matrix, (cells[:, 1], numpy.searchsorted(rowids, cells[:, 0])), cells[:, 2])
+
+    weekdays = matrix.reshape(HISTORY_DAYS // 7, 7, -1).sum(axis=0)
+    factors = (weekdays + SEASON_PRIOR_UNITS) / (weekdays.mean(axis=0) + SEASON_PRIOR_UNITS)
+    adjusted = matrix / numpy.tile(factors, (HISTORY_DAYS // 7, 1))
+    level = adjusted[:28].mean(axis=0)
+    for day in adjusted:
+        level = ALPHA * day + (1 - ALPHA) * level
+    return level.tolist(), factors.T.tolist()
+
+
+def _forecast_python(cursors, rowids):
+    """The same as _forecast_numpy over lists, a matrix row per day."""
+    column = {rowid: index for index, rowid in enumerate(rowids)}
+    matrix = [[0.0] * len(rowids) for _ in range(HISTORY_DAYS)]
+    for cursor in cursors:
+        for batch in _batches(cursor):
+            for rowid, day, units in batch:
+                matrix[day][column[rowid]] += units
+
+    weekdays = [[sum(units) for units in zip(*matrix[position::7])] for position in range(7)]
+    means = [sum(units) / 7 for units in zip(*weekdays)]
+    factors = [[(units + SEASON_PRIOR_UNITS) / (mean + SEASON_PRIOR_UNITS) for units, mean in zip(row, means)]
+               for row in weekdays]
+    adjusted = [[units / factor for units, factor in zip(day, factors[position % 7])]
+                for position, day in enumerate(matrix)]
+    level = [sum(units) / 28 for units in zip(*adjusted[:28])]
+    for day in adjusted:
+        level = [ALPHA * units + (1 - ALPHA) * smoothed for units, smoothed in zip(day, level)]
+    return level, [list(product) for product in zip(*factors)]
+
+
+def _forecast(job):
+    """Worker: forecasts rows for one inventory rowid range."""
+    db_file, archive_dir, as_of, first_rowid, last_rowid, computed_at = job
+    conn = connect_read_only(db_file)
+    products = conn.execute("SELECT rowid, product_id FROM inventory WHERE rowid BETWEEN ? AND ? ORDER BY rowid",
+                            (first_rowid, last_rowid)).fetchall()
+    if not products:
+        conn.close()
+        return []
+    first_day = date.fromisoformat(as_of) - timedelta(days=HISTORY_DAYS)
+    start = first_day.isoformat()
+    # Each cursor is read to the end before the next month is attached
+    cursors = (_daily_sales(conn, schema, start, as_of, first_rowid, last_rowid)
+               for schema in archive.history_schemas(conn, archive_dir, start, as_of))
+    rowids = [rowid for rowid, _ in products]
+    levels, factors = (_forecast_numpy if numpy else _forecast_python)(cursors, rowids)
+    conn.close()
+
+    # Factors come by position from first_day; turn them round to start on Monday
+    shift = first_day.weekday()
+    week_ahead = [date.fromisoformat(as_of).weekday() + offset for offset in range(HORIZON_DAYS)]
+    rows = []
+    for (_, product_id), level, by_position in zip(products, levels, factors):
+        weekday_factors = [by_position[(weekday - shift) % 7] for weekday in range(7)]
+        rows.append((product_id, round(level, 4), ",".join(f"{factor:.4f}" for factor in weekday_factors),
+                     round(sum(level * weekday_factors[weekday % 7] for weekday in week_ahead), 4), as_of, computed_at))
+    return rows
+
+
+def run(db_file, as_of, workers, chunk_size, archive_dir=archive.ARCHIVE_DIR):
+    """Forecast every product and write the results to forecasts. Returns the number of products forecast."""
+    inventory = InventorySystem(db_file)  # Makes sure the forecasts table exists
+    first_rowid, last_rowid = inventory.conn.execute("SELECT MIN(rowid), MAX(rowid) FROM inventory").fetchone()
+    if first_rowid is None:
+        inventory.close_connection()
+        return 0
+    computed_at = date.today().isoformat()
+    jobs = [(db_file, archive_dir, as_of, start, min(start + chunk_size - 1, last_rowid), computed_at)
+            for start in range(first_rowid, last_rowid + 1, chunk_size)]
+
+    forecast = 0
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for rows in pool.map(_forecast, jobs):
+                inventory.save_forecasts(rows)
+                forecast += len(rows)
+    else:
+        for rows in map(_forecast, jobs):  # Small catalogues are not worth starting processes for
+            inventory.save_forecasts(rows)
+            forecast += len(rows)
+    inventory.close_connection()
+    return forecast
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Forecast daily demand for every product from its sales history.")
+    parser.add_argument("--db", default=INVENTORY_DB, help="inventory database")
+    parser.add_argument("--as-of", default=date.today().isoformat(),
+                        help="first day forecast (YYYY-MM-DD); history is the 52 weeks before it")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="products per inventory rowid range")
+    parser.add_argument("--archive-dir", default=archive.ARCHIVE_DIR, help="directory holding the monthly archive files")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    count = run(args.db, args.as_of, args.workers, args.chunk_size, args.archive_dir)
+    print(f"Forecast {count} products in {time.perf_counter() - began:.1f}s"
+          f"{'' if numpy else ' (without NumPy)'}.")
@@ -0,0 +1,160 @@
+import time
+import argparse
+from collections import deque, OrderedDict
+from datetime import datetime
+import dates
+import archive
+
+# Spots loyalty abuse: one card collecting points on dozens of sales in a few
+# minutes, or redeeming rewards over and over.
+#
+# ActivityMonitor keeps, for each card and activity, the times of its last
+# few events in a deque no longer than the hold threshold, and drops the ones
+# that have slid out of the window as each new event comes in; checking an
+# event is a dictionary lookup and a few deque operations. Cards are kept in
+# least-recently-used order and the least recently seen are forgotten beyond
+# MAX_CARDS, so memory stays bounded however many cards are used. Each lane
+# process has its own monitor, so a card spread across several lanes is seen
+# by the batch scan rather than inline.
+#
+# The loyalty write path (BusinessLogicLayer) asks the monitor about every
+# accrual and redemption. The event that brings a card's count in the window
+# up to the flag threshold is recorded in FraudAlerts, at most once a window;
+# from the hold threshold on, every event is held as well. A held redemption is refused. A held
+# accrual's sale still goes through but its points are not added; the alert
+# keeps them, and `python fraud.py release` adds them once someone has looked.
+# At the till a sale is checked before it is recorded, but its alert is
+# written in the sale's own transaction and the event is only counted once
+# that has committed, so a sale that fails (e.g. on stock) leaves neither.
+#
+# scan() runs the same monitor over Transactions already recorded, live and
+# archived, in date order, and records what it finds as alerts from "scan".
+# Refunds (negative rows written by returns.py) are not accruals and are left out.
+
+# activity: (window seconds, events to flag, events to hold)
+RULES = {
+    "accrual": (600, 10, 30),
+    "redemption": (600, 3, 6),
+}
+MAX_CARDS = 100_000
+ALERT_BATCH = 1_000
+
+# {schema} is main or an archived month's history schema
+SCAN_SQL = """SELECT CustomerID, TransactionDate FROM {schema}.Transactions
+              WHERE TransactionDate >= ? AND TransactionDate < ? AND CustomerID IS NOT NULL
+                AND TotalAmountPence >= 0
+              ORDER BY TransactionDate"""
+
+
+class ActivityMonitor:
+    """Per-card sliding-window counts of loyalty activity, in bounded memory."""
+
+    def __init__(self, rules=None, max_cards=MAX_CARDS):
+        self.rules = rules or RULES
+        self.max_cards = max_cards
+        self.windows = OrderedDict()  # (activity, customer_id) -> [event times, last flagged], least recently used first
+
+    def check(self, customer_id, activity, at=None):
+        """What observe() would return for an event (at in seconds, default now), without counting it."""
+        window, flag_at, hold_at = self.rules[activity]
+        at = time.time() if at is None else at
+        times, flagged = self.windows.get((activity, customer_id)) or ((), None)
+        events = min(1 + sum(1 for seen in times if seen > at - window), hold_at)  # Counting stops at hold_at
+        if events >= hold_at:
+            return "hold", events
+        if events >= flag_at and (flagged is None or at - flagged >= window):  # Once per window, not every event
+            return "flag", events
+        return None
+
+    def count(self, customer_id, activity, flagged=False, at=None):
+        """Count an event that has happened; flagged if check() found it should be flagged."""
+        window, _, hold_at = self.rules[activity]
+        at = time.time() if at is None else at
+        key = (activity, customer_id)
+        entry = self.windows.get(key)
+        if entry is None:
+            entry = self.windows[key] = [deque(maxlen=hold_at), None]  # Counting stops at hold_at, all the rules need
+            if len(self.windows) > self.max_cards:
+                self.windows.popitem(last=False)
+        else:
+            self.windows.move_to_end(key)
+        times = entry[0]
+        while times and times[0] <= at - window:
+            times.popleft()
+        times.append(at)
+        if flagged:
+            entry[1] = at
+
+    def observe(self, customer_id, activity, at=None):
+        """Check and count an event (at in seconds, default now). Returns ("flag" or "hold", events in the window) or None."""
+        at = time.time() if at is None else at
+        found = self.check(customer_id, activity, at)
+        self.count(customer_id, activity, found is not None and found[0] == "flag", at)
+        return found
+
+
+def _seconds(timestamp):
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+def _scan_schema(conn, schema, monitor, since, until, alerts):
+    """Feed one database's Transactions to the monitor in date order, adding (CustomerID, events, date) to alerts."""
+    cursor = conn.execute(SCAN_SQL.format(schema=schema), (since, until))
+    for customer_id, transaction_date in cursor:
+        found = monitor.observe(customer_id, "accrual", _seconds(transaction_date))
+        if found:
+            alerts.append((customer_id, found[1], transaction_date))
+
+
+def scan(data_layer, since, until, directory=archive.ARCHIVE_DIR, monitor=None):
+    """Back-scan Transactions dated in [since, until) and record an alert for each burst found. Returns the alerts."""
+    monitor = monitor or ActivityMonitor()
+    window = monitor.rules["accrual"][0]
+    conn = data_layer.conn
+    if conn.in_transaction:
+        conn.commit()
+    alerts = []
+    # Archived months are all older than the live rows, so they go first, oldest first
+    for schema in archive.history_schemas(conn, directory, since, until):
+        if schema != "main":
+            _scan_schema(conn, schema, monitor, since, until, alerts)
+    _scan_schema(conn, "main", monitor, since, until, alerts)
+    detected_at = dates.now()
+    for start in range(0, len(alerts), ALERT_BATCH):
+        data_layer.record_fraud_alerts([(customer_id, "accrual", "flagged", events, window, "scan", transaction_date,
+                                         detected_at)
+                                        for customer_id, events, transaction_date in alerts[start:start + ALERT_BATCH]])
+    return alerts
+
+
+if __name__ == "__main__":
+    from data_access import DataLayer, LOYALTY_DB
+
+    parser = argparse.ArgumentParser(description="Back-scan loyalty history for abuse, and review fraud alerts.")
+    parser.add_argument("command", choices=("scan", "list", "release"))
+    parser.add_argument("--db", default=LOYALTY_DB, help="loyalty database")
+    parser.add_argument("--since", default=dates.days_ago(30), help="scan: first day scanned (YYYY-MM-DD)")
+    parser.add_argument("--until", default="9999-12-31", help="scan: day after the last one scanned (YYYY-MM-DD)")
+    parser.add_argument("--dir", default=archive.ARCHIVE_DIR, help="scan: directory holding the monthly archive files")
+    parser.add_argument("--limit", type=int, default=50, help="list: most recent alerts shown")
+    parser.add_argument("--alert", type=int, help="release: ID of the held accrual to add the points for")
+    args = parser.parse_args()
+
+    data_layer = DataLayer(args.db)
+    if args.command == "scan":
+        began = time.perf_counter()
+        found = scan(data_layer, args.since, args.until, args.dir)
+        print(f"Found {len(found)} bursts of accruals since {args.since} in {time.perf_counter() - began:.1f}s.")
+    elif args.command == "list":
+        for alert in data_layer.get_fraud_alerts(args.limit):
+            alert_id, customer_id, activity, action, events, window, source, happened_at, points = alert
+            held = f", {points} points held" if action == "held" and points else ""
+            print(f"{alert_id:>8}  customer {customer_id:<10} {activity:<10} {action:<8} {events} in {window}s "
+                  f"at {dates.format_date(happened_at)} ({source}{held})")
+    else:
+        try:
+            data_layer.release_held_accrual(args.alert)
+            print(f"Points for alert {args.alert} added.")
+        except ValueError as e:
+            raise SystemExit(str(e))
+    data_layer.close()
@@ -0,0 +1,313 @@
+import json
+import sqlite3
+import metrics
+
+# Every change to a journaled table is written by a trigger to the journal
+# table of the same database, in the same transaction, as the row's key and
+# its whole new contents. Replaying those entries in order on top of a backup
+# brings the backup forward to any later restore point (see backup.py).
+#
+# Rows archive.py moves to the monthly archive files are the exception to
+# one entry per row: each archive batch's delete is one entry of the rowid
+# ranges it removed (op "A"), so archiving does not fill the journal of the
+# database it is meant to shrink. The running totals each batch adds to are
+# collapsed afterwards to their last entry per row (collapse()).
+#
+# The same entries are the change feed that downstream systems follow
+# (change_feed.py); each reader's position is kept in journal_cursors, and
+# entries a reader has not reached yet are never trimmed.
+#
+# All tables are journaled except the journal's own, SQLite's own tables,
+# full-text indexes and the tables in UNJOURNALED_TABLES. Those are worked out
+# from other tables: by triggers, the totals on every sale line, so they are
+# rebuilt after a replay instead; or by nightly jobs (forecast.py,
+# market_basket.py) that rewrite every row, which would otherwise add a
+# journal entry per product each night.
+
+UNJOURNALED_TABLES = ("category_closure", "category_totals", "forecasts", "product_suggestions")
+JOURNAL_TABLES = ("journal", "journal_cursors")
+TRIGGER_PREFIX = "journal_"
+TRIM_BATCH_ROWS = 5_000  # Entries deleted per transaction when trimming
+
+RESTORE_POINTS_SQL = """SELECT seq, row_key, recorded_at FROM journal WHERE op = 'M'
+                        ORDER BY recorded_at, seq"""
+RESTORE_POINT_SQL = """SELECT seq FROM journal WHERE op = 'M' AND row_key = ?
+                       ORDER BY recorded_at DESC, seq DESC LIMIT 1"""
+ENTRIES_SQL = """SELECT seq, table_name, op, row_key, row_data, recorded_at FROM journal
+                 WHERE seq > ? AND seq <= ? ORDER BY seq"""
+OLDEST_CURSOR_SQL = "SELECT MIN(seq) FROM journal_cursors"
+TRIM_SQL = """DELETE FROM journal WHERE seq IN
+              (SELECT seq FROM journal WHERE seq <= ? ORDER BY seq LIMIT ?)"""
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _json_object(row, columns):
+    return "json_object(" + ", ".join(f"'{column}', {row}.{column if column == 'rowid' else _quote(column)}"
+                                      for column in columns) + ")"
+
+
+class Journal:
+    """Row-level change journal of one database, with named restore points.
+
+    Inserts are recorded with the new row, updates with the old row's key and
+    the new row, deletes with the old row's key. Keys hold the rowid (and the
+    primary key, for readers) or, for WITHOUT ROWID tables, the primary key.
+    Restore points are journal entries of their own; backup.py writes them to
+    the inventory and loyalty journals in one transaction, so a point is a
+    moment that is between transactions in both databases.
+    """
+
+    def __init__(self, conn, install=True):
+        """With install=False nothing is created or reinstalled: reading through a read-only connection, or archiving."""
+        self.conn = conn
+        if install:
+            self._create_tables()
+            self.install_triggers()
+
+    def _create_tables(self):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT,
+                op TEXT NOT NULL,
+                row_key TEXT,
+                row_data TEXT,
+                recorded_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime'))
+            )
+        """)
+        # Restore points are found by time among millions of row entries
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_journal_restore_points ON journal (recorded_at) WHERE op = 'M'")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS journal_cursors (
+                consumer TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def tables(self):
+        """{table: (columns, key columns, rowid column)} for every table the journal covers.
+
+        The rowid column is "rowid", or None for a WITHOUT ROWID table or one
+        whose INTEGER PRIMARY KEY already is the rowid.
+        """
+        rows = self.conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall()
+        virtual = [name for name, sql in rows if sql and sql.upper().startswith("CREATE VIRTUAL")]
+        tables = {}
+        for name, sql in rows:
+            if (name in JOURNAL_TABLES or name.startswith("sqlite_") or name in UNJOURNALED_TABLES
+                    or any(name == table or name.startswith(table + "_") for table in virtual)):
+                continue
+            info = self.conn.execute(f"PRAGMA table_info({_quote(name)})").fetchall()
+            key = [column for _, column, _, _, _, pk in sorted(info, key=lambda row: row[5]) if pk]
+            integer_key = len(key) == 1 and any(row[1] == key[0] and row[2].upper() == "INTEGER" for row in info)
+            has_rowid = "WITHOUT ROWID" not in sql.upper()
+            tables[name] = ([row[1] for row in info], key, "rowid" if has_rowid and not integer_key else None)
+        return tables
+
+    def _trigger_sql(self, table, columns, key, rowid):
+        key_columns = ([rowid] if rowid else []) + key
+        data_columns = ([rowid] if rowid else []) + columns
+        entry = "INSERT INTO journal (table_name, op, row_key, row_data) VALUES ('{table}', '{op}', {key}, {data});"
+        events = (("insert", "INSERT", "I", "new", _json_object("new", data_columns)),
+                  ("update", "UPDATE", "U", "old", _json_object("new", data_columns)),
+                  ("delete", "DELETE", "D", "old", "NULL"))
+        return {f"{TRIGGER_PREFIX}{table}_{name}":
+                f"CREATE TRIGGER {TRIGGER_PREFIX}{table}_{name} AFTER {event} ON {_quote(table)} BEGIN "
+                + entry.format(table=table, op=op, key=_json_object(row, key_columns), data=data) + " END"
+                for name, event, op, row, data in events}
+
+    def install_triggers(self):
+        """Create the journal triggers for every covered table, recreating any whose columns have changed."""
+        wanted = {}
+        for table, (columns, key, rowid) in self.tables().items():
+            wanted.update(self._trigger_sql(table, columns, key, rowid))
+        existing = dict(self.conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+                                          (TRIGGER_PREFIX + "%",)))
+        if all(existing.get(name) == sql for name, sql in wanted.items()):
+            return
+        # Several lanes may open the database at once; the first one to get the lock does the work
+        if self.conn.in_transaction:
+            self.conn.commit()
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            existing = dict(cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+                                           (TRIGGER_PREFIX + "%",)))
+            for name, sql in wanted.items():
+                if existing.get(name) != sql:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    cursor.execute(sql)
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def drop_triggers(self):
+        """Stop journaling, e.g. for a bulk load that a backup taken afterwards will cover."""
+        for name, in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+                                       (TRIGGER_PREFIX + "%",)).fetchall():
+            self.conn.execute(f"DROP TRIGGER {name}")
+        self.conn.commit()
+
+    def delete_archived(self, cursor, table, where, params=()):
+        """Delete rows of a rowid table moved to the archive, journaled as one entry of rowid ranges. Returns the count.
+
+        Runs in the caller's transaction, which must already hold the write
+        lock: the table's delete trigger is set aside while the rows go, and
+        nothing else can write to the table in the meantime.
+        """
+        trigger = f"{TRIGGER_PREFIX}{table}_delete"
+        row = cursor.execute("SELECT sql FROM main.sqlite_master WHERE type = 'trigger' AND name = ?", (trigger,)).fetchone()
+        delete = f"DELETE FROM main.{_quote(table)} WHERE {where}"
+        if row is None:  # Not journaled
+            return cursor.execute(delete, params).rowcount
+        # Runs of consecutive rowids: rowid minus its position is the same all along a run
+        ranges = cursor.execute(f"""SELECT MIN(rowid), MAX(rowid) FROM (
+                                        SELECT rowid, rowid - ROW_NUMBER() OVER (ORDER BY rowid) AS run
+                                        FROM main.{_quote(table)} WHERE {where})
+                                    GROUP BY run ORDER BY 1""", params).fetchall()
+        if not ranges:
+            return 0
+        cursor.execute(f"DROP TRIGGER {trigger}")
+        deleted = cursor.execute(delete, params).rowcount
+        cursor.execute(row[0])
+        cursor.execute("INSERT INTO journal (table_name, op, row_key) VALUES (?, 'A', ?)",
+                       (table, json.dumps({"rowid_ranges": ranges})))
+        return deleted
+
+    def collapse(self, after_seq, tables):
+        """Drop entries after after_seq to rows of tables that a later entry to the same row replaces. Returns the count.
+
+        Only for tables whose rows never change key. Replay writes whole rows,
+        so a row's last entry gives the same result on its own; a restore point
+        in between keeps the entries before it, and the last entry is recorded
+        as an insert if the row was inserted since after_seq.
+        """
+        # Entries between two restore points share a segment
+        rows = f"""SELECT seq, op,
+                         ROW_NUMBER() OVER (PARTITION BY table_name, row_key, segment ORDER BY seq DESC) AS later,
+                         SUM(op = 'I') OVER (PARTITION BY table_name, row_key, segment) AS inserted
+                  FROM (SELECT seq, table_name, op, row_key, SUM(op = 'M') OVER (ORDER BY seq) AS segment
+                        FROM journal WHERE seq > ?)
+                  WHERE table_name IN ({", ".join("?" * len(tables))})"""
+        params = (after_seq, *tables)
+        cursor = self.conn.cursor()
+        if self.conn.in_transaction:
+            self.conn.commit()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(f"""UPDATE journal SET op = 'I' WHERE seq IN
+                               (SELECT seq FROM ({rows}) WHERE later = 1 AND inserted AND op = 'U')""", params)
+            deleted = cursor.execute(f"DELETE FROM journal WHERE seq IN (SELECT seq FROM ({rows}) WHERE later > 1)",
+                                     params).rowcount
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        return deleted
+
+    def last_seq(self):
+        """The last sequence number written, including entries since trimmed."""
+        row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+        return row[0] if row else 0
+
+    def first_seq(self):
+        row = self.conn.execute("SELECT MIN(seq) FROM journal").fetchone()
+        return row[0] or self.last_seq() + 1
+
+    def restore_points(self):
+        """(seq, name, recorded_at) of every restore point, oldest first."""
+        return self.conn.execute(RESTORE_POINTS_SQL).fetchall()
+
+    def restore_point(self, name):
+        """Sequence number of the latest restore point called name, or None."""
+        row = self.conn.execute(RESTORE_POINT_SQL, (name,)).fetchone()
+        return row[0] if row else None
+
+    def entries(self, after_seq, until_seq):
+        """Yield the journal rows after after_seq up to until_seq, restore points included, in order."""
+        yield from self.conn.execute(ENTRIES_SQL, (after_seq, until_seq))
+
+    @metrics.timed("journal.replay")
+    def replay(self, entries):
+        """Apply entries from another copy of this database's journal, in order, in one transaction.
+
+        Triggers are dropped while the rows are written and put back after, so
+        every table ends up exactly as recorded; tables the journal does not
+        cover must be rebuilt afterwards. The entries are added to this
+        journal too, so it carries on from the same sequence number. Returns
+        the number of entries applied.
+        """
+        tables = self.tables()
+        statements = {}
+        if self.conn.in_transaction:
+            self.conn.commit()
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            triggers = cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+            for name, _ in triggers:
+                cursor.execute(f"DROP TRIGGER {_quote(name)}")
+            applied = 0
+            for entry in entries:
+                _, table, op, row_key, row_data, _ = entry
+                cursor.execute("""INSERT INTO journal (seq, table_name, op, row_key, row_data, recorded_at)
+                                  VALUES (?, ?, ?, ?, ?, ?)""", entry)
+                if op == "M":
+                    continue
+                if table not in tables:
+                    raise ValueError(f"The journal has changes to {table}, which this copy of the database does not have.")
+                if op == "A":
+                    cursor.executemany(f"DELETE FROM {_quote(table)} WHERE rowid BETWEEN ? AND ?",
+                                       json.loads(row_key)["rowid_ranges"])
+                    applied += 1
+                    continue
+                if op in ("U", "D"):
+                    key = json.loads(row_key)
+                    # Rows are found by rowid where there is one; the primary key is only there for readers
+                    columns = ["rowid"] if "rowid" in key else list(key)
+                    sql = statements.get((table, "D"))
+                    if sql is None:
+                        sql = statements[(table, "D")] = (f"DELETE FROM {_quote(table)} WHERE "
+                                                          + " AND ".join(f"{_quote(column)} = ?" for column in columns))
+                    cursor.execute(sql, [key[column] for column in columns])
+                if op in ("I", "U"):
+                    row = json.loads(row_data)
+                    columns = tuple(row)
+                    sql = statements.get((table, columns))
+                    if sql is None:
+                        # INSERT OR REPLACE, as a replaced row is recorded as an insert of the new one only
+                        sql = statements[(table, columns)] = (
+                            f"INSERT OR REPLACE INTO {_quote(table)} ({', '.join(map(_quote, columns))}) "
+                            f"VALUES ({', '.join('?' * len(columns))})")
+                    cursor.execute(sql, list(row.values()))
+                applied += 1
+            for _, sql in triggers:
+                cursor.execute(sql)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return applied
+
+    def trim(self, through_seq, batch_rows=TRIM_BATCH_ROWS):
+        """Delete entries up to through_seq a batch at a time, so writers are only held up briefly. Returns the count.
+
+        Entries a change feed consumer has not read yet are kept.
+        """
+        oldest_cursor = self.conn.execute(OLDEST_CURSOR_SQL).fetchone()[0]
+        if oldest_cursor is not None:
+            through_seq = min(through_seq, oldest_cursor)
+        deleted = 0
+        while True:
+            cursor = self.conn.execute(TRIM_SQL, (through_seq, batch_rows))
+            self.conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_rows:
+                return deleted
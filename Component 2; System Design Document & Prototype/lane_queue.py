@@ -0,0 +1,261 @@
+import sqlite3
+import json
+import threading
+import time
+import uuid
+import metrics
+from journal import Journal
+
+# Errors about the database rather than the entry: it is locked, busy or cannot be reached. Anything else
+# (a constraint, a missing table) fails the same way every time it is replayed.
+TRANSIENT_ERRORS = ("SQLITE_BUSY", "SQLITE_LOCKED", "SQLITE_CANTOPEN", "SQLITE_IOERR", "SQLITE_FULL")
+
+PENDING_SQL = """SELECT seq, idempotency_key, db_file, statements, attach FROM pending_operations
+                 ORDER BY seq LIMIT ?"""
+REMOVE_SQL = "DELETE FROM pending_operations WHERE seq = ?"
+
+
+def _transient(error):
+    """True if an error means the entry should be retried later, not set aside."""
+    name = getattr(error, "sqlite_errorname", None)  # Python 3.11+
+    if name:
+        return name.startswith(TRANSIENT_ERRORS)
+    return isinstance(error, sqlite3.OperationalError) and any(
+        word in str(error) for word in ("locked", "busy", "unable to open", "disk"))
+
+
+class LaneQueue:
+    """Durable write-ahead queue kept in a small SQLite file local to the lane.
+
+    Checkout writes are appended here first, which only touches the local
+    file, so a locked or unavailable shared database never stalls scanning.
+    Each entry holds the SQL statements to run against one target database
+    (with any other databases it writes to attached) and an idempotency key;
+    a Replayer drains the queue into the shared databases in the background.
+    Entries that cannot be applied are moved to failed_operations, where they
+    wait for someone to look at them and requeue them.
+    """
+
+    def __init__(self, queue_file="LaneQueue.db", lane="1"):
+        self.queue_file = queue_file
+        self.lane = lane
+        self.lock = threading.Lock()
+        self.conn = metrics.connect(self.queue_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")  # Replayer reads while the lane appends
+        self.conn.execute("PRAGMA synchronous = FULL")  # An acknowledged entry survives a power cut
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_operations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                lane TEXT NOT NULL,
+                db_file TEXT NOT NULL,
+                statements TEXT NOT NULL,
+                queued_at REAL NOT NULL,
+                attach TEXT NOT NULL DEFAULT '{}'
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS failed_operations (
+                seq INTEGER PRIMARY KEY,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                lane TEXT NOT NULL,
+                db_file TEXT NOT NULL,
+                statements TEXT NOT NULL,
+                queued_at REAL NOT NULL,
+                attach TEXT NOT NULL,
+                failed_at REAL NOT NULL,
+                error TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    @metrics.timed("lane_queue.enqueue")
+    def enqueue(self, db_file, statements, key=None, attach=None):
+        """Queue a list of (sql, params) statements to be applied atomically to db_file. Returns the idempotency key.
+
+        attach maps schema names to other database files the statements write
+        to; they are attached to db_file so the entry still commits atomically.
+        Re-queuing an entry with a key that is already pending is a no-op.
+        """
+        key = key or f"{self.lane}-{uuid.uuid4().hex}"
+        payload = json.dumps([[sql, list(params)] for sql, params in statements])
+        with self.lock:
+            self.conn.execute("""INSERT OR IGNORE INTO pending_operations
+                                 (idempotency_key, lane, db_file, statements, queued_at, attach) VALUES (?, ?, ?, ?, ?, ?)""",
+                              (key, self.lane, db_file, payload, time.time(), json.dumps(attach or {}, sort_keys=True)))
+            self.conn.commit()
+        return key
+
+    def pending(self, limit=100):
+        """Return up to limit of the oldest pending entries as (seq, key, db_file, statements, attach)."""
+        with self.lock:
+            rows = self.conn.execute(PENDING_SQL, (limit,)).fetchall()
+        return [(seq, key, db_file, json.loads(statements), attach) for seq, key, db_file, statements, attach in rows]
+
+    def remove(self, seqs):
+        """Drop entries that have been applied."""
+        with self.lock:
+            self.conn.executemany(REMOVE_SQL, [(seq,) for seq in seqs])
+            self.conn.commit()
+
+    def dead_letter(self, seq, error):
+        """Move an entry that keeps failing out of the way of the ones behind it, into failed_operations."""
+        with self.lock:
+            self.conn.execute("""INSERT INTO failed_operations (seq, idempotency_key, lane, db_file, statements, queued_at,
+                                                                attach, failed_at, error)
+                                 SELECT seq, idempotency_key, lane, db_file, statements, queued_at, attach, ?, ?
+                                 FROM pending_operations WHERE seq = ?""", (time.time(), error, seq))
+            self.conn.execute(REMOVE_SQL, (seq,))
+            self.conn.commit()
+
+    def failed(self, limit=100):
+        """Return up to limit of the oldest failed entries as (seq, key, db_file, failed_at, error)."""
+        with self.lock:
+            return self.conn.execute("""SELECT seq, idempotency_key, db_file, failed_at, error FROM failed_operations
+                                        ORDER BY seq LIMIT ?""", (limit,)).fetchall()
+
+    def requeue(self, seqs):
+        """Put failed entries back at the end of the queue, e.g. once what made them fail has been fixed."""
+        with self.lock:
+            for seq in seqs:
+                self.conn.execute("""INSERT OR IGNORE INTO pending_operations (idempotency_key, lane, db_file, statements,
+                                                                            queued_at, attach)
+                                     SELECT idempotency_key, lane, db_file, statements, queued_at, attach
+                                     FROM failed_operations WHERE seq = ?""", (seq,))
+                self.conn.execute("DELETE FROM failed_operations WHERE seq = ?", (seq,))
+            self.conn.commit()
+
+    def pending_count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM pending_operations").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class Replayer(threading.Thread):
+    """Background thread that drains a LaneQueue into the shared databases in batches.
+
+    Every batch for a database is applied in one transaction together with
+    its idempotency keys in an applied_operations table, so an entry that is
+    replayed twice (for example after a crash between the commit and the
+    local delete) is skipped rather than applied again. If the database is
+    locked or missing the batch is left in the queue and retried later. If a
+    batch fails for any other reason its entries are applied one at a time,
+    and one that still fails on its own is moved to the lane queue's
+    failed_operations, so it cannot hold up every sale queued after it.
+    Failures are counted in metrics; the thread never prints to the till, and
+    a tick that fails outright (the queue file itself unreadable, say) is
+    counted and tried again on the next one.
+    Entries that write to several databases are applied through a connection
+    with those databases attached, so their batch commits in all of them at once.
+    """
+
+    def __init__(self, lane_queue, batch_size=200, interval=0.5, timeout=1.0):
+        super().__init__(daemon=True)
+        self.lane_queue = lane_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.stop_event = threading.Event()
+        self.connections = {}
+
+    def _connect(self, db_file, attach="{}"):
+        conn = self.connections.get((db_file, attach))
+        if conn is None:
+            conn = metrics.connect(db_file, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("""CREATE TABLE IF NOT EXISTS applied_operations (
+                                idempotency_key TEXT PRIMARY KEY,
+                                applied_at REAL NOT NULL
+                            ) WITHOUT ROWID""")
+            Journal(conn)  # Keys are restored with the changes they guard, so a restore cannot lead to a double replay
+            for schema, attached_file in json.loads(attach).items():
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (attached_file,))
+            self.connections[(db_file, attach)] = conn
+        return conn
+
+    @metrics.timed("lane_queue.replay_batch")
+    def _apply(self, db_file, attach, entries):
+        """Apply one batch of entries to db_file, with attach attached, in a single transaction."""
+        conn = self._connect(db_file, attach)
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for seq, key, _, statements, _ in entries:
+                cursor = conn.execute("INSERT OR IGNORE INTO applied_operations (idempotency_key, applied_at) VALUES (?, ?)",
+                                      (key, now))
+                if cursor.rowcount == 0:
+                    continue  # Already applied by an earlier replay
+                for sql, params in statements:
+                    conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def drain_once(self):
+        """Apply everything that is currently pending. Returns the number of entries applied."""
+        applied = 0
+        while True:
+            entries = self.lane_queue.pending(self.batch_size)
+            if not entries:
+                return applied
+
+            batches = {}
+            for entry in entries:
+                batches.setdefault((entry[2], entry[4]), []).append(entry)
+
+            done, handled = [], 0
+            for (db_file, attach), batch in batches.items():
+                try:
+                    self._apply(db_file, attach, batch)
+                    done.extend(entry[0] for entry in batch)
+                    handled += len(batch)
+                except sqlite3.Error as e:
+                    metrics.count_error("lane_queue.replay_batch")
+                    if not _transient(e):
+                        batch_done, batch_handled = self._apply_singly(db_file, attach, batch)
+                        done.extend(batch_done)
+                        handled += batch_handled
+            self.lane_queue.remove(done)
+            applied += len(done)
+            if handled < len(entries):
+                return applied  # Something is locked; try again on the next tick
+
+    def _apply_singly(self, db_file, attach, batch):
+        """Apply a failed batch an entry at a time, dead-lettering entries that fail on their own.
+
+        Returns (seqs applied, entries applied or dead-lettered); stops at the
+        first error that is about the database rather than the entry.
+        """
+        done, handled = [], 0
+        for entry in batch:
+            try:
+                self._apply(db_file, attach, [entry])
+                done.append(entry[0])
+            except sqlite3.Error as e:
+                if _transient(e):
+                    break
+                metrics.count_error("lane_queue.dead_letter")
+                self.lane_queue.dead_letter(entry[0], f"{type(e).__name__}: {e}")
+            handled += 1
+        return done, handled
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.drain_once()
+            except Exception:
+                # The thread must outlive anything one tick runs into, or the lane queues sales nobody replays
+                metrics.count_error("lane_queue.drain")
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        """Stop the background thread after a final drain."""
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.drain_once()
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
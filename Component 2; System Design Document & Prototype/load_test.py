@@ -0,0 +1,202 @@
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+import metrics
+from data_access import InventorySystem, DataLayer
+from checkout_system import CheckoutSystem
+from loyalty_card_system import BusinessLogicLayer
+from lane_queue import LaneQueue, Replayer
+from catalog_snapshot import CatalogPublisher
+from backup import OnlineBackup, STEP_PAGES
+
+# Replays concurrent basket traffic against the headless checkout. Every lane
+# is its own process with its own connections, exactly like a till, and all
+# lanes share the same local SQLite files. Each lane count in the sweep starts
+# from a fresh copy of the same seeded databases.
+
+STOCK = 10 ** 9  # Enough that lanes never run out during a run
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def prepare_databases(work_dir, products, customers, seed):
+    """Build the template inventory and loyalty databases that every run copies."""
+    rng = random.Random(seed)
+    inventory = InventorySystem(os.path.join(work_dir, "template_inventory.db"))
+    inventory.conn.execute("DELETE FROM inventory")
+    inventory.conn.executemany(
+        "INSERT INTO inventory (product_id, name, price_pence, quantity, category_id) VALUES (?, ?, ?, ?, ?)",
+        ((str(n), f"Product {n}", rng.randint(30, 1500), STOCK, rng.randint(1, 10)) for n in range(1, products + 1)))
+    inventory.conn.commit()
+    inventory.stock_ledger.rebaseline()
+    CatalogPublisher(inventory.conn, os.path.join(work_dir, "catalog")).publish()  # Mapped by lanes run with --catalog
+    inventory.close_connection()
+
+    loyalty = DataLayer(os.path.join(work_dir, "template_loyalty.db"))
+    loyalty.conn.executemany("INSERT INTO Customer (FirstName, LastName) VALUES (?, ?)",
+                             ((f"First{n}", f"Last{n}") for n in range(customers)))
+    loyalty.conn.commit()
+    loyalty.close()
+
+
+def run_basket(checkout, rng, products, customers, args):
+    """Scan, edit and pay for one basket."""
+    for _ in range(rng.randint(1, args.basket_size * 2 - 1)):
+        try:
+            checkout.add_item(str(rng.randint(1, products)), 1 if rng.random() < 0.8 else rng.randint(2, 4))
+        except ValueError:
+            pass
+    if checkout.cart and rng.random() < 0.15:
+        try:
+            checkout.edit_item(rng.choice(checkout.cart)[0], rng.randint(1, 5))
+        except ValueError:
+            pass
+    if len(checkout.cart) > 1 and rng.random() < 0.05:
+        checkout.remove_item(rng.choice(checkout.cart)[0])
+    if not checkout.cart:
+        return
+
+    customer_id = rng.randint(1, customers) if rng.random() < args.loyalty_share else None
+    if rng.random() < 0.3:
+        checkout.complete_sale("cash", checkout.total + rng.randint(0, 2000), customer_id)
+    else:
+        checkout.complete_sale("card", customer_id=customer_id)
+
+
+def run_lane(lane, args, inventory_db, loyalty_db, products, customers, start_at, results):
+    """One simulated till. Sends (lane, latencies, lock_waits) back through results."""
+    metrics.enable()
+    rng = random.Random(args.seed * 1000 + lane)
+    lane_queue = replayer = None
+    if args.queued:
+        lane_queue = LaneQueue(os.path.join(os.path.dirname(inventory_db), f"lane{lane}_queue.db"), lane=str(lane))
+        replayer = Replayer(lane_queue, interval=0.05, timeout=5.0)
+        replayer.start()
+    catalog_dir = os.path.join(os.path.dirname(os.path.dirname(inventory_db)), "catalog") if args.catalog else None
+    inventory = InventorySystem(inventory_db, lane_queue=lane_queue, lane=str(lane), catalog_dir=catalog_dir)
+    inventory.conn.execute("PRAGMA busy_timeout = 30000")
+    data_layer = DataLayer(loyalty_db, lane_queue=lane_queue)
+    data_layer.conn.execute("PRAGMA busy_timeout = 30000")
+    checkout = CheckoutSystem(inventory, BusinessLogicLayer(data_layer))
+
+    latencies, lock_waits = [], []
+    time.sleep(max(0.0, start_at - time.time()))
+    arrival = time.perf_counter()
+    end = arrival + args.duration
+    while True:
+        if args.rate:
+            # Open loop: baskets arrive as a Poisson process whether or not the lane has kept up
+            arrival += rng.expovariate(args.rate)
+            if arrival >= end:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            arrival = time.perf_counter()
+            if arrival >= end:
+                break
+        waited = metrics.time_in_writes()
+        run_basket(checkout, rng, products, customers, args)
+        latencies.append(time.perf_counter() - arrival)
+        lock_waits.append(metrics.time_in_writes() - waited)
+
+    if replayer:
+        replayer.stop()
+    results.put((lane, latencies, lock_waits))
+
+
+def run_backups(args, inventory_db, loyalty_db, start_at, results):
+    """Back both databases up every --backup-every seconds while the lanes run. Sends ("backup", stats) back."""
+    stats = []
+    time.sleep(max(0.0, start_at - time.time()))
+    end = time.perf_counter() + args.duration
+    while time.perf_counter() < end:
+        began = time.perf_counter()
+        for db_file in (inventory_db, loyalty_db):
+            stats.append(OnlineBackup(db_file, step_pages=args.backup_pages).copy(db_file + ".backup"))
+            os.remove(db_file + ".backup")
+        time.sleep(max(0.0, min(args.backup_every - (time.perf_counter() - began), end - time.perf_counter())))
+    results.put(("backup", stats, None))
+
+
+def run(args, lanes, work_dir):
+    """Run the given number of lanes against fresh database copies and return a summary row."""
+    run_dir = os.path.join(work_dir, f"run_{lanes}")
+    os.makedirs(run_dir, exist_ok=True)
+    inventory_db = shutil.copy(os.path.join(work_dir, "template_inventory.db"), os.path.join(run_dir, "inventory.db"))
+    loyalty_db = shutil.copy(os.path.join(work_dir, "template_loyalty.db"), os.path.join(run_dir, "loyalty.db"))
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    start_at = time.time() + 1.0 + 0.1 * lanes  # Let every process start before the clock runs
+    workers = [context.Process(target=run_lane, args=(lane, args, inventory_db, loyalty_db, args.products,
+                                                      args.customers, start_at, results))
+               for lane in range(1, lanes + 1)]
+    if args.backup_every:
+        workers.append(context.Process(target=run_backups, args=(args, inventory_db, loyalty_db, start_at, results)))
+    for worker in workers:
+        worker.start()
+    latencies, lock_waits, backups = [], [], []
+    for _ in workers:
+        lane, lane_latencies, lane_waits = results.get()
+        if lane == "backup":
+            backups = lane_latencies
+            continue
+        latencies.extend(lane_latencies)
+        lock_waits.extend(lane_waits)
+    for worker in workers:
+        worker.join()
+
+    return (lanes, len(latencies), len(latencies) / args.duration,
+            _percentile(latencies, 0.50) * 1000, _percentile(latencies, 0.99) * 1000,
+            _percentile(lock_waits, 0.50) * 1000, _percentile(lock_waits, 0.99) * 1000, backups)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive concurrent checkout lanes and report throughput and latency.")
+    parser.add_argument("--lanes", default="1,2,4,8", help="comma-separated lane counts to sweep")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds each run lasts")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="baskets per second arriving at each lane (0 = as fast as each lane can go)")
+    parser.add_argument("--basket-size", type=int, default=8, help="average lines per basket")
+    parser.add_argument("--loyalty-share", type=float, default=0.6, help="fraction of baskets using a loyalty card")
+    parser.add_argument("--queued", action="store_true", help="write through each lane's write-ahead queue")
+    parser.add_argument("--catalog", action="store_true", help="read names and prices from the shared catalogue snapshot")
+    parser.add_argument("--backup-every", type=float, default=0.0,
+                        help="back the databases up online every this many seconds during each run (0 = no backups)")
+    parser.add_argument("--backup-pages", type=int, default=STEP_PAGES,
+                        help="pages per backup step (-1 = the whole file in one step)")
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--customers", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--work-dir", help="keep the databases here instead of a temporary directory")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="grocery_load_")
+    os.makedirs(work_dir, exist_ok=True)
+    prepare_databases(work_dir, args.products, args.customers, args.seed)
+
+    row = "{:>6} {:>9} {:>12} {:>10} {:>10} {:>14} {:>14}".format
+    print(row("Lanes", "Baskets", "Baskets/s", "p50 (ms)", "p99 (ms)", "Write p50 (ms)", "Write p99 (ms)"))
+    for lanes in (int(count) for count in args.lanes.split(",")):
+        result = run(args, lanes, work_dir)
+        print(row(result[0], result[1], f"{result[2]:.1f}", f"{result[3]:.2f}", f"{result[4]:.2f}",
+                  f"{result[5]:.2f}", f"{result[6]:.2f}"), flush=True)
+        if result[7]:
+            copies = result[7]
+            print(f"       {len(copies)} database copies: {sum(c['restarts'] for c in copies)} restarts, "
+                  f"longest step {max(c['longest_step_ms'] for c in copies):.1f} ms, "
+                  f"slowest copy {max(c['seconds'] for c in copies):.2f}s", flush=True)
+
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
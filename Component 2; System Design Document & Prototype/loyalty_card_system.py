@@ -1,147 +1,100 @@
-import sqlite3
-import json
-
-class DataLayer:
-    def __init__(self, db_name="Loyalty Card System.db"):
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
-        self._initialize_tables()
-
-    def _initialize_tables(self):
-        # Create Customer table
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS Customer (
-                                    CustomerID INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    FirstName TEXT,
-                                    LastName TEXT,
-                                    Email TEXT,
-                                    PhoneNumber TEXT,
-                                    Address TEXT,
-                                    CardNumber TEXT,
-                                    IssueDate TEXT,
-                                    ExpiryDate TEXT,
-                                    TotalPoints INTEGER DEFAULT 0
-                                )''')
-
-        # Create Transactions table
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS Transactions (
-                                    TransactionID INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    CustomerID INTEGER,
-                                    TransactionDate TEXT,
-                                    TotalAmount REAL,
-                                    PointsEarned INTEGER,
-                                    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID)
-                                )''')
-
-        # Create RewardRedemption table
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS RewardRedemption (
-                                    RedemptionID INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    CustomerID INTEGER,
-                                    RewardID INTEGER,
-                                    RedemptionDate TEXT,
-                                    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID),
-                                    FOREIGN KEY (RewardID) REFERENCES Reward(RewardID)
-                                )''')
-
-        # Create Reward table
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS Reward (
-                                    RewardID INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    RewardName TEXT,
-                                    Description TEXT,
-                                    PointsRequired INTEGER
-                                )''')
-        self.conn.commit()
-
-    def add_customer(self, first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date):
-        self.cursor.execute('''INSERT INTO Customer (FirstName, LastName, Email, PhoneNumber, Address, CardNumber, IssueDate, ExpiryDate) 
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', 
-                            (first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date))
-        self.conn.commit()
-
-    def record_transaction(self, customer_id, transaction_date, total_amount, points_earned):
-        self.cursor.execute('''INSERT INTO Transactions (CustomerID, TransactionDate, TotalAmount, PointsEarned) 
-                                VALUES (?, ?, ?, ?)''', 
-                            (customer_id, transaction_date, total_amount, points_earned))
-        self.cursor.execute('''UPDATE Customer SET TotalPoints = TotalPoints + ? WHERE CustomerID = ?''', 
-                            (points_earned, customer_id))
-        self.conn.commit()
-
-    def redeem_reward(self, customer_id, reward_id, redemption_date):
-        reward = self.cursor.execute('''SELECT PointsRequired FROM Reward WHERE RewardID = ?''', (reward_id,)).fetchone()
-        if not reward:
-            raise ValueError("Reward not found.")
-        
-        required_points = reward[0]
-        customer = self.cursor.execute('''SELECT TotalPoints FROM Customer WHERE CustomerID = ?''', (customer_id,)).fetchone()
-        if not customer:
-            raise ValueError("Customer not found.")
-
-        current_points = customer[0]
-        if current_points < required_points:
-            raise ValueError("Insufficient points to redeem this reward.")
-
-        self.cursor.execute('''INSERT INTO RewardRedemption (CustomerID, RewardID, RedemptionDate) 
-                                VALUES (?, ?, ?)''', 
-                            (customer_id, reward_id, redemption_date))
-        self.cursor.execute('''UPDATE Customer SET TotalPoints = TotalPoints - ? WHERE CustomerID = ?''', 
-                            (required_points, customer_id))
-        self.conn.commit()
-
-    def add_reward(self, reward_name, description, points_required):
-        self.cursor.execute('''INSERT INTO Reward (RewardName, Description, PointsRequired) 
-                                VALUES (?, ?, ?)''', 
-                            (reward_name, description, points_required))
-        self.conn.commit()
-
-    def export_data_to_json(self, table_name, file_name):
-        self.cursor.execute(f"SELECT * FROM {table_name}")
-        rows = self.cursor.fetchall()
-        
-        # Get column names
-        columns = [description[0] for description in self.cursor.description]
-        
-        # Convert rows to dictionary format
-        data = [dict(zip(columns, row)) for row in rows]
-        
-        # Write to JSON file
-        with open(file_name, 'w') as json_file:
-            json.dump(data, json_file, indent=4)
-        
-        print(f"Data from {table_name} exported to {file_name} successfully.")
-
-    def close(self):
-        self.conn.close()
-
+import money
+import dates
+import customer_validation
+from data_access import DataLayer
+from fraud import ActivityMonitor
 
 class BusinessLogicLayer:
-    def __init__(self, data_layer):
+    def __init__(self, data_layer, monitor=None):
         self.data_layer = data_layer
+        self.monitor = monitor or ActivityMonitor()  # Recent activity on each card, seen from this process
 
     def add_customer(self, first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date):
-        self.data_layer.add_customer(first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date)
-
-    def record_transaction(self, customer_id, transaction_date, total_amount):
-        points_earned = int(total_amount // 1)  # Example: 1 point for every £1 spent
-        self.data_layer.record_transaction(customer_id, transaction_date, total_amount, points_earned)
+        customer = customer_validation.clean_customer(first_name, last_name, email, phone_number, address, card_number,
+                                                      issue_date, expiry_date)
+        duplicate = self.data_layer.find_duplicate_customer(customer["CardNumber"], customer["Email"])
+        if duplicate is not None:
+            raise ValueError(f"Customer {duplicate} already has this card number or email.")
+        self.data_layer.add_customer(customer["FirstName"], customer["LastName"], customer["Email"], customer["PhoneNumber"],
+                                     customer["Address"], customer["CardNumber"], customer["IssueDate"], customer["ExpiryDate"])
+
+    def record_transaction(self, customer_id, transaction_date, total_pence):
+        self.check_card(customer_id)
+        # Without a date the transaction is happening now, e.g. at the till
+        transaction_date = dates.parse_timestamp(transaction_date) if transaction_date else dates.now()
+        points_earned = money.points_for(total_pence)  # Example: 1 point for every £1 spent
+        if not self.screen(customer_id, "accrual", transaction_date, total_pence, points_earned):
+            raise ValueError("Too many transactions on this card in the last few minutes; held for review.")
+        self.data_layer.record_transaction(customer_id, transaction_date, total_pence, points_earned)
 
     def redeem_reward(self, customer_id, reward_id, redemption_date):
+        redemption_date = dates.parse_date(redemption_date) if redemption_date else dates.today()
+        if not self.screen(customer_id, "redemption", dates.now()):
+            raise ValueError("Too many redemptions on this card in the last few minutes; held for review.")
         self.data_layer.redeem_reward(customer_id, reward_id, redemption_date)
 
+    def screen(self, customer_id, activity, happened_at, total_pence=None, points=None):
+        """Count an accrual or redemption against the card's recent activity. Returns False if it must be held.
+
+        Flagged and held events are recorded in FraudAlerts; a held accrual's
+        amount and points are kept there until it is released (fraud.py).
+        """
+        found = self.monitor.observe(customer_id, activity)
+        if not found:
+            return True
+        action, events = found
+        self.data_layer.record_fraud_alert(customer_id, activity, "held" if action == "hold" else "flagged", events,
+                                           self.monitor.rules[activity][0], happened_at, total_pence, points)
+        return action != "hold"
+
+    def screen_sale(self, customer_id, total_pence, points, happened_at):
+        """Check a till sale's accrual before the sale is recorded. Returns (held, alert).
+
+        alert is None or the FraudAlerts row (CustomerID, Activity, Action,
+        Events, WindowSeconds, HappenedAt, AmountPence, Points) to write in the
+        sale's own transaction. Call sale_recorded() once the sale is in.
+        """
+        found = self.monitor.check(customer_id, "accrual")
+        if not found:
+            return False, None
+        action, events = found
+        return action == "hold", (customer_id, "accrual", "held" if action == "hold" else "flagged", events,
+                                  self.monitor.rules["accrual"][0], happened_at, total_pence, points)
+
+    def sale_recorded(self, customer_id, alert):
+        """Count a till sale screened with screen_sale() against the card, now that it has been recorded."""
+        self.monitor.count(customer_id, "accrual", alert is not None and alert[2] == "flagged")
+
+    def recent_transactions(self, customer_id, days=30):
+        return self.data_layer.get_transactions_since(dates.days_ago(days), customer_id)
+
     def add_reward(self, reward_name, description, points_required):
         self.data_layer.add_reward(reward_name, description, points_required)
 
+    def check_card(self, customer_id):
+        """Raise ValueError if the customer's card has been blocked."""
+        blocked_on = self.data_layer.get_card_blocked_on(customer_id)
+        if blocked_on:
+            raise ValueError(f"Card blocked on {dates.format_date(blocked_on)} as it has expired; it earns no points.")
+
+    def get_customer_tier(self, customer_id):
+        segment = self.data_layer.get_customer_segment(customer_id)
+        return segment if segment else ("Unscored", "Standard")
+
 
 class PresentationLayer:
     def __init__(self, business_logic_layer):
         self.bl_layer = business_logic_layer
 
-    def show_menu(self):
+    def show_menu(self, exit_label="Exit"):
         while True:
-            print("\n1. Add Customer")
+            print("\nLOYALTY CARD SYSTEM MENU:")
+            print("1. Add Customer")
             print("2. Record Transaction")
             print("3. Redeem Reward")
             print("4. Add Reward")
             print("5. Export Data to JSON")
-            print("6. Exit")
+            print(f"6. {exit_label}")
             choice = input("Choose an option: ")
 
             if choice == '1':
@@ -155,7 +108,6 @@ class PresentationLayer:
             elif choice == '5':
                 self.export_data_ui()
             elif choice == '6':
-                print("Exit. Sign Off.")
                 break
             else:
                 print("Invalid choice. Please try again.")
@@ -170,16 +122,22 @@ class PresentationLayer:
         issue_date = input("Enter card issue date (DD/MM/YYYY): ")
         expiry_date = input("Enter card expiry date (DD/MM/YYYY): ")
 
-        self.bl_layer.add_customer(first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date)
-        print("Customer added successfully.")
+        try:
+            self.bl_layer.add_customer(first_name, last_name, email, phone_number, address, card_number, issue_date, expiry_date)
+            print("Customer added successfully.")
+        except ValueError as e:
+            print(f"Error: {e}")
 
     def record_transaction_ui(self):
         customer_id = int(input("Enter customer ID: "))
         transaction_date = input("Enter transaction date (DD/MM/YYYY): ")
-        total_amount = float(input("Enter total amount: "))
+        total_amount = money.parse_pounds(input("Enter total amount: "))
 
-        self.bl_layer.record_transaction(customer_id, transaction_date, total_amount)
-        print("Transaction recorded successfully.")
+        try:
+            self.bl_layer.record_transaction(customer_id, transaction_date, total_amount)
+            print("Transaction recorded successfully.")
+        except ValueError as e:
+            print(f"Error: {e}")
 
     def redeem_reward_ui(self):
         customer_id = int(input("Enter customer ID: "))
@@ -218,6 +176,7 @@ if __name__ == "__main__":
 
     # Start the application
     ui_layer.show_menu()
+    print("Exit. Sign Off.")
 
     # Close database connection on exit
     data_layer.close()
@@ -0,0 +1,164 @@
+import os
+import time
+import heapq
+import argparse
+from datetime import date, timedelta
+from itertools import groupby, combinations
+from operator import itemgetter
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import dates
+import archive
+from data_access import InventorySystem, INVENTORY_DB, connect_read_only
+
+# "Frequently bought together" suggestions from sales_items, written to
+# product_suggestions for checkout to look up with one primary-key read.
+#
+# Sales are split into sale_id ranges and each range is counted by one of a
+# pool of worker processes. A worker streams the range's baskets from the live
+# database and each archived month of the period (archive.history_schemas) in
+# sale_id order, with products encoded as their inventory rowid. The job makes two passes:
+#
+#   - the first counts the baskets each product is in;
+#   - the second counts pairs, only of products in at least MIN_BASKETS
+#     baskets (no rarer pair can reach MIN_BASKETS either), in a Counter keyed
+#     by both rowids packed into one integer.
+#
+# Each pair then gives a rule both ways: confidence is the share of baskets
+# with the first product that also have the second, lift how much more often
+# than chance the two are bought together. Each product keeps its
+# SUGGESTIONS best rules with a lift above MIN_LIFT.
+
+DAYS = 90  # Period of sales counted
+MIN_BASKETS = 20  # Fewest baskets a pair must be in to make a rule
+MIN_LIFT = 1.0
+SUGGESTIONS = 5  # Rules kept per product
+MAX_BASKET_PRODUCTS = 50  # Larger baskets (stock-ups, parties) say little about pairs and cost pairs^2 to count
+CHUNK_SIZE = 50_000  # Sales per sale_id range
+FETCH_ROWS = 10_000
+PAIR_SHIFT = 32  # Inventory rowids are well below 2**32
+
+# {schema} is main or an archived month's history schema
+BASKETS_SQL = """
+    SELECT si.sale_id, i.rowid FROM {schema}.sales_items si
+    JOIN main.inventory i ON i.product_id = si.product_id
+    WHERE si.sale_id BETWEEN ? AND ?
+    ORDER BY si.sale_id
+"""
+SALE_RANGE_SQL = "SELECT MIN(sale_id), MAX(sale_id) FROM {schema}.sales WHERE sale_date >= ?"
+
+
+def _baskets(conn, archive_dir, since, first_sale, last_sale):
+    """Yield each basket in the sale_id range as a sorted list of distinct inventory rowids."""
+    for schema in archive.history_schemas(conn, archive_dir, since):
+        cursor = conn.execute(BASKETS_SQL.format(schema=schema), (first_sale, last_sale))
+        rows = (row for batch in iter(lambda: cursor.fetchmany(FETCH_ROWS), []) for row in batch)
+        for _, lines in groupby(rows, itemgetter(0)):
+            yield sorted({rowid for _, rowid in lines})
+
+
+def _count_products(job):
+    """Pass 1 worker: (baskets, baskets per product) for one sale_id range."""
+    db_file, archive_dir, since, first_sale, last_sale = job
+    conn = connect_read_only(db_file)
+    baskets, products = 0, Counter()
+    for basket in _baskets(conn, archive_dir, since, first_sale, last_sale):
+        baskets += 1
+        products.update(basket)
+    conn.close()
+    return baskets, products
+
+
+def _count_pairs(job):
+    """Pass 2 worker: baskets per pair of frequent products for one sale_id range."""
+    db_file, archive_dir, since, first_sale, last_sale, frequent = job
+    conn = connect_read_only(db_file)
+    pairs = Counter()
+    for basket in _baskets(conn, archive_dir, since, first_sale, last_sale):
+        basket = [rowid for rowid in basket if rowid in frequent]
+        if len(basket) <= MAX_BASKET_PRODUCTS:
+            pairs.update(first << PAIR_SHIFT | second for first, second in combinations(basket, 2))
+    conn.close()
+    return pairs
+
+
+def rules(baskets, products, pairs, min_baskets=MIN_BASKETS, keep=SUGGESTIONS):
+    """{rowid: [(confidence, lift, pair baskets, suggested rowid), ...]} with each product's best rules first."""
+    candidates = defaultdict(list)
+    for packed, together in pairs.items():
+        if together < min_baskets:
+            continue
+        pair = (packed >> PAIR_SHIFT, packed & ((1 << PAIR_SHIFT) - 1))
+        for product, suggested in (pair, pair[::-1]):
+            lift = together * baskets / (products[product] * products[suggested])
+            if lift > MIN_LIFT:
+                candidates[product].append((together / products[product], lift, together, suggested))
+    return {product: heapq.nlargest(keep, found) for product, found in candidates.items()}
+
+
+def _sale_range(conn, archive_dir, since):
+    """(first, last) sale_id of the sales since a date, live or archived, or (None, None)."""
+    first = last = None
+    for schema in archive.history_schemas(conn, archive_dir, since):
+        low, high = conn.execute(SALE_RANGE_SQL.format(schema=schema), (since,)).fetchone()
+        if low is not None:
+            first, last = min(low, first or low), max(high, last or high)
+    return first, last
+
+
+def run(db_file, since, workers, chunk_size, archive_dir=archive.ARCHIVE_DIR, min_baskets=MIN_BASKETS):
+    """Count the baskets since a date and write every product's suggestions. Returns (baskets, products with rules)."""
+    inventory = InventorySystem(db_file)  # Makes sure the product_suggestions table exists
+    conn = connect_read_only(db_file)
+    first_sale, last_sale = _sale_range(conn, archive_dir, since)
+    conn.close()
+    if first_sale is None:
+        inventory.close_connection()
+        return 0, 0
+    ranges = [(db_file, archive_dir, since, start, min(start + chunk_size - 1, last_sale))
+              for start in range(first_sale, last_sale + 1, chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        baskets, products = 0, Counter()
+        for count, counted in pool.map(_count_products, ranges):
+            baskets += count
+            products.update(counted)
+        frequent = frozenset(rowid for rowid, count in products.items() if count >= min_baskets)
+
+        pairs = Counter()
+        for counted in pool.map(_count_pairs, [job + (frequent,) for job in ranges]):
+            pairs.update(counted)
+
+    best = rules(baskets, products, pairs, min_baskets)
+    product_ids = dict(inventory.conn.execute("SELECT rowid, product_id FROM inventory"))
+    computed_at = dates.now()
+    batch = []
+    for rowid, found in best.items():
+        batch += [(product_ids[rowid], rank, product_ids[suggested], round(confidence, 4), round(lift, 4), together,
+                   computed_at)
+                  for rank, (confidence, lift, together, suggested) in enumerate(found, 1)]
+        if len(batch) >= FETCH_ROWS:
+            inventory.save_suggestions(batch)
+            batch = []
+    inventory.save_suggestions(batch)
+    # Rules from earlier runs that did not come up this time
+    inventory.conn.execute("DELETE FROM product_suggestions WHERE computed_at < ?", (computed_at,))
+    inventory.conn.commit()
+    inventory.close_connection()
+    return baskets, len(best)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find products frequently bought together, for suggestions at checkout.")
+    parser.add_argument("--db", default=INVENTORY_DB, help="inventory database")
+    parser.add_argument("--since", default=(date.today() - timedelta(days=DAYS)).isoformat(),
+                        help=f"first day of sales counted (YYYY-MM-DD, default {DAYS} days ago)")
+    parser.add_argument("--min-baskets", type=int, default=MIN_BASKETS, help="fewest baskets a pair must be in")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="sales per sale_id range")
+    parser.add_argument("--archive-dir", default=archive.ARCHIVE_DIR, help="directory holding the monthly archive files")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    baskets, suggested = run(args.db, args.since, args.workers, args.chunk_size, args.archive_dir, args.min_baskets)
+    print(f"Counted {baskets} baskets and wrote suggestions for {suggested} products in {time.perf_counter() - began:.1f}s.")
@@ -0,0 +1,281 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import functools
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Instrumentation for the hot paths. Turn it on with GROCERY_METRICS=1 (or by
+# calling enable()); when it is off every wrapper is a single flag check and
+# connections are plain sqlite3 connections.
+ENABLED = os.environ.get("GROCERY_METRICS", "") not in ("", "0")
+
+# Latency buckets double from 1 microsecond up to about a minute
+LATENCY_BOUNDS = [2 ** i / 1_000_000 for i in range(27)]
+# Cart sizes: one bucket per item up to 10, then coarser
+SIZE_BOUNDS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 15, 20, 30, 50, 75, 100, 200, 500]
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class Histogram:
+    """Fixed-bucket histogram with a count, sum and error counter."""
+
+    __slots__ = ("bounds", "buckets", "count", "total", "errors")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations."""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target:
+                return self.bounds[index] if index < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p99": self.percentile(0.99),
+        }
+
+
+_latencies = {}
+_sizes = {}
+_statements = {}
+_lock = threading.Lock()
+
+
+def _histogram(registry, name, bounds):
+    histogram = registry.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = registry.setdefault(name, Histogram(bounds))
+    return histogram
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def reset():
+    """Forget everything recorded so far."""
+    with _lock:
+        _latencies.clear()
+        _sizes.clear()
+        _statements.clear()
+
+
+def observe_latency(name, seconds):
+    if ENABLED:
+        _histogram(_latencies, name, LATENCY_BOUNDS).observe(seconds)
+
+
+def observe_size(name, size):
+    """Record a count-like value, e.g. the number of lines in a cart."""
+    if ENABLED:
+        _histogram(_sizes, name, SIZE_BOUNDS).observe(size)
+
+
+def count_error(name):
+    """Count an error that was handled (printed) rather than raised."""
+    if ENABLED:
+        _histogram(_latencies, name, LATENCY_BOUNDS).errors += 1
+
+
+def timed(name):
+    """Decorator recording call latency under name, and counting exceptions that escape."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                _histogram(_latencies, name, LATENCY_BOUNDS).errors += 1
+                raise
+            finally:
+                _histogram(_latencies, name, LATENCY_BOUNDS).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def instrument(prefix):
+    """Class decorator that times every public method as '<prefix>.<method>'."""
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if callable(value) and not attr.startswith("_"):
+                setattr(cls, attr, timed(f"{prefix}.{attr}")(value))
+        return cls
+    return decorator
+
+
+# SQL statement timings
+
+_WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE", "BEGIN", "COMMIT")
+_thread = threading.local()
+
+
+def _statement_key(sql):
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _record_statement(histogram, key, elapsed):
+    histogram.observe(elapsed)
+    if key.startswith(_WRITE_PREFIXES):
+        _thread.write_seconds = getattr(_thread, "write_seconds", 0.0) + elapsed
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records how long each execute takes, keyed by statement text."""
+
+    def execute(self, sql, parameters=()):
+        if not ENABLED:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        key = _statement_key(sql)
+        histogram = _histogram(_statements, key, LATENCY_BOUNDS)
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.Error:
+            histogram.errors += 1
+            raise
+        finally:
+            _record_statement(histogram, key, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not ENABLED:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        key = _statement_key(sql)
+        histogram = _histogram(_statements, key, LATENCY_BOUNDS)
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error:
+            histogram.errors += 1
+            raise
+        finally:
+            _record_statement(histogram, key, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors (including those behind conn.execute) are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3's own conn.execute makes a plain cursor, not one from cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        # Commits are where a writer waits for other lanes' locks and for the disk
+        if not ENABLED:
+            return super().commit()
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record_statement(_histogram(_statements, "COMMIT", LATENCY_BOUNDS), "COMMIT", time.perf_counter() - start)
+
+
+def _trace(statement):
+    # Statements run by triggers are only visible through the trace callback
+    if statement.startswith("-- TRIGGER"):
+        _histogram(_statements, _statement_key(statement), LATENCY_BOUNDS).count += 1
+
+
+def connect(database, **kwargs):
+    """sqlite3.connect, returning an instrumented connection when metrics are enabled."""
+    if not ENABLED:
+        return sqlite3.connect(database, **kwargs)
+    conn = sqlite3.connect(database, factory=TimedConnection, **kwargs)
+    conn.set_trace_callback(_trace)
+    return conn
+
+
+def time_in_writes():
+    """Seconds the calling thread has spent in write statements and commits, including waiting for locks."""
+    return getattr(_thread, "write_seconds", 0.0)
+
+
+# Reporting
+
+def snapshot():
+    """Return all metrics as a plain dict."""
+    with _lock:
+        return {
+            "operations": {name: h.summary() for name, h in sorted(_latencies.items())},
+            "sizes": {name: h.summary() for name, h in sorted(_sizes.items())},
+            "sql": {name: h.summary() for name, h in sorted(_statements.items())},
+        }
+
+
+def dump():
+    """Render the metrics as a plain-text table."""
+    data = snapshot()
+    lines = []
+    row = "{:<60} {:>8} {:>7} {:>11} {:>11}".format
+    for section, unit in (("operations", "ms"), ("sql", "ms")):
+        lines.append(f"\n--- {section.upper()} ---")
+        lines.append(row("Name", "Count", "Errors", f"p50 ({unit})", f"p99 ({unit})"))
+        for name, summary in data[section].items():
+            lines.append(row(name[:60], summary["count"], summary["errors"],
+                             f"{summary['p50'] * 1000:.3f}", f"{summary['p99'] * 1000:.3f}"))
+    lines.append("\n--- SIZES ---")
+    lines.append(row("Name", "Count", "", "p50", "p99"))
+    for name, summary in data["sizes"].items():
+        lines.append(row(name[:60], summary["count"], "", summary["p50"], summary["p99"]))
+    return "\n".join(lines) + "\n"
+
+
+def write_json(file_name="metrics.json"):
+    with open(file_name, "w") as json_file:
+        json.dump(snapshot(), json_file, indent=4)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(snapshot(), indent=4).encode() if self.path != "/text" else dump().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if self.path != "/text" else "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep the till's terminal clean
+
+
+def serve(port=9108, host="127.0.0.1"):
+    """Serve metrics on a local HTTP endpoint (JSON at /, plain text at /text) from a background thread."""
+    server = HTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,109 @@
+import sqlite3
+import json
+import sys
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# All money in the system is held as whole pence (int). Decimal is only used
+# at the edges (parsing what the cashier typed, converting old float data) so
+# that totals built up with += and -= stay exact and cheap.
+
+# Old pound-valued columns and the pence columns that replace them
+DB_MONEY_COLUMNS = {
+    "inventory": {"price": "price_pence"},
+    "sales": {"total_amount": "total_pence"},
+    "sales_items": {"price": "price_pence"},
+    "Transactions": {"TotalAmount": "TotalAmountPence"},
+}
+
+# Old pound-valued keys in the exported JSON files and their pence replacements
+JSON_MONEY_FIELDS = {
+    "price": "price_pence",
+    "total_amount": "total_pence",
+    "subtotal": "subtotal_pence",
+    "tax": "tax_pence",
+    "total_with_tax": "total_with_tax_pence",
+    "TotalAmount": "TotalAmountPence",
+}
+
+
+def to_pence(amount):
+    """Convert a pound amount (str, int, float or Decimal) to whole pence."""
+    try:
+        pounds = Decimal(str(amount).strip().lstrip("£"))
+    except InvalidOperation:
+        raise ValueError(f"Invalid money amount: {amount!r}")
+    if not pounds.is_finite():
+        raise ValueError(f"Invalid money amount: {amount!r}")
+    return int((pounds * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def parse_pounds(text):
+    """Parse a pound amount typed by the user, e.g. '2.50' or '£2.50', into pence."""
+    return to_pence(text)
+
+
+def format_pounds(pence):
+    """Format whole pence as a pound string without the currency sign, e.g. 250 -> '2.50'."""
+    sign = "-" if pence < 0 else ""
+    pounds, pennies = divmod(abs(pence), 100)
+    return f"{sign}{pounds}.{pennies:02d}"
+
+
+def percent_of(pence, percent):
+    """Return percent% of an amount in pence, rounded half up to the nearest penny."""
+    return (pence * percent + 50) // 100
+
+
+def points_for(pence):
+    """Loyalty points earned on a spend: 1 point for every whole £1."""
+    return pence // 100
+
+
+def migrate_db(conn):
+    """Convert any pound-valued REAL columns in this database to integer pence."""
+    cursor = conn.cursor()
+    for table, columns in DB_MONEY_COLUMNS.items():
+        existing = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        for old_column, new_column in columns.items():
+            if old_column not in existing or new_column in existing:
+                continue
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {new_column} INTEGER NOT NULL DEFAULT 0")
+            cursor.execute(f"UPDATE {table} SET {new_column} = CAST(ROUND({old_column} * 100) AS INTEGER)")
+            cursor.execute(f"ALTER TABLE {table} DROP COLUMN {old_column}")
+    conn.commit()
+
+
+def _migrate_json_value(value):
+    if isinstance(value, list):
+        return [_migrate_json_value(item) for item in value]
+    if isinstance(value, dict):
+        migrated = {}
+        for key, item in value.items():
+            if key in JSON_MONEY_FIELDS and JSON_MONEY_FIELDS[key] not in value and isinstance(item, (int, float)):
+                migrated[JSON_MONEY_FIELDS[key]] = to_pence(item)
+            else:
+                migrated[key] = _migrate_json_value(item)
+        return migrated
+    return value
+
+
+def migrate_json_file(file_name):
+    """Rewrite a previously exported JSON file so its money fields are in pence."""
+    with open(file_name) as json_file:
+        data = json.load(json_file)
+    with open(file_name, "w") as json_file:
+        json.dump(_migrate_json_value(data), json_file, indent=4)
+    print(f"Migrated money fields in {file_name} to pence.")
+
+
+# Migrate existing databases and JSON exports, e.g.
+#   python money.py InventorySystem.db LoyaltyCardSystem.db Inventory.json Transactions.json
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        if path.endswith(".json"):
+            migrate_json_file(path)
+        else:
+            conn = sqlite3.connect(path)
+            migrate_db(conn)
+            conn.close()
+            print(f"Migrated money columns in {path} to pence.")
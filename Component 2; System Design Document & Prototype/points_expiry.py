@@ -0,0 +1,143 @@
+import time
+import sqlite3
+import calendar
+import argparse
+from datetime import date
+import dates
+import metrics
+import archive
+
+# Expires loyalty points older than EXPIRY_MONTHS and blocks cards past their
+# ExpiryDate. Run nightly, e.g. from cron, while the lanes keep selling.
+#
+# Points are spent oldest first, and expire oldest first, so whatever is left
+# of a customer's balance is their newest points. Anything above the points
+# earned since the cutoff date is therefore older than the cutoff, and that
+# excess is what expires:
+#
+#   expired = max(0, TotalPoints - points earned since the cutoff)
+#
+# That needs neither the redemption history nor earlier expiries, and running
+# the job twice expires nothing the second time. The points earned since the
+# cutoff come from the live Transactions (through the CustomerID,
+# TransactionDate index) plus the archived months since the cutoff, which are
+# summed once per run into a temp table before any batch starts. Archived
+# months never change, so they can be read outside the write transactions.
+#
+# Customers are then worked through in CustomerID ranges, one short BEGIN
+# IMMEDIATE transaction each, like archive.py's batches. Each batch finds
+# the whole range's excess with one INSERT ... SELECT, writes it to
+# PointsExpiry, takes it off the balances with one UPDATE, and blocks the
+# range's expired cards with another.
+
+EXPIRY_MONTHS = 12
+BATCH_CUSTOMERS = 5_000  # Customers per transaction; a few tens of milliseconds of write lock
+
+# A CustomerID range's excess over the points it earned since the cutoff
+EXPIRING_SQL = """
+    INSERT INTO temp.expiring (CustomerID, Points)
+    SELECT CustomerID, TotalPoints - Kept FROM (
+        SELECT c.CustomerID, c.TotalPoints,
+               COALESCE((SELECT SUM(t.PointsEarned) FROM main.Transactions t
+                         WHERE t.CustomerID = c.CustomerID AND t.TransactionDate >= ?), 0)
+               + COALESCE((SELECT a.Points FROM temp.archived_points a WHERE a.CustomerID = c.CustomerID), 0)
+                 AS Kept
+        FROM main.Customer c WHERE c.CustomerID BETWEEN ? AND ?)
+    WHERE TotalPoints > Kept
+"""
+BLOCK_SQL = """UPDATE Customer SET BlockedOn = ?
+               WHERE CustomerID BETWEEN ? AND ? AND ExpiryDate < ? AND BlockedOn IS NULL"""
+
+
+def expiry_cutoff(months=EXPIRY_MONTHS, today=None):
+    """The date (YYYY-MM-DD) months before today; points earned before it have expired."""
+    today = today or date.today()
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    return date(year, month + 1, min(today.day, calendar.monthrange(year, month + 1)[1])).isoformat()
+
+
+class PointsExpiry:
+    """Expires old points and blocks expired cards in a loyalty database, a batch of customers at a time."""
+
+    def __init__(self, conn, directory=archive.ARCHIVE_DIR, batch_customers=BATCH_CUSTOMERS):
+        self.conn = conn
+        self.directory = directory
+        self.batch_customers = batch_customers
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS archived_points (CustomerID INTEGER PRIMARY KEY, Points INTEGER)")
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS expiring (CustomerID INTEGER PRIMARY KEY, Points INTEGER)")
+
+    def _archived_points(self, cutoff):
+        """Sum each customer's points earned since cutoff in the archived months into temp.archived_points."""
+        self.conn.execute("DELETE FROM temp.archived_points")
+        for schema in archive.history_schemas(self.conn, self.directory, since=cutoff):
+            if schema == "main" or not self.conn.execute(
+                    f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'Transactions'").fetchone():
+                continue
+            self.conn.execute(f"""
+                INSERT INTO temp.archived_points (CustomerID, Points)
+                SELECT CustomerID, SUM(PointsEarned) FROM {schema}.Transactions
+                WHERE TransactionDate >= ? AND CustomerID IS NOT NULL GROUP BY CustomerID
+                ON CONFLICT (CustomerID) DO UPDATE SET Points = Points + excluded.Points
+            """, (cutoff,))
+            self.conn.commit()  # Months cannot be detached inside a transaction
+        self.conn.commit()
+
+    def run(self, cutoff, today):
+        """Expire points earned before cutoff and block cards expired before today (both YYYY-MM-DD).
+
+        Returns (customers with points expired, points expired, cards blocked).
+        """
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self._archived_points(cutoff)
+        first_id, last_id = self.conn.execute("SELECT MIN(CustomerID), MAX(CustomerID) FROM Customer").fetchone()
+        customers = points = blocked = 0
+        for start in range(first_id or 0, (last_id or -1) + 1, self.batch_customers):
+            batch = self._batch(start, start + self.batch_customers - 1, cutoff, today)
+            customers, points, blocked = customers + batch[0], points + batch[1], blocked + batch[2]
+        return customers, points, blocked
+
+    @metrics.timed("points_expiry.batch")
+    def _batch(self, first_id, last_id, cutoff, today):
+        """Expire and block one CustomerID range in one transaction. Returns (customers, points, cards blocked)."""
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            customers = cursor.execute(EXPIRING_SQL, (cutoff, first_id, last_id)).rowcount
+            points = 0
+            if customers:
+                points = cursor.execute("SELECT SUM(Points) FROM temp.expiring").fetchone()[0]
+                cursor.execute("""INSERT INTO PointsExpiry (CustomerID, ExpiredOn, Points)
+                                  SELECT CustomerID, ?, Points FROM temp.expiring""", (today,))
+                cursor.execute("""UPDATE Customer
+                                  SET TotalPoints = TotalPoints - (SELECT e.Points FROM temp.expiring e
+                                                                   WHERE e.CustomerID = Customer.CustomerID)
+                                  WHERE CustomerID IN (SELECT CustomerID FROM temp.expiring)""")
+                cursor.execute("DELETE FROM temp.expiring")
+            blocked = cursor.execute(BLOCK_SQL, (today, first_id, last_id, today)).rowcount
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        return customers, points, blocked
+
+
+if __name__ == "__main__":
+    from data_access import DataLayer, LOYALTY_DB
+
+    parser = argparse.ArgumentParser(description="Expire old loyalty points and block expired cards.")
+    parser.add_argument("--db", default=LOYALTY_DB, help="loyalty database")
+    parser.add_argument("--months", type=int, default=EXPIRY_MONTHS, help="points older than this many months expire")
+    parser.add_argument("--today", default=dates.today(), help="date the job runs as (YYYY-MM-DD)")
+    parser.add_argument("--dir", default=archive.ARCHIVE_DIR, help="directory holding the monthly archive files")
+    parser.add_argument("--batch-customers", type=int, default=BATCH_CUSTOMERS, help="customers per transaction")
+    args = parser.parse_args()
+
+    data_layer = DataLayer(args.db)  # Makes sure PointsExpiry and Customer.BlockedOn exist
+    data_layer.conn.execute("PRAGMA busy_timeout = 30000")  # Lanes keep selling while batches go
+    cutoff = expiry_cutoff(args.months, date.fromisoformat(args.today))
+    began = time.perf_counter()
+    customers, points, blocked = PointsExpiry(data_layer.conn, args.dir, args.batch_customers).run(cutoff, args.today)
+    print(f"Expired {points} points earned before {cutoff} from {customers} customers and blocked {blocked} expired "
+          f"cards in {time.perf_counter() - began:.1f}s.")
+    data_layer.close()
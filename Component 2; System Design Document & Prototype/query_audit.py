@@ -0,0 +1,209 @@
+import os
+import sys
+import argparse
+import tempfile
+import archive
+import barcodes
+import category_tree
+import change_feed
+import checkout_commit
+import data_access
+import forecast
+import fraud
+import journal
+import lane_queue
+import market_basket
+import points_expiry
+import returns
+import search_index
+import stock_ledger
+from data_access import InventorySystem, DataLayer
+from lane_queue import LaneQueue
+from points_expiry import PointsExpiry
+
+# Every statement the inventory, checkout and loyalty systems issue, with
+# sample parameters. Hot statements run per scan, per basket or per lookup at
+# the till and must be answered from an index; the rest are back-office
+# listings and exports where a full scan is expected.
+#
+# The SQL is each module's own constant, the one its code runs, so the audit
+# cannot drift from it. Parts filled in at run time (IN lists, schemas,
+# optional filters) are filled in here the way the code does.
+#   (name, database, sql, params, hot)
+STATEMENTS = [
+    ("inventory.get_all_products", "inventory", data_access.ALL_PRODUCTS_SQL, (), False),
+    ("inventory.get_products_page.count", "inventory", data_access.PRODUCTS_COUNT_SQL.format(where=""), (), False),
+    ("inventory.get_products_page", "inventory", data_access.PRODUCTS_PAGE_SQL.format(where=""), (20, 0), False),
+    ("inventory.get_products_page.filtered", "inventory",
+     data_access.PRODUCTS_PAGE_SQL.format(where=data_access.NAME_FILTER_SQL), ("%milk%", 20, 0), False),
+    ("inventory.get_product_details", "inventory", data_access.PRODUCT_SQL, ("42",), True),
+    ("inventory.get_product_details.stock", "inventory", data_access.PRODUCT_STOCK_SQL, ("42",), True),
+    ("inventory.update_price", "inventory", data_access.UPDATE_PRICE_SQL, (120, "42"), True),
+    ("inventory.update_quantity", "inventory", stock_ledger.ADJUST_STOCK_SQL, (-1, "42"), True),
+    ("stock_ledger.record_movement", "inventory", stock_ledger.RECORD_MOVEMENT_SQL,
+     (-1, "sale", "1", "b", "2024-12-18T10:00:00", "42"), True),
+    ("stock_ledger.stock_at.snapshot", "inventory", stock_ledger.SNAPSHOT_AT_SQL, ("42", "2024-12-18T10:00:00"), True),
+    ("stock_ledger.stock_at.movements", "inventory", stock_ledger.MOVED_SINCE_SQL,
+     ("42", 0, "2024-12-18T10:00:00"), True),
+    ("checkout_commit.sales_item", "inventory", checkout_commit.SALES_ITEM_SQL, ("b", "42", 1, 100), True),
+    ("checkout_commit.stock_check", "inventory", checkout_commit.STOCK_CHECK_SQL.format(placeholders="?, ?, ?"),
+     ("1", "2", "3"), True),
+    ("stock_ledger.oversold_movement", "inventory", stock_ledger.OVERSOLD_MOVEMENT_SQL,
+     ("1", "b", "2024-12-18T10:00:00", "42"), True),
+    ("stock_ledger.oversold_reset", "inventory", stock_ledger.OVERSOLD_RESET_SQL, ("42",), True),
+    # The stock triggers' update, with the new row's values as parameters
+    ("category_tree.totals_update", "inventory",
+     "UPDATE category_totals SET stock_units = stock_units + ? " + category_tree.ANCESTORS_OF.format("?"), (-1, 1), True),
+    ("category_tree.totals", "inventory", category_tree.TOTALS_SQL, (1,), True),
+    ("category_tree.rollup", "inventory", category_tree.ROLLUP_SQL, (1,), False),
+    ("category_tree.rollup.top_level", "inventory", category_tree.TOP_LEVEL_SQL, (), False),
+    ("category_tree.products_in", "inventory", category_tree.PRODUCTS_IN_SQL, (1, 100), True),
+    ("search.search", "inventory", search_index.SEARCH_SQL.format(category=""), ('"mil"*', 200), True),
+    ("search.search.category", "inventory", search_index.SEARCH_SQL.format(category=search_index.CATEGORY_FILTER_SQL),
+     ('"mil"*', 1, 200), True),
+    ("barcodes.codes_for", "inventory", barcodes.CODES_FOR_SQL, ("42",), False),
+    ("barcodes.resolve_scans", "inventory", barcodes.RESOLVE_SQL.format(placeholders="?, ?, ?"), ("1", "2", "3"), True),
+    ("loyalty.record_transaction.points", "loyalty", data_access.ADD_POINTS_SQL, (10, 42), True),
+    ("loyalty.find_duplicate_customer", "loyalty", data_access.DUPLICATE_CUSTOMER_SQL,
+     ("0000000000000042", "first42@example.com"), True),
+    ("loyalty.redeem_reward.reward", "loyalty", data_access.REWARD_POINTS_SQL, (1,), True),
+    ("loyalty.redeem_reward.customer", "loyalty", data_access.CUSTOMER_POINTS_SQL, (42,), True),
+    ("loyalty.redeem_reward.points", "loyalty", data_access.SPEND_POINTS_SQL, (50, 42), True),
+    ("loyalty.get_customer_segment", "loyalty", data_access.SEGMENT_SQL, (42,), True),
+    ("loyalty.get_transactions_since.customer", "loyalty", data_access.CUSTOMER_TRANSACTIONS_SINCE_SQL,
+     (42, "2024-11-18"), True),
+    ("loyalty.get_transactions_since", "loyalty", data_access.TRANSACTIONS_SINCE_SQL, ("2024-12-01",), True),
+    ("loyalty.export_data_to_json", "loyalty", data_access.EXPORT_TABLE_SQL.format(table="Transactions"), (), False),
+] + [
+    (f"archive.batch.{table}", "inventory" if table == "sales" else "loyalty",
+     archive.BATCH_SQL.format(key=key, table=table, date_column=date_column), ("2024-01-01", "2024-02-01", 5000), False)
+    for table, key, date_column, _, _ in archive.ARCHIVED_TABLES
+] + [
+    # Only the WHERE clause matters to the plan, so the key stands in for the column list
+    ("archive.copy.sales_items", "inventory",
+     archive.COPY_SQL.format(table="sales_items", columns="sale_id", where=f"sale_id {archive.IN_BATCH_SQL}"), (), False),
+    ("journal.entries", "inventory", journal.ENTRIES_SQL, (0, 5000), False),
+    ("journal.restore_points", "inventory", journal.RESTORE_POINTS_SQL, (), False),
+    ("journal.restore_point", "loyalty", journal.RESTORE_POINT_SQL, ("backup 20241218T100000",), False),
+    ("journal.trim", "inventory", journal.TRIM_SQL, (5000, 5000), False),
+    ("forecast.daily_sales", "inventory", forecast.DAILY_SALES_SQL.format(schema="main"),
+     ("2023-12-19", 1, 50000, "2023-12-19", "2024-12-18"), False),
+    ("inventory.get_forecast", "inventory", data_access.FORECAST_SQL, ("42",), False),
+    ("market_basket.baskets", "inventory", market_basket.BASKETS_SQL.format(schema="main"), (1, 50000), False),
+    ("market_basket.sale_range", "inventory", market_basket.SALE_RANGE_SQL.format(schema="main"), ("2024-09-19",), False),
+    ("inventory.get_suggestions", "inventory", data_access.SUGGESTIONS_SQL, ("42", 4), True),
+    ("points_expiry.expiring", "loyalty", points_expiry.EXPIRING_SQL, ("2023-12-18", 1, 5000), False),
+    ("points_expiry.block", "loyalty", points_expiry.BLOCK_SQL, ("2024-12-18", 1, 5000, "2024-12-18"), False),
+    ("loyalty.get_card_blocked_on", "loyalty", data_access.CARD_BLOCKED_ON_SQL, (42,), True),
+    ("fraud.scan", "loyalty", fraud.SCAN_SQL.format(schema="main"), ("2024-11-18", "9999-12-31"), False),
+    ("loyalty.release_held_accrual", "loyalty", data_access.RELEASE_HELD_ACCRUAL_SQL, (1,), False),
+    ("returns.find_sale", "inventory", returns.FIND_SALE_SQL, ("1", "1"), False),
+    ("returns.sale_lines", "inventory", returns.SALE_LINES_SQL, (1,), False),
+    ("returns.refunded", "inventory", returns.REFUNDED_SQL, (1,), False),
+    ("returns.held_alert", "inventory", returns.HELD_ALERT_SQL, ("b",), False),
+    ("change_feed.read", "inventory", change_feed.READ_SQL, (0, 1000), False),
+    ("change_feed.position", "inventory", change_feed.POSITION_SQL, ("ecommerce",), False),
+    ("change_feed.oldest_cursor", "loyalty", journal.OLDEST_CURSOR_SQL, (), False),
+    ("lane_queue.pending", "lane_queue", lane_queue.PENDING_SQL, (200,), False),
+    ("lane_queue.remove", "lane_queue", lane_queue.REMOVE_SQL, (1,), True),
+]
+
+
+def build_databases(rows, directory):
+    """Create every database in directory with rows synthetic products, customers and transactions.
+
+    The inventory connection has the loyalty database attached, as checkout
+    and returns have, and each connection has the temp tables its batch jobs
+    create.
+    """
+    inventory = InventorySystem(os.path.join(directory, "inventory.db"))  # With the store's ten sample categories
+    inventory.conn.executemany(
+        "INSERT INTO inventory (product_id, name, price_pence, quantity, category_id) VALUES (?, ?, ?, ?, ?)",
+        ((f"P{n}", f"Product {n} milk" if n % 50 == 0 else f"Product {n}", 100 + n % 900, n % 100, n % 10 + 1)
+         for n in range(rows)))
+    inventory.conn.executemany("INSERT INTO barcodes (code, product_id) VALUES (?, ?)",
+                               ((f"{n:013d}", f"P{n}") for n in range(rows)))
+    inventory.conn.commit()
+
+    loyalty = DataLayer(os.path.join(directory, "loyalty.db"))
+    loyalty.conn.executemany(
+        "INSERT INTO Customer (FirstName, LastName, CardNumber, TotalPoints) VALUES (?, ?, ?, ?)",
+        ((f"First{n}", f"Last{n}", f"{n:016d}", n % 500) for n in range(rows)))
+    loyalty.conn.executemany(
+        "INSERT INTO Transactions (CustomerID, TransactionDate, TotalAmountPence, PointsEarned) VALUES (?, ?, ?, ?)",
+        ((n % rows + 1, f"2024-{n % 12 + 1:02d}-{n % 28 + 1:02d}T{n % 24:02d}:00:00", 1000 + n % 5000, 10 + n % 50)
+         for n in range(rows * 5)))
+    loyalty.conn.executemany("INSERT INTO Reward (RewardName, Description, PointsRequired) VALUES (?, ?, ?)",
+                             ((f"Reward {n}", "", 50 * n) for n in range(1, 51)))
+    loyalty.conn.commit()
+
+    queue = LaneQueue(os.path.join(directory, "lane_queue.db"))
+
+    connections = {"inventory": inventory.conn, "loyalty": loyalty.conn, "lane_queue": queue.conn}
+    for conn in connections.values():
+        conn.execute("ANALYZE")
+        conn.commit()
+    inventory.conn.execute(f"ATTACH DATABASE ? AS {checkout_commit.LOYALTY_SCHEMA}", (loyalty.db_name,))
+    for conn in (inventory.conn, loyalty.conn):
+        archive.Archiver(conn, directory)
+    inventory.conn.execute("ATTACH DATABASE ':memory:' AS archive_month")
+    inventory.conn.execute("CREATE TABLE archive_month.sales_items (sale_id INTEGER)")
+    PointsExpiry(loyalty.conn, directory)
+    return connections
+
+
+def classify(plan_rows):
+    """Return the list of problems in an EXPLAIN QUERY PLAN result."""
+    problems = []
+    for row in plan_rows:
+        detail = row[-1]
+        if detail.startswith("SCAN") and "VIRTUAL TABLE" not in detail and "COVERING INDEX" not in detail:
+            problems.append(f"full table scan ({detail})")
+        elif detail.startswith("SCAN") and "COVERING INDEX" in detail:
+            problems.append(f"full index scan ({detail})")
+        if "TEMP B-TREE" in detail:
+            problems.append(f"temp b-tree ({detail})")
+        if "AUTOMATIC" in detail:
+            problems.append(f"missing index, SQLite built an automatic one ({detail})")
+    return problems
+
+
+def audit(connections):
+    """Run EXPLAIN QUERY PLAN over every statement. Returns (name, hot, plan, problems) rows."""
+    results = []
+    for name, database, sql, params, hot in STATEMENTS:
+        plan_rows = connections[database].execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        results.append((name, hot, [row[-1] for row in plan_rows], classify(plan_rows)))
+    return results
+
+
+def render(results):
+    lines = []
+    for name, hot, plan, problems in results:
+        status = "OK" if not problems else ("FAIL" if hot else "WARN")
+        lines.append(f"[{status:<4}] {name}{' (hot path)' if hot else ''}")
+        for step in plan:
+            lines.append(f"         plan: {step}")
+        for problem in problems:
+            lines.append(f"         !! {problem}")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Audit the query plans of every statement the grocery store issues.")
+    parser.add_argument("--rows", type=int, default=100_000, help="synthetic products/customers to generate")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if a hot-path query scans")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="grocery_audit_") as directory:
+        connections = build_databases(args.rows, directory)
+        results = audit(connections)
+        for conn in connections.values():
+            conn.close()
+    sys.stdout.write(render(results))
+
+    failures = [name for name, hot, _, problems in results if hot and problems]
+    if failures:
+        print(f"\n{len(failures)} hot-path quer{'y' if len(failures) == 1 else 'ies'} regressed to a scan: {', '.join(failures)}")
+    if args.check and failures:
+        sys.exit(1)
@@ -0,0 +1,75 @@
+import os
+import sys
+import money
+
+# Templates are built once at import time. Each row is rendered with a bound
+# str.format so the format string is never re-parsed per call, and every screen
+# is joined into a single string and written out in one go.
+PAGE_SIZE = 20
+
+_RULE = "-" * 60 + "\n"
+_CART_ROW = "{:<10} {:<25} {:<10} {:<10}\n".format
+_CART_HEADER = _CART_ROW("ID", "Name", "Price(£)", "Quantity") + _RULE
+_PRODUCT_ROW = "ID: {}, Name: {}, Price: £{}, Quantity: {}\n".format
+_SUMMARY_ROW = "{}: {}\n".format
+_PAGE_FOOTER = "Showing {}-{} of {} product(s). Page {} of {}.\n".format
+
+
+def _cart_rows(cart):
+    format_pounds = money.format_pounds
+    return [_CART_ROW(product_id, name, format_pounds(price_pence), quantity)
+            for product_id, name, quantity, price_pence in cart]
+
+
+def render_cart(cart, total_pence):
+    """Render the cart table and its running total."""
+    parts = ["\nYour Cart:\n", _CART_HEADER]
+    parts.extend(_cart_rows(cart))
+    parts.append(_RULE)
+    parts.append(f"Total: £{money.format_pounds(total_pence)}\n")
+    return "".join(parts)
+
+
+def render_receipt(cart, summary, farewell="Thank you for shopping with us!"):
+    """Render a receipt. summary is a list of (label, value) lines shown under the items."""
+    parts = ["\n--- Receipt ---\n", _CART_HEADER]
+    parts.extend(_cart_rows(cart))
+    parts.append(_RULE)
+    parts.extend(_SUMMARY_ROW(label, value) for label, value in summary)
+    parts.append(farewell + "\n")
+    return "".join(parts)
+
+
+def render_inventory(products, page=1, page_size=PAGE_SIZE, total_count=None):
+    """Render one page of product rows, as returned by InventorySystem.get_products_page."""
+    if total_count is None:
+        total_count = len(products)
+    if not products:
+        return "No products available in the inventory.\n"
+
+    format_pounds = money.format_pounds
+    parts = [_PRODUCT_ROW(product_id, name, format_pounds(price_pence), quantity)
+             for product_id, name, price_pence, quantity in products]
+    first = (page - 1) * page_size + 1
+    pages = max(1, -(-total_count // page_size))
+    parts.append(_PAGE_FOOTER(first, first + len(products) - 1, total_count, page, pages))
+    return "".join(parts)
+
+
+def emit(text, stream=None):
+    """Write a rendered block to the terminal with a single write call."""
+    stream = stream or sys.stdout
+    stream.write(text)
+    stream.flush()
+
+
+def write_receipts(receipts, directory="receipts"):
+    """Write rendered receipts to files in one batch. receipts is an iterable of (name, text) pairs."""
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for name, text in receipts:
+        path = os.path.join(directory, f"{name}.txt")
+        with open(path, "w", encoding="utf-8") as receipt_file:
+            receipt_file.write(text)
+        written.append(path)
+    return written
@@ -0,0 +1,277 @@
+import csv
+import time
+import uuid
+import argparse
+import money
+import dates
+import metrics
+import archive
+from stock_ledger import StockLedger
+from checkout_commit import LOYALTY_SCHEMA
+
+# Returns and refunds against completed sales, one at the service desk or a
+# file of them at once.
+#
+# A return is looked up by its sale (sale ID or basket ID) and checked against
+# what the sale sold less what has already come back. It then puts the stock
+# back, records the refund in returns and return_items, and takes the points
+# the refund had earned off the customer's card, all in one transaction: the
+# loyalty database is attached to the inventory connection as in
+# checkout_commit.py, so every change is made in both databases or none is.
+#
+# The points reversed are what the sale earns before the return less what it
+# earns after, so several partial returns of one sale never take back more
+# than the sale gave. The card gets a Transactions row with the negative
+# amount and points, which keeps the loyalty history adding up, and its
+# balance does not go below zero if the points have been spent. A sale with
+# no customer_id (anonymous, or recorded before the column existed) has no
+# points to take back. Nor does one whose points the fraud check is still
+# holding: the refund and its points come off the held alert instead, so the
+# release adds only what the customer kept.
+#
+# A file is worked through in batches of BATCH_RETURNS, each one BEGIN
+# IMMEDIATE transaction with a savepoint per return, so a bad line (wrong
+# sale, too many returned) is rolled back and reported on its own while the
+# rest of its batch goes through. Each return carries a reference, unique in
+# returns, so running a file again refunds nothing twice.
+#
+# Sales are only looked up live; returns are for recent sales and archive.py
+# keeps KEEP_MONTHS months live.
+
+BATCH_RETURNS = 500  # Returns per transaction; a few tens of milliseconds of write lock
+FILE_COLUMNS = ("reference", "sale", "product_id", "quantity")
+
+FIND_SALE_SQL = """SELECT sale_id, basket, sale_date, total_pence, customer_id FROM sales
+                   WHERE sale_id = ? OR basket = ?"""
+# (product_id, name, quantity sold, quantity returned, lowest price_pence) for each product of a sale
+SALE_LINES_SQL = """
+    SELECT si.product_id, COALESCE(i.name, si.product_id), SUM(si.quantity),
+           COALESCE((SELECT SUM(ri.quantity) FROM returns r JOIN return_items ri ON ri.return_id = r.return_id
+                     WHERE r.sale_id = si.sale_id AND ri.product_id = si.product_id), 0),
+           MIN(si.price_pence)
+    FROM sales_items si LEFT JOIN inventory i ON i.product_id = si.product_id
+    WHERE si.sale_id = ? GROUP BY si.product_id ORDER BY MIN(si.sales_item_id)
+"""
+REFUNDED_SQL = "SELECT COALESCE(SUM(refund_pence), 0) FROM returns WHERE sale_id = ?"
+HELD_ALERT_SQL = f"""SELECT AlertID FROM {LOYALTY_SCHEMA}.FraudAlerts
+                     WHERE Basket = ? AND Activity = 'accrual' AND Action = 'held'"""
+
+
+class Returns:
+    """Refunds completed sales, putting back their stock and taking back their loyalty points in one transaction."""
+
+    def __init__(self, conn, loyalty_db, batch_returns=BATCH_RETURNS):
+        self.conn = conn
+        self.loyalty_db = loyalty_db
+        self.batch_returns = batch_returns
+        if not any(row[1] == LOYALTY_SCHEMA for row in self.conn.execute("PRAGMA database_list")):
+            self.conn.execute(f"ATTACH DATABASE ? AS {LOYALTY_SCHEMA}", (loyalty_db,))
+
+    def find_sale(self, sale, cursor=None):
+        """(sale_id, basket, sale_date, total_pence, customer_id) of a live sale by sale ID or basket ID.
+
+        Raises ValueError if there is no such sale.
+        """
+        row = (cursor or self.conn).execute(FIND_SALE_SQL, (sale, sale)).fetchone()
+        if row is None:
+            raise ValueError(f"Sale {sale} not found. Sales older than {archive.KEEP_MONTHS} months are archived "
+                             "and cannot be returned.")
+        return row
+
+    def sale_lines(self, sale_id):
+        """[(product_id, name, quantity sold, quantity returned, price_pence)] of a sale."""
+        return self.conn.execute(SALE_LINES_SQL, (sale_id,)).fetchall()
+
+    def _apply(self, cursor, reference, sale, lines, returned_at):
+        """Write one return within the open transaction. Returns (refund_pence, points_reversed)."""
+        if cursor.execute("SELECT 1 FROM returns WHERE reference = ?", (reference,)).fetchone():
+            raise ValueError(f"Return {reference} has already been processed.")
+        sale_id, basket, _, total_pence, customer_id = self.find_sale(sale, cursor)
+        quantities = {}
+        for product_id, quantity in lines:
+            try:
+                quantity = int(quantity)  # Lines from a file are still text
+            except ValueError:
+                raise ValueError(f"Invalid quantity {quantity!r} of {product_id}.") from None
+            if quantity <= 0:
+                raise ValueError(f"Quantity returned of {product_id} must be at least 1.")
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        if not quantities:
+            raise ValueError("Nothing to return.")
+
+        sold = {product_id: (quantity, returned, price_pence)
+                for product_id, _, quantity, returned, price_pence in self.sale_lines(sale_id)}
+        refund = 0
+        items = []
+        for product_id, quantity in quantities.items():
+            bought, returned, price_pence = sold.get(product_id, (0, 0, 0))
+            if quantity > bought - returned:
+                raise ValueError(f"Sale {sale_id} has {bought - returned} of {product_id} left to return, not {quantity}.")
+            refund += quantity * price_pence  # A product sold on several lines is refunded at its lowest price
+            items.append((product_id, quantity, price_pence))
+
+        points = 0
+        if customer_id is not None:
+            refunded = cursor.execute(REFUNDED_SQL, (sale_id,)).fetchone()[0]
+            points = money.points_for(total_pence - refunded) - money.points_for(total_pence - refunded - refund)
+            held = cursor.execute(HELD_ALERT_SQL, (basket,)).fetchone()
+            if held:
+                # None of the sale's points are on the card yet
+                cursor.execute(f"""UPDATE {LOYALTY_SCHEMA}.FraudAlerts
+                                   SET AmountPence = AmountPence - ?, Points = Points - ? WHERE AlertID = ?""",
+                               (refund, points, held[0]))
+                points = 0
+        return_id = cursor.execute("""INSERT INTO returns (sale_id, reference, returned_at, refund_pence, customer_id,
+                                                           points_reversed)
+                                      VALUES (?, ?, ?, ?, ?, ?)""",
+                                   (sale_id, reference, returned_at, refund, customer_id, points)).lastrowid
+        cursor.executemany("INSERT INTO return_items (return_id, product_id, quantity, price_pence) VALUES (?, ?, ?, ?)",
+                           [(return_id,) + item for item in items])
+        for sql, params in StockLedger.stock_change_statements(
+                [(product_id, quantity) for product_id, quantity, _ in items], "return", basket=basket,
+                moved_at=returned_at):
+            cursor.execute(sql, params)
+        if customer_id is not None and not held:
+            cursor.execute(f"""INSERT INTO {LOYALTY_SCHEMA}.Transactions (CustomerID, TransactionDate, TotalAmountPence,
+                                                                          PointsEarned)
+                               VALUES (?, ?, ?, ?)""", (customer_id, returned_at, -refund, -points))
+            cursor.execute(f"UPDATE {LOYALTY_SCHEMA}.Customer SET TotalPoints = MAX(TotalPoints - ?, 0) WHERE CustomerID = ?",
+                           (points, customer_id))
+        return refund, points
+
+    @metrics.timed("returns.batch")
+    def process(self, returns):
+        """Apply [(reference, sale, [(product_id, quantity)])] in one transaction, a savepoint per return.
+
+        Returns ([(reference, refund_pence, points_reversed)] done,
+        [(reference, reason)] rejected); a rejected return writes nothing.
+        """
+        if self.conn.in_transaction:
+            self.conn.commit()
+        done, rejected = [], []
+        returned_at = dates.now()
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for reference, sale, lines in returns:
+                cursor.execute("SAVEPOINT return_line")
+                try:
+                    refund, points = self._apply(cursor, reference, sale, lines, returned_at)
+                    done.append((reference, refund, points))
+                except ValueError as e:
+                    cursor.execute("ROLLBACK TO return_line")
+                    rejected.append((reference, str(e)))
+                cursor.execute("RELEASE return_line")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return done, rejected
+
+    def refund(self, sale, lines, reference=None):
+        """Return [(product_id, quantity)] from one sale. Returns (refund_pence, points_reversed); raises ValueError."""
+        done, rejected = self.process([(reference or uuid.uuid4().hex, sale, lines)])
+        if rejected:
+            raise ValueError(rejected[0][1])
+        return done[0][1:]
+
+    def process_file(self, path):
+        """Apply a CSV file of returns, one line per product returned, in batches. Returns (done, rejected).
+
+        The columns are FILE_COLUMNS; consecutive lines with the same reference
+        are one return.
+        """
+        done, rejected = [], []
+        batch = []
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f)
+            missing = set(FILE_COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(f"{path} has no {', '.join(sorted(missing))} column.")
+            for line in reader:
+                reference, quantity = line["reference"].strip(), line["quantity"].strip()
+                if batch and batch[-1][0] == reference:
+                    batch[-1][2].append((line["product_id"].strip(), quantity))
+                    continue
+                if len(batch) == self.batch_returns:
+                    finished = self.process(batch)
+                    done, rejected = done + finished[0], rejected + finished[1]
+                    batch = []
+                batch.append((reference, line["sale"].strip(), [(line["product_id"].strip(), quantity)]))
+        if batch:
+            finished = self.process(batch)
+            done, rejected = done + finished[0], rejected + finished[1]
+        return done, rejected
+
+
+def returns_menu(returns):
+    """Take one return at the service desk: find the sale, pick what came back, and refund it."""
+    print("\n--- RETURNS AND REFUNDS ---")
+    try:
+        sale_id, _, sale_date, total_pence, customer_id = returns.find_sale(input("Enter the sale ID or basket ID: ").strip())
+    except ValueError as e:
+        print(e)
+        return
+    lines = returns.sale_lines(sale_id)
+    print(f"\nSale {sale_id} of {dates.format_date(sale_date)}, £{money.format_pounds(total_pence)}"
+          f"{f', loyalty customer {customer_id}' if customer_id is not None else ''}:")
+    for product_id, name, quantity, returned, price_pence in lines:
+        print(f"  {product_id:<12} {name:<30} {quantity - returned} of {quantity} returnable at "
+              f"£{money.format_pounds(price_pence)}")
+
+    items = []
+    while True:
+        product_id = input("Enter a Product ID being returned (press Enter when done): ").strip()
+        if not product_id:
+            break
+        try:
+            items.append((product_id, int(input("Enter the quantity returned: "))))
+        except ValueError:
+            print("Invalid quantity. Please enter a valid number.")
+    if not items:
+        print("No return recorded.")
+        return
+    try:
+        refund, points = returns.refund(sale_id, items)
+    except ValueError as e:
+        print(e)
+        return
+    print(f"Refund £{money.format_pounds(refund)}; stock put back"
+          f"{f' and {points} loyalty points taken back' if points else ''}.")
+
+
+if __name__ == "__main__":
+    from data_access import InventorySystem, INVENTORY_DB, LOYALTY_DB
+
+    parser = argparse.ArgumentParser(description="Process a file of returns, or show what a sale has left to return.")
+    parser.add_argument("command", choices=("process", "show"))
+    parser.add_argument("target", help="process: CSV file of returns (reference,sale,product_id,quantity); "
+                                       "show: sale ID or basket ID")
+    parser.add_argument("--db", default=INVENTORY_DB, help="inventory database")
+    parser.add_argument("--loyalty-db", default=LOYALTY_DB, help="loyalty database")
+    parser.add_argument("--batch-returns", type=int, default=BATCH_RETURNS, help="returns per transaction")
+    args = parser.parse_args()
+
+    inventory = InventorySystem(args.db)  # Makes sure the returns tables and sales.customer_id exist
+    inventory.conn.execute("PRAGMA busy_timeout = 30000")  # Lanes keep selling while batches go
+    returns = Returns(inventory.conn, args.loyalty_db, args.batch_returns)
+    try:
+        if args.command == "process":
+            began = time.perf_counter()
+            done, rejected = returns.process_file(args.target)
+            for reference, reason in rejected:
+                print(f"Rejected {reference}: {reason}")
+            print(f"Refunded £{money.format_pounds(sum(refund for _, refund, _ in done))} on {len(done)} returns, "
+                  f"taking back {sum(points for *_, points in done)} points; rejected {len(rejected)}, "
+                  f"in {time.perf_counter() - began:.1f}s.")
+        else:
+            sale_id, basket, sale_date, total_pence, customer_id = returns.find_sale(args.target)
+            print(f"Sale {sale_id} (basket {basket}) of {dates.format_date(sale_date)}, £{money.format_pounds(total_pence)}"
+                  f"{f', loyalty customer {customer_id}' if customer_id is not None else ''}")
+            for product_id, name, quantity, returned, price_pence in returns.sale_lines(sale_id):
+                print(f"  {product_id:<12} {name:<30} sold {quantity}, returned {returned}, at "
+                      f"£{money.format_pounds(price_pence)}")
+    except (ValueError, OSError) as e:
+        raise SystemExit(str(e))
+    finally:
+        inventory.close_connection()
@@ -0,0 +1,147 @@
+import os
+import time
+import argparse
+from bisect import bisect_left
+from collections import Counter
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+from data_access import DataLayer, connect_read_only
+
+# Recency/frequency/monetary scoring over the loyalty Transactions table.
+#
+# Customers are split into CustomerID ranges and each range is aggregated
+# by SQLite with one GROUP BY (set-based, so no per-row Python), in a pool of
+# worker processes with read-only connections. The job makes two passes:
+# the first only returns value histograms, which are merged to find the
+# quintile cut-offs; the second scores each range and the parent writes
+# it to CustomerSegment as it arrives. No pass ever holds more than one
+# range of customers in memory.
+
+# (segment, tier) for each rule, first match wins. r, f and m are 1-5 scores.
+SEGMENT_RULES = [
+    (lambda r, f, m: r >= 4 and f >= 4 and m >= 4, "Champions", "Gold"),
+    (lambda r, f, m: r >= 3 and f >= 4, "Loyal", "Silver"),
+    (lambda r, f, m: r == 5 and f == 1, "New", "Standard"),
+    (lambda r, f, m: r >= 4 and f >= 2, "Potential Loyalist", "Silver"),
+    (lambda r, f, m: r <= 2 and f >= 3, "At Risk", "Silver"),
+    (lambda r, f, m: r <= 2 and f <= 2, "Hibernating", "Standard"),
+    (lambda r, f, m: True, "Needs Attention", "Standard"),
+]
+
+
+def segment_for(r_score, f_score, m_score):
+    for rule, segment, tier in SEGMENT_RULES:
+        if rule(r_score, f_score, m_score):
+            return segment, tier
+
+
+def _aggregate(conn, as_of, first_id, last_id):
+    """(CustomerID, recency_days, frequency, monetary_pence) for every customer with dated transactions in the range.
+
+    History that archive.py has moved out of Transactions is counted through
+    the per-customer totals it leaves behind in ArchivedTransactionTotals.
+    Refunds (negative rows written by returns.py) come off the spend but are
+    not visits.
+    """
+    return conn.execute("""
+        SELECT CustomerID,
+               CAST(julianday(?) - julianday(MAX(LastDate)) AS INTEGER),
+               SUM(Visits),
+               SUM(AmountPence)
+        FROM (SELECT CustomerID, MAX(TransactionDate) AS LastDate, SUM(IFNULL(TotalAmountPence, 0) >= 0) AS Visits,
+                     SUM(TotalAmountPence) AS AmountPence
+              FROM Transactions
+              WHERE CustomerID BETWEEN ? AND ? AND TransactionDate IS NOT NULL
+              GROUP BY CustomerID
+              UNION ALL
+              SELECT CustomerID, LastTransactionDate, TransactionCount, TotalAmountPence
+              FROM ArchivedTransactionTotals
+              WHERE CustomerID BETWEEN ? AND ?)
+        GROUP BY CustomerID
+    """, (as_of, first_id, last_id, first_id, last_id)).fetchall()
+
+
+def _histograms(job):
+    """Pass 1 worker: value counts for one CustomerID range."""
+    db_file, as_of, first_id, last_id = job
+    conn = connect_read_only(db_file)
+    recency, frequency, monetary = Counter(), Counter(), Counter()
+    for _, days, count, pence in _aggregate(conn, as_of, first_id, last_id):
+        recency[days] += 1
+        frequency[count] += 1
+        monetary[pence // 100] += 1  # Whole pounds are plenty for finding quintiles
+    conn.close()
+    return recency, frequency, monetary
+
+
+def _score(job):
+    """Pass 2 worker: scored CustomerSegment rows for one CustomerID range."""
+    db_file, as_of, first_id, last_id, cutoffs, computed_at = job
+    r_cutoffs, f_cutoffs, m_cutoffs = cutoffs
+    conn = connect_read_only(db_file)
+    rows = []
+    for customer_id, days, count, pence in _aggregate(conn, as_of, first_id, last_id):
+        r_score = 5 - bisect_left(r_cutoffs, days)  # Fewer days since the last visit scores higher
+        f_score = 1 + bisect_left(f_cutoffs, count)
+        m_score = 1 + bisect_left(m_cutoffs, pence // 100)
+        segment, tier = segment_for(r_score, f_score, m_score)
+        rows.append((customer_id, days, count, pence, r_score, f_score, m_score, segment, tier, computed_at))
+    conn.close()
+    return rows
+
+
+def quintile_cutoffs(counts):
+    """The four values splitting a value -> count histogram into five equal groups."""
+    total = sum(counts.values())
+    cutoffs, seen, values = [], 0, sorted(counts)
+    targets = [total * q / 5 for q in (1, 2, 3, 4)]
+    for value in values:
+        seen += counts[value]
+        while targets and seen >= targets[0]:
+            cutoffs.append(value)
+            targets.pop(0)
+    return cutoffs or [0, 0, 0, 0]
+
+
+def run(db_file, as_of, workers, chunk_size):
+    """Score every customer and write the results to CustomerSegment. Returns the number of customers scored."""
+    data_layer = DataLayer(db_file)  # Makes sure the CustomerSegment table exists
+    first_id, last_id = data_layer.conn.execute("""
+        SELECT MIN(FirstID), MAX(LastID) FROM (
+            SELECT MIN(CustomerID) AS FirstID, MAX(CustomerID) AS LastID FROM Transactions
+            UNION ALL
+            SELECT MIN(CustomerID), MAX(CustomerID) FROM ArchivedTransactionTotals)
+    """).fetchone()
+    if first_id is None:
+        return 0
+    ranges = [(start, min(start + chunk_size - 1, last_id)) for start in range(first_id, last_id + 1, chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        recency, frequency, monetary = Counter(), Counter(), Counter()
+        for r, f, m in pool.map(_histograms, [(db_file, as_of, first, last) for first, last in ranges]):
+            recency.update(r)
+            frequency.update(f)
+            monetary.update(m)
+        cutoffs = (quintile_cutoffs(recency), quintile_cutoffs(frequency), quintile_cutoffs(monetary))
+
+        computed_at = date.today().isoformat()
+        scored = 0
+        jobs = [(db_file, as_of, first, last, cutoffs, computed_at) for first, last in ranges]
+        for rows in pool.map(_score, jobs):
+            data_layer.save_customer_segments(rows)
+            scored += len(rows)
+    data_layer.close()
+    return scored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute RFM scores and segments for every loyalty customer.")
+    parser.add_argument("--db", default="LoyaltyCardSystem.db", help="loyalty database")
+    parser.add_argument("--as-of", default=date.today().isoformat(), help="date recency is measured from (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="customers per CustomerID range")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    count = run(args.db, args.as_of, args.workers, args.chunk_size)
+    print(f"Scored {count} customers in {time.perf_counter() - began:.1f}s.")
@@ -0,0 +1,116 @@
+import re
+import sqlite3
+import metrics
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+# How many index matches are considered for each result returned
+CANDIDATES_PER_RESULT = 20
+
+# {category} is "" or CATEGORY_FILTER_SQL
+SEARCH_SQL = """
+    SELECT i.product_id, i.name, i.price_pence, i.quantity
+    FROM inventory_search s
+    JOIN inventory i ON i.rowid = s.rowid
+    WHERE inventory_search MATCH ?{category}
+    LIMIT ?
+"""
+CATEGORY_FILTER_SQL = " AND i.category_id = ?"
+
+
+class ProductSearchIndex:
+    """Full-text name search over the inventory table using SQLite FTS5.
+
+    The index is an external-content FTS5 table, so product names are not
+    stored twice. Triggers on inventory keep it up to date one row at a time
+    as products are added, renamed or removed; stock changes do not touch it.
+    Prefix indexes for the first few characters make search-as-you-type
+    lookups a single index probe.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.available = self._create_index()
+
+    def _create_index(self):
+        """Create the FTS5 table and its sync triggers. Returns False if FTS5 is unavailable."""
+        cursor = self.conn.cursor()
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'inventory_search'").fetchone()
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS inventory_search USING fts5(
+                    name,
+                    product_id UNINDEXED,
+                    category_id UNINDEXED,
+                    content='inventory',
+                    content_rowid='rowid',
+                    prefix='1 2 3',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            print(f"Product search index unavailable, falling back to LIKE search: {e}")
+            return False
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS inventory_search_insert AFTER INSERT ON inventory BEGIN
+                INSERT INTO inventory_search (rowid, name, product_id, category_id)
+                VALUES (new.rowid, new.name, new.product_id, new.category_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS inventory_search_delete AFTER DELETE ON inventory BEGIN
+                INSERT INTO inventory_search (inventory_search, rowid, name, product_id, category_id)
+                VALUES ('delete', old.rowid, old.name, old.product_id, old.category_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS inventory_search_update AFTER UPDATE OF product_id, name, category_id ON inventory BEGIN
+                INSERT INTO inventory_search (inventory_search, rowid, name, product_id, category_id)
+                VALUES ('delete', old.rowid, old.name, old.product_id, old.category_id);
+                INSERT INTO inventory_search (rowid, name, product_id, category_id)
+                VALUES (new.rowid, new.name, new.product_id, new.category_id);
+            END
+        """)
+
+        # Index any products that were added before the search index existed
+        if not exists:
+            cursor.execute("INSERT INTO inventory_search (inventory_search) VALUES ('rebuild')")
+        self.conn.commit()
+        return True
+
+    @staticmethod
+    def _match_expression(query):
+        """Turn free text into an FTS5 query where every word must match as a prefix."""
+        return " ".join(f'"{term}"*' for term in _TERM.findall(query))
+
+    @metrics.timed("search.search")
+    def search(self, query, category_id=None, limit=10):
+        """Return up to limit (product_id, name, price_pence, quantity) rows whose name matches query."""
+        expression = self._match_expression(query)
+        if not expression:
+            return []
+
+        cursor = self.conn.cursor()
+        if not self.available:
+            sql = "SELECT product_id, name, price_pence, quantity FROM inventory WHERE name LIKE ?"
+            params = [f"%{query.strip()}%"]
+            if category_id is not None:
+                sql += " AND category_id = ?"
+                params.append(category_id)
+            cursor.execute(sql + " ORDER BY name LIMIT ?", params + [limit])
+            return cursor.fetchall()
+
+        # Ranking every match with bm25 gets slow for short, common prefixes on a
+        # big catalogue, so take a bounded set of candidates in index order and
+        # rank just those: names starting with the query first, then shortest.
+        category, params = "", [expression]
+        if category_id is not None:
+            category = CATEGORY_FILTER_SQL
+            params.append(category_id)
+        cursor.execute(SEARCH_SQL.format(category=category), params + [limit * CANDIDATES_PER_RESULT])
+        lowered = query.strip().lower()
+        candidates = cursor.fetchall()
+        candidates.sort(key=lambda row: (not row[1].lower().startswith(lowered), len(row[1])))
+        return candidates[:limit]
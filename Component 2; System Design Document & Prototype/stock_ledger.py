@@ -0,0 +1,230 @@
+import sqlite3
+import argparse
+import dates
+import metrics
+
+# Reasons a product's stock can change. Negative deltas take stock out.
+# "oversold" puts back units a queued sale took beyond the stock on record.
+REASONS = ("initial", "sale", "return", "restock", "adjustment", "stock_count", "oversold")
+
+ADJUST_STOCK_SQL = "UPDATE inventory SET quantity = quantity + ? WHERE product_id = ?"
+RECORD_MOVEMENT_SQL = """INSERT INTO stock_movements (product_id, delta, reason, lane, basket, moved_at)
+                         SELECT product_id, ?, ?, ?, ?, ? FROM inventory WHERE product_id = ?"""
+OVERSOLD_MOVEMENT_SQL = """INSERT INTO stock_movements (product_id, delta, reason, lane, basket, moved_at)
+                           SELECT product_id, -quantity, 'oversold', ?, ?, ? FROM inventory
+                           WHERE product_id = ? AND quantity < 0"""
+OVERSOLD_RESET_SQL = "UPDATE inventory SET quantity = 0 WHERE product_id = ? AND quantity < 0"
+SNAPSHOT_AT_SQL = """SELECT quantity, last_movement_id FROM stock_snapshots
+                     WHERE product_id = ? AND taken_at <= ? ORDER BY taken_at DESC LIMIT 1"""
+MOVED_SINCE_SQL = """SELECT COALESCE(SUM(delta), 0), COUNT(*) FROM stock_movements
+                     WHERE product_id = ? AND movement_id > ? AND moved_at <= ?"""
+
+
+class StockLedger:
+    """Append-only record of every change to inventory.quantity, with per-product snapshots.
+
+    Each change is written as a stock_movements row (signed delta, reason,
+    lane and basket) in the same transaction as the quantity update; see
+    stock_change_statements. Snapshots record a product's quantity and the
+    last movement it includes, so the stock at any time is the latest
+    snapshot at or before it plus the movements after that snapshot, found
+    through the (product_id, movement_id) index. Only the movements since the
+    last snapshot are read, not the product's whole history.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._create_tables()
+
+    def _create_tables(self):
+        cursor = self.conn.cursor()
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_movements'").fetchone()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stock_movements (
+                movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id TEXT NOT NULL,
+                delta INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                lane TEXT,
+                basket TEXT,
+                moved_at TEXT NOT NULL
+            )
+        """)
+        cursor.execute("""CREATE INDEX IF NOT EXISTS idx_stock_movements_product_id_movement_id
+                          ON stock_movements (product_id, movement_id)""")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_moved_at ON stock_movements (moved_at)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stock_snapshots (
+                product_id TEXT NOT NULL,
+                taken_at TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                last_movement_id INTEGER NOT NULL,
+                PRIMARY KEY (product_id, taken_at)
+            ) WITHOUT ROWID
+        """)
+        # Mistakes are corrected with a new movement, never by editing an old one
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS stock_movements_append_only BEFORE UPDATE ON stock_movements BEGIN
+                SELECT RAISE(ABORT, 'stock_movements is append-only');
+            END
+        """)
+        self.conn.commit()
+
+        # Stock that was there before the ledger existed becomes its starting point
+        if not exists:
+            self.take_snapshots(min_movements=0)
+
+    @staticmethod
+    def stock_change_statements(changes, reason, lane=None, basket=None, moved_at=None):
+        """(sql, params) statements that apply [(product_id, delta)] to inventory and record each movement.
+
+        They must be run in one transaction, or queued as one lane queue entry.
+        Movements are only recorded for products that exist.
+        """
+        if reason not in REASONS:
+            raise ValueError(f"Unknown stock movement reason: {reason!r}")
+        moved_at = moved_at or dates.now()
+        statements = [(ADJUST_STOCK_SQL, (delta, product_id)) for product_id, delta in changes]
+        statements += [(RECORD_MOVEMENT_SQL, (delta, reason, lane, basket, moved_at, product_id))
+                       for product_id, delta in changes]
+        return statements
+
+    @staticmethod
+    def stock_count_statements(product_id, counted, lane=None, moved_at=None):
+        """(sql, params) statements that set a product's stock to a physical count and record the difference.
+
+        The difference is worked out when the statements run, so a queued count
+        is still right if sales were applied in between.
+        """
+        return [("""INSERT INTO stock_movements (product_id, delta, reason, lane, basket, moved_at)
+                    SELECT product_id, ? - quantity, 'stock_count', ?, NULL, ? FROM inventory WHERE product_id = ?""",
+                 (counted, lane, moved_at or dates.now(), product_id)),
+                ("UPDATE inventory SET quantity = ? WHERE product_id = ?", (counted, product_id))]
+
+    @staticmethod
+    def oversold_statements(product_ids, lane=None, basket=None, moved_at=None):
+        """(sql, params) statements that bring any of the products whose stock is below zero back to zero.
+
+        The units are recorded as an "oversold" movement: the shelf held more
+        than the stock on record, so it is due a count. For sales applied from
+        a lane queue, which were paid for before their stock could be checked.
+        """
+        moved_at = moved_at or dates.now()
+        statements = []
+        for product_id in product_ids:
+            statements += [(OVERSOLD_MOVEMENT_SQL, (lane, basket, moved_at, product_id)),
+                           (OVERSOLD_RESET_SQL, (product_id,))]
+        return statements
+
+    @metrics.timed("stock_ledger.take_snapshots")
+    def take_snapshots(self, min_movements=1):
+        """Snapshot every product with at least min_movements movements since its last snapshot. Returns the count.
+
+        Runs in one write transaction so each quantity matches the last movement it is recorded against.
+        """
+        cursor = self.conn.cursor()
+        if self.conn.in_transaction:
+            self.conn.commit()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            last_movement_id = cursor.execute("SELECT COALESCE(MAX(movement_id), 0) FROM stock_movements").fetchone()[0]
+            cursor.execute("""
+                INSERT OR REPLACE INTO stock_snapshots (product_id, taken_at, quantity, last_movement_id)
+                SELECT i.product_id, ?, i.quantity, ? FROM inventory i
+                WHERE (SELECT COUNT(*) FROM stock_movements m
+                       WHERE m.product_id = i.product_id AND m.movement_id <= ? AND m.movement_id >
+                             COALESCE((SELECT s.last_movement_id FROM stock_snapshots s WHERE s.product_id = i.product_id
+                                       ORDER BY s.taken_at DESC LIMIT 1), -1)) >= ?
+            """, (dates.now(), last_movement_id, last_movement_id, min_movements))
+            taken = cursor.rowcount
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        return taken
+
+    def rebaseline(self):
+        """Forget all movements and snapshots and start again from the current stock, e.g. after a bulk load."""
+        self.conn.execute("DELETE FROM stock_movements")
+        self.conn.execute("DELETE FROM stock_snapshots")
+        self.conn.commit()
+        self.take_snapshots(min_movements=0)
+
+    @metrics.timed("stock_ledger.stock_at")
+    def stock_at(self, product_id, at):
+        """The quantity of a product at an ISO date/timestamp, or None if it had no stock history by then."""
+        snapshot = self.conn.execute(SNAPSHOT_AT_SQL, (product_id, at)).fetchone()
+        quantity, last_movement_id = snapshot if snapshot else (None, 0)
+        moved, count = self.conn.execute(MOVED_SINCE_SQL, (product_id, last_movement_id, at)).fetchone()
+        if quantity is None and not count:
+            return None
+        return (quantity or 0) + moved
+
+    def stock_levels_at(self, at):
+        """{product_id: quantity} at an ISO date/timestamp for every product in inventory with stock history by then."""
+        rows = self.conn.execute("""
+            SELECT product_id, COALESCE(base_quantity, 0) + COALESCE(moved, 0) FROM (
+                SELECT p.product_id, p.base_quantity,
+                       (SELECT SUM(m.delta) FROM stock_movements m
+                        WHERE m.product_id = p.product_id AND m.movement_id > p.last_movement_id AND m.moved_at <= :at) AS moved
+                FROM (SELECT i.product_id, s.quantity AS base_quantity, COALESCE(s.last_movement_id, 0) AS last_movement_id
+                      FROM inventory i
+                      LEFT JOIN stock_snapshots s ON s.product_id = i.product_id AND s.taken_at =
+                          (SELECT MAX(taken_at) FROM stock_snapshots WHERE product_id = i.product_id AND taken_at <= :at)) p
+            ) WHERE base_quantity IS NOT NULL OR moved IS NOT NULL
+        """, {"at": at})
+        return dict(rows)
+
+    def movements(self, product_id, since=None, until=None):
+        """A product's movements, oldest first, as (movement_id, delta, reason, lane, basket, moved_at) rows."""
+        return self.conn.execute("""SELECT movement_id, delta, reason, lane, basket, moved_at FROM stock_movements
+                                    WHERE product_id = ? AND moved_at >= ? AND moved_at <= ? ORDER BY movement_id""",
+                                 (product_id, since or "", until or "9999")).fetchall()
+
+    def movements_by_reason(self, since=None, until=None):
+        """(reason, movements, units) totals over a time range; stock_count and adjustment losses are shrinkage."""
+        return self.conn.execute("""SELECT reason, COUNT(*), SUM(delta) FROM stock_movements
+                                    WHERE moved_at >= ? AND moved_at <= ? GROUP BY reason ORDER BY reason""",
+                                 (since or "", until or "9999")).fetchall()
+
+    def shrinkage(self, since=None, until=None, limit=20):
+        """Products losing the most stock to counts and manual adjustments: (product_id, name, units_lost) rows."""
+        return self.conn.execute("""SELECT m.product_id, i.name, -SUM(m.delta) AS lost FROM stock_movements m
+                                    LEFT JOIN inventory i ON i.product_id = m.product_id
+                                    WHERE m.reason IN ('stock_count', 'adjustment') AND m.delta < 0
+                                      AND m.moved_at >= ? AND m.moved_at <= ?
+                                    GROUP BY m.product_id ORDER BY lost DESC LIMIT ?""",
+                                 (since or "", until or "9999", limit)).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stock ledger maintenance and point-in-time stock queries.")
+    parser.add_argument("command", choices=("snapshot", "at", "report"))
+    parser.add_argument("--db", default="InventorySystem.db", help="inventory database")
+    parser.add_argument("--min-movements", type=int, default=1, help="snapshot: only products with this many new movements")
+    parser.add_argument("--time", help="at: ISO date or timestamp (default now)")
+    parser.add_argument("--product", help="at: a single product ID")
+    parser.add_argument("--since", help="report: start of the period (ISO)")
+    parser.add_argument("--until", help="report: end of the period (ISO)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    ledger = StockLedger(conn)
+    if args.command == "snapshot":
+        print(f"Snapshotted {ledger.take_snapshots(args.min_movements)} products.")
+    elif args.command == "at":
+        at = dates.parse_timestamp(args.time) if args.time else dates.now()
+        levels = {args.product: ledger.stock_at(args.product, at)} if args.product else ledger.stock_levels_at(at)
+        for product_id, quantity in sorted(levels.items()):
+            print(f"{product_id}\t{quantity}")
+    else:
+        since = dates.parse_timestamp(args.since) if args.since else None
+        until = dates.parse_timestamp(args.until) if args.until else None
+        print("Reason           Movements      Units")
+        for reason, count, units in ledger.movements_by_reason(since, until):
+            print(f"{reason:<16} {count:>9} {units:>10}")
+        print("\nShrinkage (units lost to stock counts and adjustments):")
+        for product_id, name, lost in ledger.shrinkage(since, until):
+            print(f"{product_id:<10} {name or '':<40} {lost:>6}")
+    conn.close()
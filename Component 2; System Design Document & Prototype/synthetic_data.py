@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+import dates
+from customer_validation import luhn_check_digit
+from data_access import InventorySystem, DataLayer
+from search_index import ProductSearchIndex
+import category_tree
+
+# Deterministic generator for benchmark-sized stores. The same seed always
+# produces the same rows. Rows are produced lazily and written with
+# executemany in large chunks inside one transaction per chunk, with
+# journaling off, so memory stays flat however many baskets are requested.
+
+CHUNK_SIZE = 50_000
+DATE_FORMAT = dates.DATE_FORMAT
+SALE_DATE_FORMAT = dates.TIMESTAMP_FORMAT
+
+DEPARTMENTS = ["Dairy", "Snacks", "Beverages", "Bakery", "Fruit & Veg.", "Frozen Foods",
+               "Toiletries & Beauty", "Home & Entertainment", "Clothing", "Other"]
+# Top-level groups the departments roll up into, numbered after the departments
+DEPARTMENT_GROUPS = {"Food & Drink": ["Dairy", "Snacks", "Beverages", "Bakery", "Fruit & Veg.", "Frozen Foods"],
+                     "Household": ["Toiletries & Beauty", "Home & Entertainment", "Clothing", "Other"]}
+ADJECTIVES = ["Organic", "Fresh", "Large", "Small", "Family", "Value", "Premium", "Light", "Classic", "Spicy",
+              "Sweet", "Salted", "Whole", "Semi-Skimmed", "Free Range", "Mini", "Giant", "Original", "Smoked", "Crunchy"]
+NOUNS = ["Milk", "Bread", "Eggs", "Butter", "Cheese", "Yoghurt", "Crisps", "Chocolate", "Biscuits", "Cola",
+         "Juice", "Water", "Coffee", "Tea", "Apples", "Bananas", "Potatoes", "Carrots", "Pizza", "Peas",
+         "Shampoo", "Toothpaste", "Soap", "Batteries", "Candles", "Socks", "Rice", "Pasta", "Beans", "Soup"]
+FIRST_NAMES = ["Jacob", "Sophia", "Mason", "Olivia", "Amir", "Chloe", "Noah", "Aisha", "Leo", "Grace",
+               "Oscar", "Priya", "Harry", "Mia", "Yusuf", "Isla", "Jack", "Zara", "Theo", "Ella"]
+LAST_NAMES = ["Smith", "Taylor", "Jones", "Brown", "Khan", "Williams", "Patel", "Wilson", "Evans", "Thomas",
+              "Roberts", "Ali", "Walker", "Wright", "Green", "Hall", "Wood", "Clarke", "Hughes", "Edwards"]
+STREETS = ["High Street", "Station Road", "Victoria Avenue", "Church Lane", "Park Road", "Mill Lane"]
+
+# Relative shoppers per hour of the day (store open 07:00-22:00) and per weekday (Mon=0)
+HOUR_WEIGHTS = {7: 2, 8: 4, 9: 4, 10: 5, 11: 7, 12: 10, 13: 9, 14: 5, 15: 5, 16: 7, 17: 10, 18: 9, 19: 6, 20: 4, 21: 2}
+WEEKDAY_WEIGHTS = [0.9, 0.85, 0.9, 0.95, 1.15, 1.35, 1.0]
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative Zipf weights for ranks 1..count, for use with bisect or random.choices."""
+    return list(accumulate(1.0 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def generate_categories():
+    """(category_id, name, parent_id) rows: each department under its group."""
+    group_ids = {group: len(DEPARTMENTS) + n for n, group in enumerate(DEPARTMENT_GROUPS, start=1)}
+    parents = {name: group_ids[group] for group, names in DEPARTMENT_GROUPS.items() for name in names}
+    return ([(category_id, name, parents[name]) for category_id, name in enumerate(DEPARTMENTS, start=1)] +
+            [(category_id, group, None) for group, category_id in group_ids.items()])
+
+
+def generate_products(rng, count, prices):
+    """Yield (product_id, name, price_pence, quantity, category_id) rows, filling prices as it goes."""
+    for n in range(1, count + 1):
+        name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(('', 'x2 ', 'x4 ', '500g ', '1L '))}#{n}"
+        price_pence = max(10, int(rng.lognormvariate(5.3, 0.8)))  # Median around £2
+        prices.append(price_pence)
+        yield str(n), name, price_pence, rng.randint(0, 500), rng.randint(1, len(DEPARTMENTS))
+
+
+def generate_customers(rng, count, points, start):
+    """Yield Customer rows. points holds the TotalPoints accrued by the generated transactions."""
+    for n in range(1, count + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        body = "5" + "".join(str(rng.randint(0, 9)) for _ in range(14))
+        card = body + luhn_check_digit(body)
+        issued = start - timedelta(days=rng.randint(0, 1500))
+        yield (n, first, last, f"{first.lower()}.{last.lower()}{n}@example.com",
+               "07" + "".join(str(rng.randint(0, 9)) for _ in range(9)),
+               f"{rng.randint(1, 250)} {rng.choice(STREETS)}",
+               " ".join(card[i:i + 4] for i in range(0, 16, 4)),
+               issued.strftime(DATE_FORMAT), (issued + timedelta(days=5 * 365 + 1)).strftime(DATE_FORMAT), points[n])
+
+
+def generate_baskets(rng, baskets, days, start, prices, customers, loyalty_share, zipf_exponent):
+    """Yield (sale, items, loyalty_transaction) for each basket in time order.
+
+    Product popularity follows a Zipf distribution over a shuffled ranking,
+    so the best sellers are spread across IDs; basket times follow the
+    HOUR_WEIGHTS and WEEKDAY_WEIGHTS profiles.
+    """
+    product_count = len(prices)
+    ranking = list(range(1, product_count + 1))
+    rng.shuffle(ranking)
+    cum_weights = zipf_cum_weights(product_count, zipf_exponent)
+    total_weight = cum_weights[-1]
+    hours = list(HOUR_WEIGHTS)
+    hour_weights = list(HOUR_WEIGHTS.values())
+
+    day_weights = [WEEKDAY_WEIGHTS[(start + timedelta(days=d)).weekday()] for d in range(days)]
+    day_total = sum(day_weights)
+    sale_id = 0
+    for day in range(days):
+        date = start + timedelta(days=day)
+        remaining = baskets - sale_id
+        count = remaining if day == days - 1 else min(remaining, round(baskets * day_weights[day] / day_total))
+        times = sorted(zip(rng.choices(hours, hour_weights, k=count), (rng.randrange(60) for _ in range(count))))
+        for hour, minute in times:
+            sale_id += 1
+            when = date.replace(hour=hour, minute=minute)
+            lines = {}
+            for _ in range(min(60, int(rng.expovariate(1 / 8)) + 1)):  # Mean of about 8 lines
+                product = ranking[bisect_left(cum_weights, rng.random() * total_weight)]
+                lines[product] = lines.get(product, 0) + (1 if rng.random() < 0.85 else rng.randint(2, 4))
+            items = [(sale_id, str(product), quantity, prices[product - 1]) for product, quantity in lines.items()]
+            total_pence = sum(quantity * price for _, _, quantity, price in items)
+            sale = (sale_id, when.strftime(SALE_DATE_FORMAT), total_pence)
+            loyalty = None
+            if customers and rng.random() < loyalty_share:
+                # Skewed towards low IDs, so a minority of regulars do most of the shopping
+                customer_id = 1 + int(customers * rng.random() ** 3)
+                loyalty = (customer_id, sale[1], total_pence, total_pence // 100)
+            yield sale, items, loyalty
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bulk_insert(conn, sql, rows):
+    written = 0
+    for chunk in _chunks(rows):
+        conn.execute("BEGIN")
+        conn.executemany(sql, chunk)
+        conn.execute("COMMIT")
+        written += len(chunk)
+    return written
+
+
+def _fast_load(conn):
+    conn.isolation_level = None
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MB
+
+
+class _BasketSplitter:
+    """Fans the basket stream out into sales, sales_items and loyalty row streams."""
+
+    def __init__(self, baskets, points):
+        self.baskets = baskets
+        self.points = points
+        self.items = []
+        self.loyalty = []
+
+    def sales(self):
+        for sale, items, loyalty in self.baskets:
+            self.items.extend(items)
+            if loyalty:
+                self.loyalty.append(loyalty)
+                self.points[loyalty[0]] += loyalty[3]
+            yield sale
+
+
+def write_sqlite(args, rng, start):
+    for path in (args.inventory_db, args.loyalty_db):
+        if os.path.exists(path):
+            sys.exit(f"{path} already exists; refusing to overwrite it.")
+
+    inventory = InventorySystem(args.inventory_db)
+    loyalty = DataLayer(args.loyalty_db)
+    inv_conn, loy_conn = inventory.conn, loyalty.conn
+    for conn in (inv_conn, loy_conn):
+        _fast_load(conn)
+    # Generated rows are not journaled; a backup taken afterwards is the starting point for restores
+    for system in (inventory, loyalty):
+        system.journal.drop_triggers()
+        system.conn.execute("DELETE FROM journal")
+
+    # Start from empty tables and index names once at the end, not per row
+    inv_conn.execute("DROP TRIGGER IF EXISTS inventory_search_insert")
+    for trigger in category_tree.TRIGGERS:
+        inv_conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    inv_conn.execute("DELETE FROM inventory")
+    inv_conn.execute("DELETE FROM categories")
+    _bulk_insert(inv_conn, "INSERT INTO categories (category_id, name, parent_id) VALUES (?, ?, ?)", generate_categories())
+
+    prices = array("l")
+    began = time.perf_counter()
+    count = _bulk_insert(inv_conn, "INSERT INTO inventory (product_id, name, price_pence, quantity, category_id) VALUES (?, ?, ?, ?, ?)",
+                         generate_products(rng, args.products, prices))
+    inv_conn.execute("INSERT INTO inventory_search (inventory_search) VALUES ('rebuild')")
+    ProductSearchIndex(inv_conn)  # Recreate the sync trigger
+    inventory.stock_ledger.rebaseline()  # Stock history starts from the generated stock
+    print(f"{count} products written in {time.perf_counter() - began:.1f}s")
+
+    began = time.perf_counter()
+    points = array("l", [0]) * (args.customers + 1)
+    baskets = generate_baskets(rng, args.baskets, args.days, start, prices, args.customers,
+                               args.loyalty_share, args.zipf)
+    splitter = _BasketSplitter(baskets, points)
+    sales = items = transactions = 0
+    for chunk in _chunks(splitter.sales()):
+        inv_conn.execute("BEGIN")
+        inv_conn.executemany("INSERT INTO sales (sale_id, sale_date, total_pence) VALUES (?, ?, ?)", chunk)
+        inv_conn.executemany("INSERT INTO sales_items (sale_id, product_id, quantity, price_pence) VALUES (?, ?, ?, ?)",
+                             splitter.items)
+        inv_conn.execute("COMMIT")
+        loy_conn.execute("BEGIN")
+        loy_conn.executemany("""INSERT INTO Transactions (CustomerID, TransactionDate, TotalAmountPence, PointsEarned)
+                                VALUES (?, ?, ?, ?)""", splitter.loyalty)
+        loy_conn.execute("COMMIT")
+        sales, items, transactions = sales + len(chunk), items + len(splitter.items), transactions + len(splitter.loyalty)
+        splitter.items.clear()
+        splitter.loyalty.clear()
+    elapsed = time.perf_counter() - began
+    print(f"{sales} sales, {items} sales lines and {transactions} loyalty transactions written in {elapsed:.1f}s")
+
+    began = time.perf_counter()
+    category_tree.CategoryTree(inv_conn).rebuild()  # Recreate the category triggers and total everything up once
+    print(f"Category totals built in {time.perf_counter() - began:.1f}s")
+
+    began = time.perf_counter()
+    count = _bulk_insert(loy_conn, """INSERT INTO Customer (CustomerID, FirstName, LastName, Email, PhoneNumber, Address,
+                                      CardNumber, IssueDate, ExpiryDate, TotalPoints) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                         generate_customers(rng, args.customers, points, start))
+    print(f"{count} customers written in {time.perf_counter() - began:.1f}s")
+
+    for system in (inventory, loyalty):
+        system.journal.install_triggers()
+    for conn in (inv_conn, loy_conn):
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.execute("ANALYZE")
+        conn.close()
+
+
+def write_jsonl(args, rng, start):
+    os.makedirs(args.jsonl_dir, exist_ok=True)
+
+    def dump(name, columns, rows):
+        path = os.path.join(args.jsonl_dir, f"{name}.jsonl")
+        count = 0
+        with open(path, "w") as jsonl_file:
+            for chunk in _chunks(rows):
+                jsonl_file.write("".join(json.dumps(dict(zip(columns, row))) + "\n" for row in chunk))
+                count += len(chunk)
+        print(f"{count} rows written to {path}")
+
+    prices = array("l")
+    dump("categories", ("category_id", "name", "parent_id"), generate_categories())
+    dump("inventory", ("product_id", "name", "price_pence", "quantity", "category_id"),
+         generate_products(rng, args.products, prices))
+
+    points = array("l", [0]) * (args.customers + 1)
+    splitter = _BasketSplitter(generate_baskets(rng, args.baskets, args.days, start, prices, args.customers,
+                                                args.loyalty_share, args.zipf), points)
+    sales_path = os.path.join(args.jsonl_dir, "sales_items.jsonl")
+    transactions_path = os.path.join(args.jsonl_dir, "Transactions.jsonl")
+    with open(sales_path, "w") as items_file, open(transactions_path, "w") as transactions_file:
+        def sales_with_side_files():
+            for chunk in _chunks(splitter.sales()):
+                yield from chunk
+                items_file.write("".join(json.dumps(dict(zip(("sale_id", "product_id", "quantity", "price_pence"), row)))
+                                         + "\n" for row in splitter.items))
+                transactions_file.write("".join(json.dumps(dict(zip(
+                    ("CustomerID", "TransactionDate", "TotalAmountPence", "PointsEarned"), row))) + "\n"
+                    for row in splitter.loyalty))
+                splitter.items.clear()
+                splitter.loyalty.clear()
+        dump("sales", ("sale_id", "sale_date", "total_pence"), sales_with_side_files())
+
+    dump("Customer", ("CustomerID", "FirstName", "LastName", "Email", "PhoneNumber", "Address", "CardNumber",
+                      "IssueDate", "ExpiryDate", "TotalPoints"), generate_customers(rng, args.customers, points, start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a large, realistic synthetic grocery store dataset.")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--baskets", type=int, default=1_000_000, help="number of sales to generate")
+    parser.add_argument("--days", type=int, default=365, help="days of history the sales are spread over")
+    parser.add_argument("--start-date", default="2024-01-01", help="first day of sales history (YYYY-MM-DD)")
+    parser.add_argument("--loyalty-share", type=float, default=0.6, help="fraction of sales made with a loyalty card")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent for product popularity")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--inventory-db", default="SyntheticInventory.db")
+    parser.add_argument("--loyalty-db", default="SyntheticLoyalty.db")
+    parser.add_argument("--jsonl-dir", help="write JSON Lines files to this directory instead of SQLite")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = datetime.strptime(args.start_date, "%Y-%m-%d")
+    if args.jsonl_dir:
+        write_jsonl(args, rng, start)
+    else:
+        write_sqlite(args, rng, start)
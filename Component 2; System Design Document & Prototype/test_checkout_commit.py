@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+from lane_queue import LaneQueue, Replayer
+from checkout_commit import CheckoutCommit
+from data_access import InventorySystem, DataLayer
+
+
+class OversoldCheckoutTest(unittest.TestCase):
+    """A sale of more than the stock on record is refused at the till, but a queued one is kept and marked oversold."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="grocery_checkout_test_")
+        self.inventory_db = os.path.join(self.work_dir, "inventory.db")
+        self.loyalty_db = os.path.join(self.work_dir, "loyalty.db")
+        self.inventory = InventorySystem(self.inventory_db)
+        self.data_layer = DataLayer(self.loyalty_db)
+        self.data_layer.conn.execute("INSERT INTO Customer (FirstName, TotalPoints) VALUES ('A', 0)")
+        self.data_layer.conn.commit()
+        self.product_id, self.stock = self.inventory.conn.execute(
+            "SELECT product_id, quantity FROM inventory LIMIT 1").fetchone()
+        self.lane_queue = LaneQueue(os.path.join(self.work_dir, "lane_queue.db"))
+
+    def tearDown(self):
+        self.lane_queue.close()
+        self.inventory.close_connection()
+        self.data_layer.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def count(self, conn, table):
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def quantity(self):
+        return self.inventory.conn.execute("SELECT quantity FROM inventory WHERE product_id = ?",
+                                           (self.product_id,)).fetchone()[0]
+
+    def test_direct_oversell_writes_nothing(self):
+        movements = self.count(self.inventory.conn, "stock_movements")
+        sale = CheckoutCommit(self.inventory.conn, self.loyalty_db)
+        with self.assertRaises(ValueError):
+            sale.commit([(self.product_id, "", self.stock + 5, 100)], (self.stock + 5) * 100, "basket-1", 1)
+        self.assertEqual(self.quantity(), self.stock)
+        self.assertEqual(self.count(self.inventory.conn, "sales"), 0)
+        self.assertEqual(self.count(self.inventory.conn, "sales_items"), 0)
+        self.assertEqual(self.count(self.inventory.conn, "stock_movements"), movements)
+        self.assertEqual(self.count(self.data_layer.conn, "Transactions"), 0)
+        self.assertEqual(self.data_layer.conn.execute("SELECT TotalPoints FROM Customer").fetchone()[0], 0)
+
+    def test_queued_oversell_is_recorded_as_oversold(self):
+        sale = CheckoutCommit(self.inventory.conn, self.loyalty_db, lane_queue=self.lane_queue, lane="1",
+                              inventory_db=self.inventory_db)
+        sale.commit([(self.product_id, "", self.stock + 5, 100)], (self.stock + 5) * 100, "basket-1", 1)
+        replayer = Replayer(self.lane_queue)
+        self.assertEqual(replayer.drain_once(), 1)
+        replayer.stop()
+        self.assertEqual(self.quantity(), 0)
+        self.assertEqual(self.inventory.conn.execute(
+            "SELECT reason, delta FROM stock_movements WHERE basket = 'basket-1' ORDER BY movement_id").fetchall(),
+            [("sale", -(self.stock + 5)), ("oversold", 5)])
+        self.assertEqual(self.count(self.inventory.conn, "sales"), 1)
+        self.assertEqual(self.count(self.data_layer.conn, "Transactions"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from lane_queue import LaneQueue, Replayer
+from data_access import InventorySystem
+
+
+class ReplayerTest(unittest.TestCase):
+    """Queued entries are applied once each, and one that keeps failing is set aside without holding up the rest."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="grocery_lane_queue_test_")
+        self.inventory_db = os.path.join(self.work_dir, "inventory.db")
+        self.inventory = InventorySystem(self.inventory_db)
+        self.product_id, self.stock = self.inventory.conn.execute(
+            "SELECT product_id, quantity FROM inventory LIMIT 1").fetchone()
+        self.lane_queue = LaneQueue(os.path.join(self.work_dir, "lane_queue.db"))
+        self.replayer = Replayer(self.lane_queue)
+
+    def tearDown(self):
+        self.replayer.stop()
+        self.lane_queue.close()
+        self.inventory.close_connection()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def sale(self, basket):
+        return [("INSERT INTO sales (sale_date, total_pence, basket) VALUES ('2024-12-18T10:00:00', 100, ?)", (basket,))]
+
+    def baskets(self):
+        return [row[0] for row in self.inventory.conn.execute("SELECT basket FROM sales ORDER BY sale_id")]
+
+    def test_failing_entry_is_dead_lettered_and_can_be_requeued(self):
+        self.lane_queue.enqueue(self.inventory_db, self.sale("basket-1"))
+        self.replayer.drain_once()
+        # The same basket again breaks its unique constraint every time it is tried
+        self.lane_queue.enqueue(self.inventory_db, self.sale("basket-1"))
+        self.lane_queue.enqueue(self.inventory_db, self.sale("basket-2"))
+        self.assertEqual(self.replayer.drain_once(), 1)
+        self.assertEqual(self.baskets(), ["basket-1", "basket-2"])
+        self.assertEqual(self.lane_queue.pending_count(), 0)
+        failed = self.lane_queue.failed()
+        self.assertEqual(len(failed), 1)
+        self.assertIn("UNIQUE", failed[0][4])
+
+        self.inventory.conn.execute("DELETE FROM sales WHERE basket = 'basket-1'")
+        self.inventory.conn.commit()
+        self.lane_queue.requeue([failed[0][0]])
+        self.assertEqual(self.lane_queue.failed(), [])
+        self.assertEqual(self.replayer.drain_once(), 1)
+        self.assertEqual(self.baskets(), ["basket-2", "basket-1"])
+
+    def test_same_key_is_applied_once(self):
+        statements = [("UPDATE inventory SET quantity = quantity - 1 WHERE product_id = ?", (self.product_id,))]
+        for _ in range(2):
+            self.lane_queue.enqueue(self.inventory_db, statements, key="sale-basket-1")
+            self.replayer.drain_once()
+        self.assertEqual(self.lane_queue.pending_count(), 0)
+        self.assertEqual(self.inventory.conn.execute("SELECT quantity FROM inventory WHERE product_id = ?",
+                                                     (self.product_id,)).fetchone()[0], self.stock - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
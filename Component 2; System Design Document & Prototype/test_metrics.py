@@ -0,0 +1,35 @@
+import sqlite3
+import unittest
+import metrics
+
+
+class StatementTimingTest(unittest.TestCase):
+    """Statements run straight on an instrumented connection are timed like those on its cursors."""
+
+    def setUp(self):
+        self.was_enabled = metrics.ENABLED
+        metrics.enable()
+        metrics.reset()
+        self.conn = metrics.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+        metrics.reset()
+        metrics.enable(self.was_enabled)
+
+    def test_connection_execute_is_timed(self):
+        self.conn.execute("CREATE TABLE t (n INTEGER)")
+        self.conn.executemany("INSERT INTO t (n) VALUES (?)", [(1,), (2,)])
+        self.assertEqual(self.conn.execute("SELECT SUM(n)  FROM t").fetchone(), (3,))
+        sql = metrics.snapshot()["sql"]
+        self.assertEqual(sql["SELECT SUM(n) FROM t"]["count"], 1)
+        self.assertEqual(sql["INSERT INTO t (n) VALUES (?)"]["count"], 1)
+
+    def test_connection_execute_errors_are_counted(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            self.conn.execute("SELECT * FROM missing")
+        self.assertEqual(metrics.snapshot()["sql"]["SELECT * FROM missing"]["errors"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
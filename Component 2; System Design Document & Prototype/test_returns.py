@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+import dates
+from returns import Returns
+from checkout_commit import CheckoutCommit
+from data_access import InventorySystem, DataLayer
+
+
+class HeldPointsReturnTest(unittest.TestCase):
+    """A return takes back only the points its sale actually put on the card."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="grocery_returns_test_")
+        self.loyalty_db = os.path.join(self.work_dir, "loyalty.db")
+        self.inventory = InventorySystem(os.path.join(self.work_dir, "inventory.db"))
+        self.data_layer = DataLayer(self.loyalty_db)
+        self.data_layer.conn.execute("INSERT INTO Customer (FirstName, TotalPoints) VALUES ('A', 0)")
+        self.data_layer.conn.commit()
+        self.product_id = self.inventory.conn.execute("SELECT product_id FROM inventory LIMIT 1").fetchone()[0]
+        # A £40 sale whose 40 points the fraud check held
+        alert = (1, "accrual", "held", 5, 3600, dates.now(), 4000, 40)
+        CheckoutCommit(self.inventory.conn, self.loyalty_db).commit([(self.product_id, "", 4, 1000)], 4000, "basket-1", 1,
+                                                                    alert=alert)
+        self.alert_id = self.data_layer.conn.execute("SELECT AlertID FROM FraudAlerts").fetchone()[0]
+        self.returns = Returns(self.inventory.conn, self.loyalty_db)
+
+    def tearDown(self):
+        self.inventory.close_connection()
+        self.data_layer.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def points(self):
+        return self.data_layer.conn.execute("SELECT TotalPoints FROM Customer WHERE CustomerID = 1").fetchone()[0]
+
+    def test_held_sale_keeps_its_customer(self):
+        self.assertEqual(self.returns.find_sale("basket-1")[4], 1)
+        self.assertEqual(self.points(), 0)
+
+    def test_return_while_held_comes_off_the_alert(self):
+        self.assertEqual(self.returns.refund("basket-1", [(self.product_id, 1)]), (1000, 0))
+        self.assertEqual(self.points(), 0)
+        self.data_layer.release_held_accrual(self.alert_id)
+        self.assertEqual(self.points(), 30)
+        self.assertEqual(self.data_layer.conn.execute("SELECT TotalAmountPence, PointsEarned FROM Transactions").fetchall(),
+                         [(3000, 30)])
+
+    def test_return_after_release_takes_back_released_points(self):
+        self.data_layer.release_held_accrual(self.alert_id)
+        self.assertEqual(self.returns.refund("basket-1", [(self.product_id, 1)]), (1000, 10))
+        self.assertEqual(self.points(), 30)
+        with self.assertRaises(ValueError):
+            self.data_layer.release_held_accrual(self.alert_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+import rfm
+from archive import Archiver
+from returns import Returns
+from checkout_commit import CheckoutCommit
+from data_access import InventorySystem, DataLayer
+
+
+class RefundFrequencyTest(unittest.TestCase):
+    """A refund takes its amount off a customer's spend but is not another visit, live or archived."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="grocery_rfm_test_")
+        self.loyalty_db = os.path.join(self.work_dir, "loyalty.db")
+        self.inventory = InventorySystem(os.path.join(self.work_dir, "inventory.db"))
+        self.data_layer = DataLayer(self.loyalty_db)
+        self.data_layer.conn.executemany("INSERT INTO Customer (FirstName, TotalPoints) VALUES (?, 0)", [("A",), ("B",)])
+        self.data_layer.conn.commit()
+        product_id = self.inventory.conn.execute("SELECT product_id FROM inventory LIMIT 1").fetchone()[0]
+        sale = CheckoutCommit(self.inventory.conn, self.loyalty_db)
+        for customer_id in (1, 2):
+            sale.commit([(product_id, "", 4, 250)], 1000, f"basket-{customer_id}", customer_id)
+        Returns(self.inventory.conn, self.loyalty_db).refund("basket-1", [(product_id, 2)])
+
+    def tearDown(self):
+        self.inventory.close_connection()
+        self.data_layer.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def segments(self):
+        rfm.run(self.loyalty_db, date.today().isoformat(), workers=1, chunk_size=1000)
+        return dict((customer_id, (frequency, monetary)) for customer_id, frequency, monetary in self.data_layer.conn.execute(
+            "SELECT CustomerID, Frequency, MonetaryPence FROM CustomerSegment"))
+
+    def test_refund_is_not_a_visit(self):
+        self.assertEqual(self.segments(), {1: (1, 500), 2: (1, 1000)})
+
+    def test_archived_refund_is_not_a_visit(self):
+        Archiver(self.data_layer.conn, os.path.join(self.work_dir, "archive")).archive("9999-12-31")
+        self.assertEqual(self.data_layer.conn.execute("SELECT COUNT(*) FROM Transactions").fetchone()[0], 0)
+        self.assertEqual(self.segments(), {1: (1, 500), 2: (1, 1000)})
+
+
+if __name__ == "__main__":
+    unittest.main()